@@ -1,6 +1,11 @@
-try:
-    from pyhydllp import hydllp, util, sql
-except ImportError:
-    from pyhydllp import hydllp, util
 from pyhydllp.hyd import hyd
 
+## The submodules pull in pandas and pdsql, so only import them when first accessed
+_submodules = ['hydllp', 'util', 'sql', 'base', 'combo', 'catalog', 'dataset', 'planner', 'cache', 'bridge', 'shm', 'profiler', 'cli', 'replay', 'synthetic']
+
+
+def __getattr__(name):
+    if name in _submodules:
+        import importlib
+        return importlib.import_module('pyhydllp.' + name)
+    raise AttributeError("module 'pyhydllp' has no attribute '" + name + "'")
@@ -4,15 +4,19 @@ Created on Sat Mar 24 17:38:18 2018
 
 @author: michaelek
 """
+import contextlib
+import threading
+from collections import deque
 import numpy as np
 import pandas as pd
 from datetime import date
 from pyhydllp import util, hydllp
+from pyhydllp.profiler import stage as profiler_stage
 
 
-def get_ts_blockinfo(self, sites, datasources=['A'], variables=['100', '10', '110', '140', '130', '143', '450'], start='1900-01-01', end='2100-01-01', from_mod_date='1900-01-01', to_mod_date='2100-01-01'):
+def get_ts_blockinfo(self, sites, datasources=['A'], variables=['100', '10', '110', '140', '130', '143', '450'], start='1900-01-01', end='2100-01-01', from_mod_date='1900-01-01', to_mod_date='2100-01-01', sites_chunk=500, mod_days_chunk=None, threads=1):
     """
-    Wrapper function to extract info about when data has changed between modification dates.
+    Wrapper function to extract info about when data has changed between modification dates. Large requests are split into chunks by sites and modification date span and can be run in parallel.
 
     Parameters
     ----------
@@ -30,6 +34,12 @@ def get_ts_blockinfo(self, sites, datasources=['A'], variables=['100', '10', '11
         The starting date of the modification.
     to_mod_date : str
         The ending date of the modification.
+    sites_chunk : int
+        Number of sites to request to hydllp at one time.
+    mod_days_chunk : int or None
+        Number of days of the modification date range to request to hydllp at one time. None will request the entire range at once.
+    threads : int
+        Number of parallel Hydstra sessions to run the chunks in.
 
     Returns
     -------
@@ -37,15 +47,43 @@ def get_ts_blockinfo(self, sites, datasources=['A'], variables=['100', '10', '11
         With site, data_source, varto, from_mod_date, and to_mod_date.
     """
     ### Process sites
-    sites1 = util.select_sites(sites).tolist()
+    sites1 = util.select_sites(sites)
+    n_chunks = max(np.ceil(len(sites1) / float(sites_chunk)), 1)
+    sites2 = [i.tolist() for i in np.array_split(sites1, n_chunks)]
+
+    ### Process modification dates
+    from_mod_date1 = pd.Timestamp(from_mod_date)
+    to_mod_date1 = pd.Timestamp(to_mod_date)
+    if isinstance(mod_days_chunk, int):
+        breaks = list(pd.date_range(from_mod_date1, to_mod_date1, freq=str(mod_days_chunk) + 'D'))
+        if breaks and (breaks[-1] < to_mod_date1):
+            breaks.append(to_mod_date1)
+        mod_dates = list(zip(breaks[:-1], breaks[1:]))
+        if not mod_dates:
+            mod_dates = [(from_mod_date1, to_mod_date1)]
+    else:
+        mod_dates = [(from_mod_date1, to_mod_date1)]
+
+    chunks = [(s, m) for s in sites2 for m in mod_dates]
+
+    def blockinfo(h, chunk):
+        return h.get_ts_blockinfo(chunk[0], start=start, end=end, datasources=datasources, variables=variables, from_mod_date=chunk[1][0], to_mod_date=chunk[1][1], sort=False)
 
     ### Extract data
-    with hydllp.openHyDb(self.hydllp) as h:
-        df = h.get_ts_blockinfo(sites1, start=start, end=end, datasources=datasources, variables=variables, from_mod_date=from_mod_date, to_mod_date=to_mod_date)
+    dfs = hydllp.map_sessions(self.hydllp, blockinfo, chunks, threads)
+
+    dfs = [df for df in dfs if not df.empty]
+    if not dfs:
+        return pd.DataFrame()
+    df = pd.concat(dfs)
+    if len(mod_dates) > 1:
+        df = df.drop_duplicates()
+    df = df.sort_values(['site', 'varto', 'from_mod_date']).reset_index(drop=True)
+
     return df
 
 
-def ts_data_changes(self, varto, sites, data_source='A', from_mod_date=None, to_mod_date=None):
+def ts_data_changes(self, varto, sites, data_source='A', from_mod_date=None, to_mod_date=None, threads=1, site_files_path=None):
     """
     Function to determine the time series data indexed by sites and variables that have changed between the from_mod_date and to_mod_date. For non-flow rating sites/variables!!!
 
@@ -61,6 +99,10 @@ def ts_data_changes(self, varto, sites, data_source='A', from_mod_date=None, to_
         The starting date when the data has been modified.
     to_mod_date: str
         The ending date when the data has been modified.
+    threads : int
+        Number of parallel Hydstra sessions to run the blockinfo requests in.
+    site_files_path : str or None
+        Path to the Hydstra ts data (.A) files. If given, sites whose archive files have not been modified since the from_mod_date are removed before the blockinfo requests (see util.site_mod_time). Sites without an archive file are always requested.
 
     Returns
     -------
@@ -76,7 +118,18 @@ def ts_data_changes(self, varto, sites, data_source='A', from_mod_date=None, to_
             to_mod_date1 = pd.Timestamp(to_mod_date)
         else:
             to_mod_date1 = today1
-        blocklist = self.get_ts_blockinfo(sites, [data_source], variables=varto, from_mod_date=from_mod_date1, to_mod_date=to_mod_date1)
+
+        ## Remove the sites with untouched archive files - optional
+        if isinstance(site_files_path, str):
+            sites = [str(s) for s in util.select_sites(sites)]
+            mod_times = util.site_mod_time(site_files_path, sites)
+            ## The file mod times are in GMT, so allow for the time zone offset
+            old_files = set(mod_times.loc[mod_times.mod_time < (from_mod_date1 - pd.Timedelta(days=1)), 'site'])
+            sites = [s for s in sites if s.replace('/', '_') not in old_files]
+            if not sites:
+                return pd.DataFrame()
+
+        blocklist = self.get_ts_blockinfo(sites, [data_source], variables=varto, from_mod_date=from_mod_date1, to_mod_date=to_mod_date1, threads=threads)
         if blocklist.empty:
             return blocklist
         else:
@@ -112,7 +165,7 @@ def get_variable_list(self, sites, data_source='A'):
     return df
 
 
-def get_ts_data(self, sites, start=0, end=0, datasource='A', data_type='mean', varfrom=100, varto=140, qual_codes=None, interval='day', multiplier=1, report_time=None, sites_chunk=20, print_sites=False, export_path=None):
+def get_ts_data(self, sites, start=0, end=0, datasource='A', data_type='mean', varfrom=100, varto=140, qual_codes=None, interval='day', multiplier=1, report_time=None, sites_chunk=20, print_sites=False, export_path=None, local_resample=False, concat_data=True, processes=1, profiler=None):
     """
     Wrapper function over hydllp to read in data from Hydstra's database. Must be run in a 32bit python. If either start_time or end_time is not 0, then they both need a date.
 
@@ -144,29 +197,255 @@ def get_ts_data(self, sites, start=0, end=0, datasource='A', data_type='mean', v
         Specifying the report_time as “end” will cause the time output with aggregated values for mean, total, and partial total data types to be the end of the period instead of the start.
     print_sites : bool
         print site names as they are extracted.
+    export_path : str or None
+        Path to a csv, h5, or parquet file. Each chunk of sites is appended to the file as it is extracted (see util.ts_writer).
+    local_resample : bool
+        If the hyd object has a ts_cache, should the data be resampled locally from cached finer interval data when available? Only for the data_types mean, tot, max, min, first, and last (see util.resample_ts). Only finer data extracted without qual_codes is used, since the quality codes are filtered after the aggregation like on the server. The finer data must cover the whole periods that the request overlaps, otherwise the data is extracted from the server.
+    concat_data : bool
+        Should the extracted data be kept and returned? Set to False with an export_path to export more data than fits in memory.
+    processes : int
+        Number of processes to extract the site chunks in. Each process has its own Hydstra login and hands its data back via shared memory (see pyhydllp.shm).
+    profiler : Profiler or None
+        A profiler to record the timings of the stages (see pyhydllp.profiler).
 
     Return
     ------
-    DataFrame
-        In long format with site and time as a MultiIndex.
+    DataFrame or None
+        In long format with site and time as a MultiIndex. None if concat_data is False.
     """
 
     ### Process sites into workable chunks
     sites1 = util.select_sites(sites)
+    site_itemsize = max([len(str(s)) for s in sites1] + [1])
+
+    ### Use the cached data - optional
+    cache = self.ts_cache
+    if cache is not None:
+        with profiler_stage(profiler, 'cache'):
+            sites_list = [str(s) for s in sites1]
+            key = cache.make_key(datasource, data_type, varfrom, varto, interval, multiplier, qual_codes, report_time)
+            data = cache.get(key, sites_list, start, end)
+            if (data is None) and local_resample and (data_type in ['mean', 'tot', 'max', 'min', 'first', 'last']):
+                ## Hydstra aggregates before the quality codes are filtered, so the finer data must be unfiltered
+                fine_key = cache.make_key(datasource, data_type, varfrom, varto, interval, multiplier, None, None)
+                fine_data = cache.get_finer(fine_key, sites_list, start, end)
+                if fine_data is not None:
+                    data = util.resample_ts(fine_data, interval, multiplier, data_type, report_time)
+                    if isinstance(qual_codes, list):
+                        data = data[data.qual_code.isin(qual_codes)]
+        if data is not None:
+            if isinstance(export_path, str):
+                with profiler_stage(profiler, 'export'), util.ts_writer(export_path, site_itemsize=site_itemsize) as writer:
+                    writer.write(data)
+            if not concat_data:
+                return None
+            return data
+
     n_chunks = np.ceil(len(sites1) / float(sites_chunk))
     sites2 = np.array_split(sites1, n_chunks)
 
     ### Run instance of hydllp
-    data = pd.DataFrame()
-    with hydllp.openHyDb(self.hydllp) as h:
-        for i in sites2:
-            if print_sites:
-                print(i)
-            ### extract data
-            df = h.get_ts_traces(site_list=list(i), start=start, end=end, datasource=datasource, data_type=data_type, varfrom=varfrom, varto=varto, interval=interval, multiplier=multiplier, qual_codes=qual_codes, report_time=report_time)
-            data = pd.concat([data, df])
-
-    if isinstance(export_path, str):
-        util.save_df(data, export_path)
+    dfs = []
+    with contextlib.ExitStack() as stack:
+        if isinstance(export_path, str):
+            writer = stack.enter_context(util.ts_writer(export_path, site_itemsize=site_itemsize))
+        else:
+            writer = None
+        if (processes > 1) and (len(sites2) > 1):
+            from pyhydllp import shm
+            with profiler_stage(profiler, 'get_ts_traces_processes'):
+                df = shm.get_ts_traces_processes(self.hydllp, [list(i) for i in sites2], processes, start=start, end=end, datasource=datasource, data_type=data_type, varfrom=varfrom, varto=varto, interval=interval, multiplier=multiplier, qual_codes=qual_codes, report_time=report_time)
+            if writer is not None:
+                with profiler_stage(profiler, 'export'):
+                    writer.write(df)
+            dfs.append(df)
+        else:
+            with profiler_stage(profiler, 'login'):
+                h = stack.enter_context(hydllp.openHyDb(self.hydllp))
+            for i in sites2:
+                if print_sites:
+                    print(i)
+                site_str = ','.join([str(s) for s in i])
+                ### extract data
+                with profiler_stage(profiler, 'get_ts_traces', site_str, h):
+                    df = h.get_ts_traces(site_list=list(i), start=start, end=end, datasource=datasource, data_type=data_type, varfrom=varfrom, varto=varto, interval=interval, multiplier=multiplier, qual_codes=qual_codes, report_time=report_time)
+                if writer is not None:
+                    with profiler_stage(profiler, 'export', site_str):
+                        writer.write(df)
+                if concat_data:
+                    dfs.append(df)
+
+    if not concat_data:
+        return None
+
+    with profiler_stage(profiler, 'concat'):
+        data = pd.concat(dfs)
+
+    if cache is not None:
+        cache.put(key, sites_list, start, end, data)
+
+    return data
+
+
+def iter_ts_data(self, sites, start=0, end=0, datasource='A', data_type='mean', varfrom=100, varto=140, qual_codes=None, interval='day', multiplier=1, report_time=None, sites_chunk=20, lookahead=2, max_bytes=None):
+    """
+    Generator to extract the time series data one chunk of sites at a time. The next chunks are prefetched in a background thread while the caller processes the current chunk. The parameters are the same as get_ts_data.
+
+    Parameters
+    ----------
+    sites : list, array, one column csv file, or dataframe
+        Site numbers.
+    start : str or int of 0
+        The start time in the format of either '2001-01-01' or 0 (for all data).
+    end : str or int of 0
+        Same formatting as start.
+    datasource : str
+        Hydstra datasource code (usually 'A').
+    data_type : str
+        mean, maxmin, max, min, start, end, first, last, tot, point, partialtot, or cum.
+    varfrom : int or float
+        The hydstra source data variable (100.00 is water level).
+    varto : int or float
+        The hydstra conversion data variable (140.00 is flow).
+    qual_codes : list of int or None
+        The quality codes in Hydstra for filtering the data.
+    interval : str
+        The frequency of the output data (year, month, day, hour, minute, second, period).
+    multiplier : int
+        interval frequency.
+    report_time : start or end
+        The time reported for the aggregated values.
+    sites_chunk : int
+        Number of sites to request to hydllp at one time.
+    lookahead : int
+        The max number of chunks to prefetch.
+    max_bytes : int or None
+        The max memory in bytes of the prefetched chunks. One chunk is always prefetched when none are waiting. None for no limit.
+
+    Return
+    ------
+    Generator of DataFrame
+        In long format with site and time as a MultiIndex.
+    """
+    ### Process sites into workable chunks
+    sites1 = util.select_sites(sites)
+    n_chunks = np.ceil(len(sites1) / float(sites_chunk))
+    sites2 = np.array_split(sites1, n_chunks)
+
+    state = {'queue': deque(), 'bytes': 0, 'done': False, 'stop': False, 'error': None}
+    cond = threading.Condition()
+
+    def ready():
+        if state['stop'] or not state['queue']:
+            return True
+        return (len(state['queue']) < lookahead) and ((max_bytes is None) or (state['bytes'] < max_bytes))
+
+    def fetch():
+        try:
+            with hydllp.openHyDb(self.hydllp) as h:
+                for i in sites2:
+                    with cond:
+                        cond.wait_for(ready)
+                        if state['stop']:
+                            return
+                    df = h.get_ts_traces(site_list=list(i), start=start, end=end, datasource=datasource, data_type=data_type, varfrom=varfrom, varto=varto, interval=interval, multiplier=multiplier, qual_codes=qual_codes, report_time=report_time)
+                    n_bytes = int(df.memory_usage(index=True).sum())
+                    with cond:
+                        state['queue'].append((df, n_bytes))
+                        state['bytes'] += n_bytes
+                        cond.notify_all()
+        except Exception as err:
+            state['error'] = err
+        finally:
+            with cond:
+                state['done'] = True
+                cond.notify_all()
+
+    thread = threading.Thread(target=fetch, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            with cond:
+                cond.wait_for(lambda: state['queue'] or state['done'])
+                if state['queue']:
+                    df, n_bytes = state['queue'].popleft()
+                    state['bytes'] -= n_bytes
+                    cond.notify_all()
+                elif state['error'] is not None:
+                    raise state['error']
+                else:
+                    break
+            yield df
+    finally:
+        with cond:
+            state['stop'] = True
+            cond.notify_all()
+        thread.join()
+
+
+def get_ts_data_multi(self, sites, var_specs, start=0, end=0, datasource='A', qual_codes=None, interval='day', multiplier=1, report_time=None, sites_chunk=20, threads=1):
+    """
+    Function to extract several variables for the same sites in one call. The requests for all variables are interleaved within one login (or a pool of sessions with threads > 1) and identical variable specs are only requested once. Each distinct spec is its own get_ts_traces request, since a request only takes one varfrom, varto, and data_type.
+
+    Parameters
+    ----------
+    sites : list, array, one column csv file, or dataframe
+        Site numbers.
+    var_specs : list of tuple
+        The (varfrom, varto, data_type) of each variable (e.g. [(100, 140, 'mean'), (100, 140, 'max'), (10, 10, 'tot')]). Each varto and data_type combination must only have one varfrom.
+    start : str or int of 0
+        The start time in the format of either '2001-01-01' or 0 (for all data).
+    end : str or int of 0
+        Same formatting as start.
+    datasource : str
+        Hydstra datasource code (usually 'A').
+    qual_codes : list of int or None
+        The quality codes in Hydstra for filtering the data.
+    interval : str
+        The frequency of the output data (year, month, day, hour, minute, second, period).
+    multiplier : int
+        interval frequency.
+    report_time : start or end
+        Specifying the report_time as "end" will cause the time output with aggregated values for mean, total, and partial total data types to be the end of the period instead of the start.
+    sites_chunk : int
+        Number of sites to request to hydllp at one time.
+    threads : int
+        Number of parallel Hydstra sessions.
+
+    Return
+    ------
+    DataFrame
+        In long format with site, variable (the varto), data_type, and time as a MultiIndex.
+    """
+    ### Process the variable specs
+    specs = []
+    for spec in var_specs:
+        spec1 = (spec[0], spec[1], spec[2])
+        if spec1 not in specs:
+            specs.append(spec1)
+    var_types = [s[1:] for s in specs]
+    if len(set(var_types)) < len(var_types):
+        raise ValueError('Each varto and data_type combination in var_specs must only have one varfrom')
+
+    ### Process sites into workable chunks
+    sites1 = util.select_sites(sites)
+    n_chunks = max(np.ceil(len(sites1) / float(sites_chunk)), 1)
+    sites2 = [i.tolist() for i in np.array_split(sites1, n_chunks)]
+
+    tasks = [(s, spec) for s in sites2 for spec in specs]
+
+    def traces(h, task):
+        site_list, (varfrom, varto, data_type) = task
+        df = h.get_ts_traces(site_list=site_list, start=start, end=end, datasource=datasource, data_type=data_type, varfrom=varfrom, varto=varto, interval=interval, multiplier=multiplier, qual_codes=qual_codes, report_time=report_time)
+        df = df.reset_index()
+        df['variable'] = varto
+        df['data_type'] = data_type
+        return df
+
+    ### Extract data
+    dfs = hydllp.map_sessions(self.hydllp, traces, tasks, threads)
+
+    data = pd.concat(dfs).set_index(['site', 'variable', 'data_type', 'time']).sort_index()
 
     return data
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Bridge to run the hydllp.dll in a separate worker process. The hydllp.dll is 32bit, so the worker runs in a 32bit python environment while the client (and all of the data processing) can run in a 64bit python environment.
+
+The client and worker talk over the stdin and stdout pipes of the worker. Each message is a frame of a 5 byte header (the message type as an unsigned char and the payload length as a little-endian unsigned int) followed by the payload. The requests and responses of query_by_dict are passed as json bytes. The worker passes the JsonCall responses on without decoding them (see Hydllp._query_raw), so they are only decoded once by the client.
+
+The worker is started as:
+
+    python -m pyhydllp.bridge --backend pyhydllp.hydllp:Hydllp
+"""
+import os
+import sys
+import struct
+import time
+import threading
+import subprocess
+import argparse
+import importlib
+from pyhydllp.hydllp import Hydllp, HydstraError, HydstraErrorUnknown, get_json_codec
+
+### Message types
+INIT = 1
+LOGIN = 2
+LOGOUT = 3
+CALL = 4
+CLOSE = 5
+OK = 10
+ERROR = 11
+
+_header = struct.Struct('<BI')
+
+_errors = {'HydstraError': HydstraError, 'HydstraErrorUnknown': HydstraErrorUnknown}
+
+
+def write_frame(stream, msg_type, payload=b''):
+    """
+    Write a message frame to a binary stream.
+    """
+    stream.write(_header.pack(msg_type, len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def _read_exact(stream, n):
+    chunks = []
+    while n > 0:
+        b = stream.read(n)
+        if not b:
+            raise EOFError('The pipe was closed')
+        chunks.append(b)
+        n -= len(b)
+    return b''.join(chunks)
+
+
+def read_frame(stream):
+    """
+    Read a message frame from a binary stream.
+
+    Returns
+    -------
+    tuple
+        Of (msg_type, payload).
+    """
+    msg_type, n = _header.unpack(_read_exact(stream, _header.size))
+    return msg_type, _read_exact(stream, n)
+
+
+def _encode(dumps, obj):
+    b = dumps(obj)
+    if not isinstance(b, bytes):
+        b = b.encode('utf-8')
+    return b
+
+
+def _import_backend(backend):
+    module, name = backend.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+############################################
+### Worker
+
+
+def run_worker(backend='pyhydllp.hydllp:Hydllp', json_codec='auto', stdin=None, stdout=None):
+    """
+    Function to run the worker loop. The worker owns the backend Hydllp object and handles the requests from the client until the CLOSE message or the end of the pipe.
+
+    Parameters
+    ----------
+    backend : str
+        The backend class as 'module:class'. The class must be initialised with the Hydllp parameters and have the login, logout, and query_by_dict methods. If it also has the _query_raw method (like Hydllp), the responses are passed on without decoding them.
+    json_codec : str
+        The json codec used to encode the responses.
+    stdin : binary stream or None
+        The stream to read the requests from. None is the stdin of the process.
+    stdout : binary stream or None
+        The stream to write the responses to. None is the stdout of the process.
+    """
+    if stdin is None:
+        stdin = sys.stdin.buffer
+    if stdout is None:
+        # Anything printed (e.g. by query_by_dict) must not end up in the pipe
+        stdout = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        sys.stdout = sys.stderr
+
+    backend_class = _import_backend(backend)
+    dumps, loads = get_json_codec(json_codec)[1:]
+    h = None
+
+    while True:
+        try:
+            msg_type, payload = read_frame(stdin)
+        except EOFError:
+            break
+        try:
+            if msg_type == CALL:
+                # The response bytes are passed on as they are and only decoded by the client
+                if hasattr(h, '_query_raw'):
+                    out = h._query_raw(payload)
+                else:
+                    out = _encode(dumps, h.query_by_dict(loads(memoryview(payload))))
+            elif msg_type == INIT:
+                h = backend_class(**loads(memoryview(payload)))
+                out = b''
+            elif msg_type == LOGIN:
+                h.login(**loads(memoryview(payload)))
+                out = b''
+            elif msg_type == LOGOUT:
+                h.logout()
+                out = b''
+            elif msg_type == CLOSE:
+                write_frame(stdout, OK)
+                break
+            else:
+                raise HydstraErrorUnknown('Unknown message type: ' + str(msg_type))
+            write_frame(stdout, OK, out)
+        except Exception as err:
+            write_frame(stdout, ERROR, _encode(dumps, {'type': type(err).__name__, 'msg': str(err)}))
+
+    stdout.close()
+
+
+############################################
+### Client
+
+
+class HydllpBridge(Hydllp):
+    """
+    Hydllp object that runs the hydllp.dll in a worker process (see the module docstring). All of the Hydllp methods can be used as normal.
+
+    Parameters
+    ----------
+    ini_path : str
+        Path to the Hyaccess.ini file.
+    dll_path : str
+        Path to the hydllp.dll file.
+    hydllp_filename : str
+        The hydllp file name.
+    hyaccess_filename : str
+        The hyaccess file name.
+    hyconfig_filename : str
+        The hyconfig file name.
+    username : str
+        The login username for Hydstra.
+    password : str
+        Same as username, but for password.
+    json_codec : str
+        The json codec used by the client (orjson, ujson, simdjson, json, or auto). The worker uses the fastest one installed in its environment.
+    single_flight : bool
+        Should concurrent identical requests share one call (see Hydllp.query_by_dict)?
+    python_exe : str or None
+        The (32bit) python executable for the worker. None uses the current python executable.
+    backend : str
+        The backend class of the worker as 'module:class'.
+
+    Returns
+    -------
+    HydllpBridge object
+    """
+    def __init__(self, ini_path, dll_path, hydllp_filename='hydllp.dll', hyaccess_filename='Hyaccess.ini', hyconfig_filename='HYCONFIG.INI', username='', password='', json_codec='auto', single_flight=False, python_exe=None, backend='pyhydllp.hydllp:Hydllp'):
+
+        init_kwargs = dict(ini_path=ini_path, dll_path=dll_path, hydllp_filename=hydllp_filename, hyaccess_filename=hyaccess_filename, hyconfig_filename=hyconfig_filename, username=username, password=password, json_codec=json_codec, single_flight=single_flight, python_exe=python_exe, backend=backend)
+        self._init_common(init_kwargs, username, password, json_codec, single_flight, (backend, ini_path, hyaccess_filename, hyconfig_filename))
+
+        self._lock = threading.Lock()
+
+        if python_exe is None:
+            python_exe = sys.executable
+
+        # Make sure the worker can import this version of pyhydllp
+        env = os.environ.copy()
+        package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([package_path] + [p for p in [env.get('PYTHONPATH')] if p])
+
+        # The worker runs in the dll directory in case the dll needs files relative to the working directory
+        # Only the working directory of the worker process is changed, so the paths are made absolute first
+        dll_kwargs = {k: v for k, v in self._init_kwargs.items() if k not in ['python_exe', 'backend', 'single_flight']}
+        for k in ['ini_path', 'dll_path']:
+            if isinstance(dll_kwargs[k], str):
+                dll_kwargs[k] = os.path.abspath(dll_kwargs[k])
+        dll_kwargs['json_codec'] = 'auto'
+
+        # The worker python environment may have different json codecs installed
+        self._worker = subprocess.Popen([python_exe, '-m', 'pyhydllp.bridge', '--backend', backend], stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, cwd=dll_kwargs['dll_path'])
+
+        self._request(INIT, _encode(self._json_dumps, dll_kwargs))
+
+    def _request(self, msg_type, payload=b''):
+        """
+        Send a message to the worker and wait for the response.
+
+        Returns
+        -------
+        bytes
+            The payload of the response.
+        """
+        with self._lock:
+            if self._worker.poll() is not None:
+                raise HydstraError('The hydllp worker process has stopped')
+            try:
+                write_frame(self._worker.stdin, msg_type, payload)
+                res_type, res = read_frame(self._worker.stdout)
+            except (EOFError, OSError):
+                raise HydstraError('The hydllp worker process has stopped')
+
+        if res_type == ERROR:
+            err = self._json_loads(memoryview(res))
+            raise _errors.get(err['type'], HydstraErrorUnknown)(err['msg'])
+
+        return res
+
+    def login(self, username=None, password=None):
+        """
+        Logs into hydstra in the worker.
+
+        Parameters:
+        -----------
+        username : str
+            Hydstra username
+
+        passwords : str
+            Hydstra password
+
+        """
+        self._request(LOGIN, _encode(self._json_dumps, {'username': username, 'password': password}))
+        self._identity = username if isinstance(username, str) else self._username
+        self._logged_in = True
+
+    def logout(self):
+        """
+        Log out of hydstra in the worker.
+        """
+        if self._logged_in:
+            self._request(LOGOUT)
+            self._logged_in = False
+
+    def _query_by_dict(self, request_dict):
+        """
+        Sends and receives request to the hydstra server via the worker.
+        """
+        t1 = time.perf_counter()
+        request_json = _encode(self._json_dumps, request_dict)
+        t2 = time.perf_counter()
+        res = self._request(CALL, request_json)
+        t3 = time.perf_counter()
+        result_dict = self._json_loads(memoryview(res))
+        t4 = time.perf_counter()
+        self._check_result(result_dict)
+
+        stats = self.call_stats
+        stats['calls'] += 1
+        stats['bytes_sent'] += len(request_json)
+        stats['bytes_received'] += len(res)
+        stats['encode_time'] += t2 - t1
+        stats['call_time'] += t3 - t2
+        stats['decode_time'] += t4 - t3
+
+        return result_dict
+
+    def close(self):
+        """
+        Stop the worker process.
+        """
+        super(HydllpBridge, self).close()
+        if self._worker.poll() is None:
+            try:
+                self._request(CLOSE)
+            except HydstraError:
+                pass
+            self._worker.stdin.close()
+            self._worker.wait()
+            self._worker.stdout.close()
+
+############################################
+### Main
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a hydllp bridge worker on the stdin and stdout pipes.')
+    parser.add_argument('--backend', default='pyhydllp.hydllp:Hydllp', help="The backend class as 'module:class'.")
+    parser.add_argument('--json-codec', default='auto', help='The json codec used to encode the responses.')
+    args = parser.parse_args()
+
+    run_worker(args.backend, args.json_codec)
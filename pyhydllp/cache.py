@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory cache of extracted time series data.
+"""
+import threading
+import pandas as pd
+from pyhydllp import util
+from pyhydllp.planner import _align_window, interval_gap
+
+## The intervals from finest to coarsest
+intervals = ['second', 'minute', 'hour', 'day', 'month', 'year']
+
+
+class TsCache(object):
+    """
+    Class to cache the outputs of get_ts_data. Cached data is reused when a later request is covered by the sites and time range of an earlier one. Coarser intervals can also be derived from cached finer interval data (see util.resample_ts).
+
+    Parameters
+    ----------
+    max_entries : int
+        The max number of cached extractions. The oldest are dropped first.
+
+    Returns
+    -------
+    TsCache object
+    """
+    def __init__(self, max_entries=50):
+        self.max_entries = max_entries
+        self._entries = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(datasource, data_type, varfrom, varto, interval, multiplier, qual_codes, report_time):
+        """
+        Create the cache key of a request.
+        """
+        if isinstance(qual_codes, list):
+            qual_codes = tuple(sorted(qual_codes))
+        return (datasource, data_type, varfrom, varto, interval, multiplier, qual_codes, report_time)
+
+    @staticmethod
+    def _covers(entry, sites, start, end):
+        if not set(sites).issubset(entry['sites']):
+            return False
+        if (entry['start'] is not None) and ((start is None) or (start < entry['start'])):
+            return False
+        if (entry['end'] is not None) and ((end is None) or (end > entry['end'])):
+            return False
+        return True
+
+    @staticmethod
+    def _slice(data, sites, start, end):
+        sites1 = data.index.get_level_values('site')
+        times1 = data.index.get_level_values('time')
+        mask = sites1.isin(sites)
+        if start is not None:
+            mask = mask & (times1 >= start)
+        if end is not None:
+            mask = mask & (times1 <= end)
+        return data[mask]
+
+    @staticmethod
+    def _slice_periods(data, sites, start, end, report_time):
+        """
+        Slice aggregated data to the periods of an aligned (half open) window. The times are the start of the periods or the end with report_time 'end'.
+        """
+        sites1 = data.index.get_level_values('site')
+        times1 = data.index.get_level_values('time')
+        mask = sites1.isin(sites)
+        if report_time == 'end':
+            if start is not None:
+                mask = mask & (times1 > start)
+            if end is not None:
+                mask = mask & (times1 <= end)
+        else:
+            if start is not None:
+                mask = mask & (times1 >= start)
+            if end is not None:
+                mask = mask & (times1 < end)
+        return data[mask]
+
+    def put(self, key, sites, start, end, data):
+        """
+        Add extracted data to the cache.
+
+        Parameters
+        ----------
+        key : tuple
+            From make_key.
+        sites : list of str
+            The requested sites.
+        start : str, int of 0, or Timestamp
+            The requested start time.
+        end : str, int of 0, or Timestamp
+            The requested end time.
+        data : DataFrame
+            The output of get_ts_data.
+        """
+        entry = {'key': key, 'sites': set([str(s) for s in sites]), 'start': util.time_bound(start), 'end': util.time_bound(end), 'data': data}
+        with self._lock:
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                self._entries.pop(0)
+
+    def get(self, key, sites, start, end):
+        """
+        Get cached data that covers the request. Aggregated data is sliced to the whole periods that the request overlaps, like Hydstra returns them.
+
+        Returns
+        -------
+        DataFrame or None
+        """
+        sites1 = [str(s) for s in sites]
+        start1 = util.time_bound(start)
+        end1 = util.time_bound(end)
+        with self._lock:
+            entries = [e for e in self._entries if (e['key'] == key) and self._covers(e, sites1, start1, end1)]
+        if not entries:
+            return None
+        start2, end2, aligned = _align_window(start1, end1, key[1], key[4], key[5])
+        if aligned:
+            return self._slice_periods(entries[-1]['data'], sites1, start2, end2, key[7])
+        return self._slice(entries[-1]['data'], sites1, start1, end1)
+
+    def get_finer(self, key, sites, start, end):
+        """
+        Get cached data with a finer interval (and a multiplier of 1) that covers the request and can be resampled to the interval of the key. Like Hydstra, the request gets the whole periods of the interval that it overlaps, so the finer data must cover all of them (from the start of the first period to the last finer time before the end of the last period). The returned data is sliced to those periods.
+
+        Returns
+        -------
+        DataFrame or None
+        """
+        interval = key[4]
+        if interval not in intervals:
+            return None
+        finer = intervals[:intervals.index(interval)]
+        keys = [key[:4] + (i, 1) + key[6:] for i in finer]
+
+        sites1 = [str(s) for s in sites]
+        start1, end1, _ = _align_window(util.time_bound(start), util.time_bound(end), key[1], interval, key[5])
+
+        ## The last finer time of the periods per finer interval
+        end2 = {}
+        for i in finer:
+            end2[i] = None if end1 is None else end1 - pd.DateOffset(**{interval_gap[i]: 1})
+
+        with self._lock:
+            entries = [e for e in self._entries if (e['key'] in keys) and self._covers(e, sites1, start1, end2[e['key'][4]])]
+        if not entries:
+            return None
+        ## Prefer the coarsest of the finer intervals
+        entry = max(entries, key=lambda e: intervals.index(e['key'][4]))
+        return self._slice(entry['data'], sites1, start1, end2[entry['key'][4]])
+
+    def clear(self):
+        """
+        Remove all cached data.
+        """
+        with self._lock:
+            self._entries = []
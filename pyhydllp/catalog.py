@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent catalog of the Hydstra sites, variable periods, and rating relationships used to plan the bulk extractions.
+"""
+import sqlite3
+import threading
+import pandas as pd
+from pyhydllp import sql
+
+
+class SiteCatalog(object):
+    """
+    Class to store the Hydstra sites/variables (from the PERIOD table) and the variable periods (from get_variable_list) in an SQLite file. The catalog is refreshed incrementally so that only new sites and sites with modified data are requested from Hydstra. The connection can be shared between threads; the catalog reads and writes are serialised with a lock.
+
+    Parameters
+    ----------
+    path : str
+        Path to the SQLite catalog file. It will be created if it does not exist.
+    data_source : str
+        Hydstra datasource code (usually 'A'). It's saved in the catalog file, so an existing catalog must have the same data_source.
+    max_age : str, Timedelta, or None
+        The age of the catalog after which it should be refreshed (e.g. '1D'). None will only refresh an empty catalog.
+
+    Returns
+    -------
+    SiteCatalog object
+    """
+    def __init__(self, path, data_source='A', max_age='1D'):
+        self.path = path
+        self.data_source = data_source
+        if max_age is None:
+            self.max_age = None
+        else:
+            self.max_age = pd.Timedelta(max_age)
+
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._create_tables()
+
+        ### Check that the catalog is of the same data source
+        data_source0 = self._get_meta('data_source')
+        if data_source0 is None:
+            self._set_meta(data_source=data_source)
+        elif data_source0 != data_source:
+            self._con.close()
+            raise ValueError('The catalog ' + path + ' is of the data_source ' + data_source0 + ' not ' + str(data_source))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _create_tables(self):
+        """
+        Create the catalog tables and indexes if they do not exist.
+        """
+        with self._lock, self._con:
+            self._con.execute('CREATE TABLE IF NOT EXISTS sites_var (site TEXT, varfrom INTEGER, varto INTEGER)')
+            self._con.execute('CREATE TABLE IF NOT EXISTS var_periods (site TEXT, varto INTEGER, var_name TEXT, units TEXT, from_date TEXT, to_date TEXT)')
+            self._con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._con.execute('CREATE INDEX IF NOT EXISTS sites_var_site ON sites_var (site)')
+            self._con.execute('CREATE INDEX IF NOT EXISTS sites_var_varto ON sites_var (varto)')
+            self._con.execute('CREATE INDEX IF NOT EXISTS var_periods_site ON var_periods (site)')
+            self._con.execute('CREATE INDEX IF NOT EXISTS var_periods_varto ON var_periods (varto)')
+
+    def _get_meta(self, key):
+        """
+        Read a value of the meta table or None if it's not set.
+        """
+        with self._lock:
+            row = self._con.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _set_meta(self, **kwargs):
+        """
+        Write values to the meta table.
+        """
+        with self._lock, self._con:
+            self._con.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [(k, str(v)) for k, v in kwargs.items()])
+
+    @property
+    def refreshed(self):
+        """
+        The time of the last refresh as a Timestamp or None if the catalog has never been refreshed.
+        """
+        value = self._get_meta('refreshed')
+        if value is None:
+            return None
+        return pd.Timestamp(value)
+
+    def is_stale(self):
+        """
+        Check if the catalog needs to be refreshed.
+
+        Returns
+        -------
+        bool
+        """
+        refreshed = self.refreshed
+        if refreshed is None:
+            return True
+        if self.max_age is None:
+            return False
+        return (pd.Timestamp.now() - refreshed) > self.max_age
+
+    def refresh(self, hyd, server, database, username=None, password=None, pool=None, full=False, threads=1):
+        """
+        Function to update the catalog. The sites/variables are re-read from the PERIOD table, but the variable periods are only requested from Hydstra for new sites and sites with data modified since the last refresh. The server and database are saved in the catalog with the first refresh and the later refreshes must be from the same ones, unless full is True (which rebuilds the catalog).
+
+        Parameters
+        ----------
+        hyd : hyd
+            An initialised hyd object.
+        server : str
+            The SQL server name.
+        database : str
+            The database name.
+        username : str or None
+            The SQL username. None will use a trusted connection.
+        password : str or None
+            Same as username, but for password.
+        pool : SqlPool or None
+            A shared SqlPool. None will open a new connection.
+        full : bool
+            Should all of the variable periods be requested regardless of the last refresh? A full refresh can change the server and database of the catalog.
+        threads : int
+            Number of parallel Hydstra sessions to run the blockinfo requests in.
+
+        Returns
+        -------
+        list of str
+            The sites that had their variable periods updated.
+        """
+        now1 = pd.Timestamp.now().floor('s')
+        refreshed = self.refreshed
+
+        ### Check that the catalog is of the same server and database
+        source0 = (self._get_meta('server'), self._get_meta('database'))
+        if (not full) and (refreshed is not None) and (source0 != (None, None)) and (source0 != (str(server), str(database))):
+            raise ValueError('The catalog is of the server/database ' + '/'.join(source0) + ', use full=True to rebuild it from ' + str(server) + '/' + str(database))
+
+        ### Sites and variables
+        sites_var = sql.sql_sites_var(server, database, varto=None, data_source=self.data_source, username=username, password=password, pool=pool)
+        sites_var = sites_var[['site', 'varfrom', 'varto']]
+        sites = sites_var.site.unique().tolist()
+
+        ### Determine the sites that need their periods updated
+        with self._lock:
+            old_sites = set(pd.read_sql('SELECT DISTINCT site FROM var_periods', self._con).site)
+        if full or (refreshed is None):
+            upd_sites = sites
+        else:
+            new_sites = [s for s in sites if s not in old_sites]
+            old_sites1 = [s for s in sites if s in old_sites]
+            varto_list = [str(v) for v in sites_var.varto.unique().tolist()]
+            if old_sites1:
+                blocks = hyd.get_ts_blockinfo(old_sites1, datasources=[self.data_source], variables=varto_list, from_mod_date=refreshed, to_mod_date=now1, threads=threads)
+            else:
+                blocks = pd.DataFrame()
+            if blocks.empty:
+                chg_sites = []
+            else:
+                chg_sites = blocks.site.astype(str).str.strip().unique().tolist()
+            upd_sites = new_sites + [s for s in chg_sites if s not in new_sites]
+
+        if upd_sites:
+            var_periods = hyd.get_variable_list(upd_sites, self.data_source)
+            var_periods = var_periods[['site', 'varto', 'var_name', 'units', 'from_date', 'to_date']]
+        else:
+            var_periods = pd.DataFrame(columns=['site', 'varto', 'var_name', 'units', 'from_date', 'to_date'])
+
+        ### Save
+        rem_sites = [s for s in old_sites if s not in set(sites)]
+        with self._lock, self._con:
+            self._con.execute('DELETE FROM sites_var')
+            sites_var.to_sql('sites_var', self._con, if_exists='append', index=False)
+            if full:
+                self._con.execute('DELETE FROM var_periods')
+            else:
+                self._con.executemany('DELETE FROM var_periods WHERE site = ?', [(s,) for s in rem_sites + upd_sites])
+            var_periods.to_sql('var_periods', self._con, if_exists='append', index=False)
+            self._set_meta(refreshed=now1, server=server, database=database)
+
+        return upd_sites
+
+    def query(self, varto=None, sites=None):
+        """
+        Function to read the sites/variables and their variable periods from the catalog.
+
+        Parameters
+        ----------
+        varto : int, list of int, or None
+            The hydstra conversion data variable (140.00 is flow). None returns all variables.
+        sites: list of str or None
+            List of sites to be returned. None includes all sites.
+
+        Returns
+        -------
+        tuple of two DataFrames
+            The sites_var (site, varfrom, varto) and the variable periods (site, varto, var_name, units, from_date, to_date).
+        """
+        where_lst = []
+        params = []
+        if isinstance(varto, int):
+            varto = [varto]
+        if isinstance(varto, list):
+            where_lst.append('varto IN ({})'.format(', '.join(['?'] * len(varto))))
+            params.extend([int(v) for v in varto])
+        if isinstance(sites, list):
+            where_lst.append('site IN ({})'.format(', '.join(['?'] * len(sites))))
+            params.extend([str(s) for s in sites])
+
+        stmt = 'SELECT site, varfrom, varto FROM sites_var'
+        if where_lst:
+            stmt = stmt + ' WHERE ' + ' AND '.join(where_lst)
+        stmt2 = 'SELECT site, varto, var_name, units, from_date, to_date FROM var_periods WHERE site IN (SELECT DISTINCT site FROM sites_var'
+        if where_lst:
+            stmt2 = stmt2 + ' WHERE ' + ' AND '.join(where_lst)
+        stmt2 = stmt2 + ')'
+
+        with self._lock:
+            sites_var = pd.read_sql(stmt, self._con, params=params)
+            var_periods = pd.read_sql(stmt2, self._con, params=params, parse_dates=['from_date', 'to_date'])
+
+        sites_var['varfrom'] = sites_var['varfrom'].astype('int32')
+        sites_var['varto'] = sites_var['varto'].astype('int32')
+        var_periods['varto'] = var_periods['varto'].astype('int32')
+
+        return sites_var, var_periods.reset_index(drop=True)
+
+    def close(self):
+        """
+        Close the connection to the catalog file.
+        """
+        with self._lock:
+            self._con.close()
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Command line bulk extractor. Runs the jobs of a json job spec through get_ts_data_bulk in a pool of workers, shows the progress and throughput, and prints a json summary.
+
+    pyhydllp job.json --workers 4 --summary summary.json
+
+The progress lines and other messages are written to stderr, so stdout only has the json summary. PyTables is not thread safe, so jobs that export to h5 files must be run with one worker.
+
+The job spec contains the hyd parameters, defaults for all jobs, and the list of jobs. The job parameters are the get_ts_data_bulk parameters (sql_username and sql_password are the SQL login):
+
+    {
+        "hyd": {"ini_path": "...", "dll_path": "...", "username": "", "password": ""},
+        "defaults": {"server": "...", "database": "hydstra", "from_mod_date": "2018-07-01", "interval": "day"},
+        "jobs": [
+            {"name": "flow", "varto": 140, "export": "flow.h5"},
+            {"name": "precip", "varto": 10, "sites": ["70105", "69607"], "export": "precip.h5"}
+        ]
+    }
+"""
+import sys
+import json
+import time
+import threading
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+hyd_keys = ['ini_path', 'dll_path', 'hydllp_filename', 'hyaccess_filename', 'hyconfig_filename', 'username', 'password', 'json_codec', 'bridge_python']
+
+job_keys = ['name', 'server', 'database', 'varto', 'sites', 'data_source', 'from_date', 'to_date', 'from_mod_date', 'to_mod_date', 'interval', 'qual_codes', 'cols_convert', 'code_convert', 'qual_code_convert', 'export', 'sql_username', 'sql_password', 'catalog', 'site_files_path']
+
+
+def read_job_spec(spec):
+    """
+    Function to read and check a job spec.
+
+    Parameters
+    ----------
+    spec : str or dict
+        The path to the json job spec or the job spec as a dict.
+
+    Returns
+    -------
+    tuple
+        Of the hyd parameters (dict) and the jobs (list of dict) with the defaults filled in.
+    """
+    if isinstance(spec, str):
+        with open(spec) as f:
+            spec = json.load(f)
+
+    hyd_kwargs = dict(spec.get('hyd', {}))
+    bad_keys = set(hyd_kwargs).difference(hyd_keys)
+    if bad_keys:
+        raise ValueError('Unknown hyd parameters: ' + ', '.join(sorted(bad_keys)))
+
+    defaults = spec.get('defaults', {})
+    jobs = []
+    for i, j in enumerate(spec.get('jobs', [])):
+        job = dict(defaults)
+        job.update(j)
+        bad_keys = set(job).difference(job_keys)
+        if bad_keys:
+            raise ValueError('Unknown parameters in job ' + str(i) + ': ' + ', '.join(sorted(bad_keys)))
+        for key in ['server', 'database', 'varto']:
+            if key not in job:
+                raise ValueError('Job ' + str(i) + ' has no ' + key)
+        job.setdefault('name', 'job_' + str(i))
+        jobs.append(job)
+
+    if not jobs:
+        raise ValueError('The job spec has no jobs')
+
+    names = [j['name'] for j in jobs]
+    if len(set(names)) < len(names):
+        raise ValueError('The job names must be unique')
+
+    return hyd_kwargs, jobs
+
+
+class Progress(object):
+    """
+    Thread safe progress and throughput counters of the jobs. A progress line is written to the stream at most every interval seconds.
+    """
+    def __init__(self, stream=sys.stderr, interval=5):
+        self.stream = stream
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.jobs = {}
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def job(self, name):
+        """
+        Get the progress callback of a job for get_ts_data_bulk.
+        """
+        counts = {'sites': 0, 'total': None, 'rows': 0, 'bytes': 0}
+        with self._lock:
+            self.jobs[name] = counts
+
+        def update(info):
+            with self._lock:
+                counts['sites'] = info['done']
+                counts['total'] = info['total']
+                counts['rows'] += info['rows']
+                counts['bytes'] += info['bytes']
+            self.write()
+
+        return update
+
+    def metrics(self):
+        """
+        The totals and rates of all jobs so far.
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            sites = sum([c['sites'] for c in self.jobs.values()])
+            rows = sum([c['rows'] for c in self.jobs.values()])
+            mb = sum([c['bytes'] for c in self.jobs.values()]) / 1024 ** 2
+        seconds = time.perf_counter() - self.start
+        rate = 1 / seconds if seconds > 0 else 0
+        return {'seconds': round(seconds, 3), 'sites': sites, 'rows': rows, 'mb': round(mb, 3), 'sites_per_s': round(sites * rate, 3), 'rows_per_s': round(rows * rate, 1), 'mb_per_s': round(mb * rate, 3)}
+
+    def write(self, force=False):
+        """
+        Write a progress line to the stream.
+        """
+        if self.stream is None:
+            return
+        now = time.perf_counter()
+        if not force and (now - self._last < self.interval):
+            return
+        self._last = now
+        m = self.metrics()
+        with self._lock:
+            jobs = ' '.join(['{}: {}/{}'.format(k, c['sites'], '?' if c['total'] is None else c['total']) for k, c in self.jobs.items()])
+        self.stream.write('[{seconds:.0f} s] {sites} sites, {rows} rows, {mb:.1f} MB | {sites_per_s:.2f} sites/s, {rows_per_s:.0f} rows/s, {mb_per_s:.2f} MB/s | '.format(**m) + jobs + '\n')
+        self.stream.flush()
+
+
+def run_jobs(spec, workers=1, progress_interval=5, stream=sys.stderr):
+    """
+    Function to run the jobs of a job spec with get_ts_data_bulk. Each worker has its own Hydstra session and the SQL connections are shared in a pool per server and database.
+
+    Parameters
+    ----------
+    spec : str or dict
+        The path to the json job spec or the job spec as a dict.
+    workers : int
+        The number of jobs to run in parallel. Must be 1 if any job exports to an h5 file.
+    progress_interval : int or float
+        The min seconds between the progress lines.
+    stream : file or None
+        The stream to write the progress lines to. None writes nothing.
+
+    Returns
+    -------
+    dict
+        The summary of the run with the overall metrics and the status, metrics, and error of each job.
+    """
+    from pyhydllp import hyd, sql
+
+    hyd_kwargs, jobs = read_job_spec(spec)
+
+    if workers > 1:
+        exports = [j['export'] for j in jobs if isinstance(j.get('export'), str)]
+        if len(set(exports)) < len(exports):
+            raise ValueError('Jobs run in parallel must have different export files')
+        ## PyTables is not thread safe, so the HDF5 exports can't be written from several threads
+        if any([e.lower().endswith('.h5') for e in exports]):
+            raise ValueError('Jobs that export to h5 files must be run with one worker')
+
+    ### SQL connection pools
+    pools = {}
+    for j in jobs:
+        key = (j['server'], j['database'], j.get('sql_username'), j.get('sql_password'))
+        if key not in pools:
+            pools[key] = sql.SqlPool(*key, pool_size=workers)
+
+    progress = Progress(stream, progress_interval)
+
+    def run(job):
+        job = dict(job)
+        name = job.pop('name')
+        username = job.pop('sql_username', None)
+        password = job.pop('sql_password', None)
+        pool = pools[(job['server'], job['database'], username, password)]
+        callback = progress.job(name)
+
+        t1 = time.perf_counter()
+        res = {'name': name, 'varto': job['varto'], 'status': 'ok', 'error': None}
+        hyd1 = None
+        try:
+            hyd1 = hyd(**hyd_kwargs)
+            hyd1.get_ts_data_bulk(username=username, password=password, pool=pool, progress=callback, **job)
+        except Exception as err:
+            res['status'] = 'error'
+            res['error'] = '{}: {}'.format(type(err).__name__, err)
+        finally:
+            if hyd1 is not None:
+                hyd1.close()
+        res['seconds'] = round(time.perf_counter() - t1, 3)
+        res.update({k: progress.jobs[name][k] for k in ['sites', 'rows']})
+        res['mb'] = round(progress.jobs[name]['bytes'] / 1024 ** 2, 3)
+        return res
+
+    try:
+        with ThreadPoolExecutor(max(workers, 1)) as executor:
+            results = list(executor.map(run, jobs))
+    finally:
+        for pool in pools.values():
+            pool.dispose()
+
+    progress.write(True)
+
+    summary = progress.metrics()
+    summary['status'] = 'ok' if all([r['status'] == 'ok' for r in results]) else 'error'
+    summary['workers'] = workers
+    summary['jobs'] = results
+
+    return summary
+
+
+def main(argv=None):
+    """
+    The pyhydllp console entry point.
+    """
+    parser = argparse.ArgumentParser(prog='pyhydllp', description='Extract Hydstra data in bulk from a json job spec.')
+    parser.add_argument('spec', help='Path to the json job spec.')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of jobs to run in parallel.')
+    parser.add_argument('-s', '--summary', help='Path to also save the json summary to.')
+    parser.add_argument('-i', '--progress-interval', type=float, default=5, help='Min seconds between the progress lines.')
+    parser.add_argument('-q', '--quiet', action='store_true', help="Don't write the progress lines.")
+    args = parser.parse_args(argv)
+
+    summary = run_jobs(args.spec, workers=args.workers, progress_interval=args.progress_interval, stream=None if args.quiet else sys.stderr)
+
+    summary_json = json.dumps(summary, indent=2)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            f.write(summary_json)
+    print(summary_json)
+
+    return 0 if summary['status'] == 'ok' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
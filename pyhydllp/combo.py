@@ -4,12 +4,15 @@ Created on Sat Mar 24 13:39:58 2018
 
 @author: michaelek
 """
+import sys
 import pandas as pd
 import pdsql
 from pyhydllp import sql, hydllp
+from pyhydllp.catalog import SiteCatalog
+from pyhydllp.profiler import stage as profiler_stage
 
 
-def get_ts_data_bulk(self, server, database, varto, sites=None, data_source='A', from_date=None, to_date=None, from_mod_date=None, to_mod_date=None, interval='day', qual_codes=[30, 20, 10, 11, 21, 18], concat_data=False, cols_convert=None, code_convert=None, qual_code_convert=None, export=None, username=None, password=None):
+def get_ts_data_bulk(self, server, database, varto, sites=None, data_source='A', from_date=None, to_date=None, from_mod_date=None, to_mod_date=None, interval='day', qual_codes=[30, 20, 10, 11, 21, 18], concat_data=False, cols_convert=None, code_convert=None, qual_code_convert=None, export=None, username=None, password=None, pool=None, catalog=None, site_files_path=None, profiler=None, progress=None):
     """
     Function to read in data from Hydstra's database using HYDLLP. This function extracts all sites with a specific variable code (varto).
 
@@ -47,6 +50,20 @@ def get_ts_data_bulk(self, server, database, varto, sites=None, data_source='A',
         A dict to convert the hydstra quality codes to another set of codes.
     export: str
         Path string where the data should be saved, or None to not save the data.
+    username : str or None
+        The SQL username. None will use a trusted connection.
+    password : str or None
+        Same as username, but for password.
+    pool : SqlPool or None
+        A shared SqlPool. None will use the hyd sql_pool or otherwise open a single connection for the SQL queries of this call.
+    catalog : str, SiteCatalog, or None
+        A persistent site catalog (or the path to one) to determine the record periods from. See sites_var_periods.
+    site_files_path : str or None
+        Path to the Hydstra ts data (.A) files. If given with from_mod_date, sites with untouched archive files are skipped before requesting the blockinfo. See ts_data_changes.
+    profiler : Profiler or None
+        A profiler to record the timings of the stages and sites (see pyhydllp.profiler).
+    progress : callable or None
+        A function called after each site with a dict of the site, varto, rows, bytes (in memory), done (number of sites processed), and total (number of sites). None prints the sites as they are processed.
 
     Return
     ------
@@ -56,44 +73,51 @@ def get_ts_data_bulk(self, server, database, varto, sites=None, data_source='A',
     ### Parameters
     device_data_type = {100: 'mean', 140: 'mean', 143: 'mean', 450: 'mean', 110: 'mean', 130: 'mean', 10: 'tot'}
 
-    ### Determine the period lengths for all sites and variables
-    sites_var_period = self.sites_var_periods(server=server, database=database, varto=varto, sites=sites, data_source=data_source)
-#    sites_list = sites_var_period.site.unique().tolist()
-    varto_list = sites_var_period.varto.unique().astype('int32').tolist()
-
-    ### Restrict period ranges - optional
-    if isinstance(from_date, str):
-        from_date1 = pd.Timestamp(from_date)
-        sites_var_period = sites_var_period[sites_var_period.to_date > from_date1]
-        from_date_df = sites_var_period.from_date.apply(lambda x: x if x > from_date1 else from_date1)
-        sites_var_period['from_date'] = from_date_df
-    if isinstance(to_date, str):
-        to_date1 = pd.Timestamp(to_date)
-        sites_var_period = sites_var_period[sites_var_period.from_date > to_date1]
-        to_date_df = sites_var_period.to_date.apply(lambda x: x if x > to_date1 else to_date1)
-        sites_var_period['to_date'] = to_date_df
-
-    ### Only pull out data according to the modifcation date ranges - optional
-    if isinstance(from_mod_date, str):
-        sites_block = sites_var_period[sites_var_period.varfrom == sites_var_period.varto]
-        varto_block = sites_block.varto.unique().astype('int32').tolist()
-
-        chg1 = self.ts_data_changes(varto_block, sites_block.site.unique(), from_mod_date=from_mod_date, to_mod_date=to_mod_date)
-        if not chg1.empty:
-            chg1 = chg1.drop('to_date', axis=1)
-        if 140 in varto_list:
-            sites_flow = sites_var_period[(sites_var_period.varfrom != sites_var_period.varto) & (sites_var_period.varto == 140)]
-            chg2 = sql.rating_changes(server=server, database=database, sites=sites_flow.site.unique().tolist(), from_mod_date=from_mod_date, to_mod_date=to_mod_date, username=username, password=password)
-            chg1 = pd.concat([chg1, chg2])
-        if chg1.empty:
-            print('No data has been changed since last export')
-            return None
-
-        chg1.rename(columns={'from_date': 'mod_date'}, inplace=True)
-        chg3 = pd.merge(sites_var_period, chg1, on=['site', 'varfrom', 'varto'])
-        chg4 = chg3[chg3.to_date > chg3.mod_date].copy()
-        chg4['from_date'] = chg4['mod_date']
-        sites_var_period = chg4.drop('mod_date', axis=1).copy()
+    if pool is None:
+        pool = self.sql_pool
+
+    with sql.open_pool(server, database, username, password, pool) as pool1:
+        ### Determine the period lengths for all sites and variables
+        with profiler_stage(profiler, 'sites_var_periods'):
+            sites_var_period = self.sites_var_periods(server=server, database=database, varto=varto, sites=sites, data_source=data_source, username=username, password=password, pool=pool1, catalog=catalog, profiler=profiler)
+#        sites_list = sites_var_period.site.unique().tolist()
+        varto_list = sites_var_period.varto.unique().astype('int32').tolist()
+
+        ### Restrict period ranges - optional
+        if isinstance(from_date, str):
+            from_date1 = pd.Timestamp(from_date)
+            sites_var_period = sites_var_period[sites_var_period.to_date > from_date1]
+            from_date_df = sites_var_period.from_date.apply(lambda x: x if x > from_date1 else from_date1)
+            sites_var_period['from_date'] = from_date_df
+        if isinstance(to_date, str):
+            to_date1 = pd.Timestamp(to_date)
+            sites_var_period = sites_var_period[sites_var_period.from_date > to_date1]
+            to_date_df = sites_var_period.to_date.apply(lambda x: x if x > to_date1 else to_date1)
+            sites_var_period['to_date'] = to_date_df
+
+        ### Only pull out data according to the modifcation date ranges - optional
+        if isinstance(from_mod_date, str):
+            sites_block = sites_var_period[sites_var_period.varfrom == sites_var_period.varto]
+            varto_block = sites_block.varto.unique().astype('int32').tolist()
+
+            with profiler_stage(profiler, 'ts_data_changes'):
+                chg1 = self.ts_data_changes(varto_block, sites_block.site.unique(), from_mod_date=from_mod_date, to_mod_date=to_mod_date, site_files_path=site_files_path)
+            if not chg1.empty:
+                chg1 = chg1.drop('to_date', axis=1)
+            if 140 in varto_list:
+                sites_flow = sites_var_period[(sites_var_period.varfrom != sites_var_period.varto) & (sites_var_period.varto == 140)]
+                with profiler_stage(profiler, 'rating_changes'):
+                    chg2 = sql.rating_changes(server=server, database=database, sites=sites_flow.site.unique().tolist(), from_mod_date=from_mod_date, to_mod_date=to_mod_date, pool=pool1)
+                chg1 = pd.concat([chg1, chg2])
+            if chg1.empty:
+                print('No data has been changed since last export', file=sys.stderr)
+                return None
+
+            chg1.rename(columns={'from_date': 'mod_date'}, inplace=True)
+            chg3 = pd.merge(sites_var_period, chg1, on=['site', 'varfrom', 'varto'])
+            chg4 = chg3[chg3.to_date > chg3.mod_date].copy()
+            chg4['from_date'] = chg4['mod_date']
+            sites_var_period = chg4.drop('mod_date', axis=1).copy()
 
     ### Convert datetime to date as str
     sites_var_period2 = sites_var_period.copy()
@@ -106,54 +130,65 @@ def get_ts_data_bulk(self, server, database, varto, sites=None, data_source='A',
             if export.endswith('.h5'):
                 store = pd.HDFStore(export, mode='a')
 
+    n_sites = len(sites_var_period2)
+
     data = pd.DataFrame()
     with hydllp.openHyDb(self.hydllp) as h:
-        for tup in sites_var_period2.itertuples(index=False):
-            print('Processing site: ' + str(tup.site))
+        for n, tup in enumerate(sites_var_period2.itertuples(index=False), 1):
+            if progress is None:
+                print('Processing site: ' + str(tup.site), file=sys.stderr)
             varto = tup.varto
             data_type = device_data_type[varto]
 
-            df = h.get_ts_traces(site_list=[tup.site], data_type=data_type, start=tup.from_date, end=tup.to_date, varfrom=tup.varfrom, varto=varto, interval=interval, qual_codes=qual_codes)
+            with profiler_stage(profiler, 'get_ts_traces', tup.site, h):
+                df = h.get_ts_traces(site_list=[tup.site], data_type=data_type, start=tup.from_date, end=tup.to_date, varfrom=tup.varfrom, varto=varto, interval=interval, qual_codes=qual_codes)
             if df.empty:
+                if progress is not None:
+                    progress({'site': tup.site, 'varto': varto, 'rows': 0, 'bytes': 0, 'done': n, 'total': n_sites})
                 continue
-            df['hydstra_code'] = varto
-            site1 = str(tup.site).replace('_', '/')
 
-            ## Convert code 143 to code 140
-            if varto == 143:
-                df.loc[:, 'data'] = df.loc[:, 'data'] * 0.001
-                df['hydstra_code'] = 140
+            with profiler_stage(profiler, 'transform', tup.site):
+                df['hydstra_code'] = varto
+                site1 = str(tup.site).replace('_', '/')
+
+                ## Convert code 143 to code 140
+                if varto == 143:
+                    df.loc[:, 'data'] = df.loc[:, 'data'] * 0.001
+                    df['hydstra_code'] = 140
 
-            ## Convert GW well sites to their proper name
-            if varto in [110]:
-                df.index = df.index.set_levels([site1], 'site')
+                ## Convert GW well sites to their proper name
+                if varto in [110]:
+                    df.index = df.index.set_levels([site1], 'site')
 
-            ## Reset index
-            df = df.reset_index()
+                ## Reset index
+                df = df.reset_index()
 
-            ## Convert Hydstra mtype codes
-            if isinstance(code_convert, dict):
-                df.replace({'hydstra_code': code_convert}, inplace=True)
+                ## Convert Hydstra mtype codes
+                if isinstance(code_convert, dict):
+                    df.replace({'hydstra_code': code_convert}, inplace=True)
 
-            ## Convert Hydstra quality code
-            if isinstance(qual_code_convert, dict):
-                df.replace({'qual_code': qual_code_convert}, inplace=True)
+                ## Convert Hydstra quality code
+                if isinstance(qual_code_convert, dict):
+                    df.replace({'qual_code': qual_code_convert}, inplace=True)
 
-            ## Convert column names
-            if isinstance(cols_convert, dict):
-                df.rename(columns=cols_convert, inplace=True)
+                ## Convert column names
+                if isinstance(cols_convert, dict):
+                    df.rename(columns=cols_convert, inplace=True)
 
             ### Export options
-            if isinstance(export, dict):
-                col_names = df.columns
-                pdsql.mssql.update_mssql_table_rows(df, on=[col_names[0], col_names[1], col_names[4]], **export)
-            elif isinstance(export, str):
-                if export.endswith('.h5'):
-                    try:
-                        store.append(key='var_' + str(varto), value=df, min_itemsize={col_names[0]: site_str_len})
-                    except Exception as err:
-                        store.close()
-                        raise err
+            col_names = df.columns
+            with profiler_stage(profiler, 'export', tup.site):
+                if isinstance(export, dict):
+                    pdsql.mssql.update_mssql_table_rows(df, on=[col_names[0], col_names[1], col_names[4]], **export)
+                elif isinstance(export, str):
+                    if export.endswith('.h5'):
+                        try:
+                            store.append(key='var_' + str(varto), value=df, min_itemsize={col_names[0]: site_str_len})
+                        except Exception as err:
+                            store.close()
+                            raise err
+            if progress is not None:
+                progress({'site': tup.site, 'varto': varto, 'rows': len(df), 'bytes': int(df.memory_usage(index=True, deep=True).sum()), 'done': n, 'total': n_sites})
             if concat_data:
                 data = pd.concat([data, df])
     if isinstance(export, str):
@@ -162,7 +197,7 @@ def get_ts_data_bulk(self, server, database, varto, sites=None, data_source='A',
         return data
 
 
-def sites_var_periods(self, server, database, varto=None, sites=None, data_source='A', username=None, password=None):
+def sites_var_periods(self, server, database, varto=None, sites=None, data_source='A', username=None, password=None, pool=None, catalog=None, profiler=None):
     """
     Function to determine the record periods for Hydstra sites/variables.
 
@@ -178,20 +213,65 @@ def sites_var_periods(self, server, database, varto=None, sites=None, data_sourc
         List of sites to be returned. None includes all sites.
     data_source : str
         Hydstra datasource code (usually 'A').
+    username : str or None
+        The SQL username. None will use a trusted connection.
+    password : str or None
+        Same as username, but for password.
+    pool : SqlPool or None
+        A shared SqlPool. None will use the hyd sql_pool or otherwise open a new connection.
+    catalog : str, SiteCatalog, or None
+        A persistent site catalog (or the path to an SQLite file for one). The catalog is incrementally refreshed when it is stale and then queried instead of SQL and Hydstra. A SiteCatalog must have the same data_source. None will query SQL and Hydstra directly.
+    profiler : Profiler or None
+        A profiler to record the timings of the stages (see pyhydllp.profiler).
 
     Returns
     -------
     DataFrame
         With site, varfrom, varto, from_date, and to_date.
     """
-    sites_var = sql.sql_sites_var(varto=varto, data_source=data_source, server=server, database=database, username=username, password=password)
+    if pool is None:
+        pool = self.sql_pool
+
+    ### Read from the catalog - optional
+    if catalog is not None:
+        if isinstance(catalog, str):
+            catalog1 = SiteCatalog(catalog, data_source=data_source)
+        else:
+            catalog1 = catalog
+            if catalog1.data_source != data_source:
+                raise ValueError('The catalog data_source ' + str(catalog1.data_source) + ' does not match the data_source ' + str(data_source))
+        try:
+            if catalog1.is_stale():
+                with profiler_stage(profiler, 'catalog_refresh'):
+                    catalog1.refresh(self, server, database, username=username, password=password, pool=pool)
+            with profiler_stage(profiler, 'catalog_query'):
+                sites_var, sites_period = catalog1.query(varto=varto, sites=sites)
+        finally:
+            if isinstance(catalog, str):
+                catalog1.close()
+
+        return _combine_periods(sites_var, sites_period)
+
+    with profiler_stage(profiler, 'sql_sites_var'):
+        sites_var = sql.sql_sites_var(varto=varto, data_source=data_source, server=server, database=database, username=username, password=password, pool=pool)
     if isinstance(sites, list):
         sites_var = sites_var[sites_var.site.isin([str(i) for i in sites])]
     sites_list = sites_var.site.unique().tolist()
-    varto_list = sites_var.varto.unique().astype('int32').tolist()
 
     ### Determine the period lengths for all sites and variables
-    sites_period = self.get_variable_list(sites_list, data_source)
+    with profiler_stage(profiler, 'get_variable_list', hydllp=self.hydllp):
+        sites_period = self.get_variable_list(sites_list, data_source)
+
+    return _combine_periods(sites_var, sites_period)
+
+
+def _combine_periods(sites_var, sites_period):
+    """
+    Function to combine the sites/variables with their variable periods. Rated flow sites (100 to 140) get the periods of their water level.
+    """
+    varto_list = sites_var.varto.unique().astype('int32').tolist()
+
+    sites_period = sites_period.copy()
     sites_period['varfrom'] = sites_period['varto']
     if 140 in varto_list:
         flow_rate_sites = sites_var[(sites_var.varfrom == 100) & (sites_var.varto == 140)]
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy time series dataset. Selections are collected and compiled into the minimal get_ts_traces requests only when the data is needed.
+"""
+import copy
+import numpy as np
+import pandas as pd
+from pyhydllp import util, hydllp
+
+
+def ts_dataset(self, sites, start=0, end=0, datasource='A', data_type='mean', varfrom=100, varto=140, qual_codes=None, interval='day', multiplier=1, report_time=None, sites_chunk=20):
+    """
+    Function to create a lazy time series dataset. Nothing is requested from Hydstra until the dataset is computed or iterated over. The parameters are the same as get_ts_data.
+
+    Parameters
+    ----------
+    sites : list, array, one column csv file, or dataframe
+        Site numbers.
+    start : str or int of 0
+        The start time in the format of either '2001-01-01' or 0 (for all data).
+    end : str or int of 0
+        Same formatting as start.
+    datasource : str
+        Hydstra datasource code (usually 'A').
+    data_type : str
+        mean, maxmin, max, min, start, end, first, last, tot, point, partialtot, or cum.
+    varfrom : int or float
+        The hydstra source data variable (100.00 is water level).
+    varto : int or float
+        The hydstra conversion data variable (140.00 is flow).
+    qual_codes : list of int or None
+        The quality codes in Hydstra for filtering the data.
+    interval : str
+        The frequency of the output data (year, month, day, hour, minute, second, period).
+    multiplier : int
+        interval frequency.
+    report_time : start or end
+        The time reported for the aggregated values.
+    sites_chunk : int
+        Number of sites to request to hydllp at one time.
+
+    Returns
+    -------
+    TsDataset
+    """
+    return TsDataset(self, sites, start=start, end=end, datasource=datasource, data_type=data_type, varfrom=varfrom, varto=varto, qual_codes=qual_codes, interval=interval, multiplier=multiplier, report_time=report_time, sites_chunk=sites_chunk)
+
+
+class TsDataset(object):
+    """
+    Lazy time series dataset returned by hyd.ts_dataset. The selection methods return new datasets and can be chained. The dataset is only extracted with compute or by iterating over it (one DataFrame per request).
+
+    Parameters
+    ----------
+    hyd : hyd
+        An initialised hyd object.
+    sites : list, array, one column csv file, or dataframe
+        Site numbers.
+    kwargs
+        See hyd.ts_dataset.
+
+    Returns
+    -------
+    TsDataset object
+    """
+    def __init__(self, hyd, sites, start=0, end=0, datasource='A', data_type='mean', varfrom=100, varto=140, qual_codes=None, interval='day', multiplier=1, report_time=None, sites_chunk=20):
+        self._hyd = hyd
+        self.sites = [str(s) for s in util.select_sites(sites)]
+        self.start = util.time_bound(start)
+        self.end = util.time_bound(end)
+        util.check_time_bounds(self.start, self.end)
+        self.datasource = datasource
+        self.data_type = data_type
+        self.varfrom = varfrom
+        self.varto = varto
+        self.qual_codes = qual_codes
+        self.interval = interval
+        self.multiplier = multiplier
+        self.report_time = report_time
+        self.sites_chunk = sites_chunk
+
+    def __repr__(self):
+        times = [str(t) if t is not None else 'all' for t in (self.start, self.end)]
+        return '<TsDataset {n} sites, varfrom {varfrom}, varto {varto}, {start} to {end}, {multiplier} {interval} {data_type}, {n_req} requests>'.format(n=len(self.sites), varfrom=self.varfrom, varto=self.varto, start=times[0], end=times[1], multiplier=self.multiplier, interval=self.interval, data_type=self.data_type, n_req=len(self.requests()))
+
+    def _replace(self, **kwargs):
+        new1 = copy.copy(self)
+        for k, v in kwargs.items():
+            setattr(new1, k, v)
+        return new1
+
+    def sel_time(self, start=None, end=None):
+        """
+        Restrict the dataset to a time range. The range is intersected with the current one. A dataset of all data needs both the start and end, since HYDLLP only takes both times or neither.
+
+        Parameters
+        ----------
+        start : str, Timestamp, or None
+            The start time. None keeps the current start.
+        end : str, Timestamp, or None
+            The end time. None keeps the current end.
+
+        Returns
+        -------
+        TsDataset
+        """
+        start1 = self.start
+        end1 = self.end
+        if start is not None:
+            start = pd.Timestamp(start)
+            if (start1 is None) or (start > start1):
+                start1 = start
+        if end is not None:
+            end = pd.Timestamp(end)
+            if (end1 is None) or (end < end1):
+                end1 = end
+        util.check_time_bounds(start1, end1)
+        return self._replace(start=start1, end=end1)
+
+    def sel_sites(self, sites):
+        """
+        Restrict the dataset to a subset of the sites.
+
+        Parameters
+        ----------
+        sites : list, array, Series, or DataFrame
+            The sites to keep.
+
+        Returns
+        -------
+        TsDataset
+        """
+        sites1 = set([str(s) for s in util.select_sites(sites)])
+        return self._replace(sites=[s for s in self.sites if s in sites1])
+
+    def sel_qual_codes(self, qual_codes):
+        """
+        Restrict the dataset to the quality codes. The codes are intersected with the current ones. They are passed to every get_ts_traces request like in get_ts_data. The HYDLLP get_ts_traces function has no quality code parameter, so the other values are still transferred and are dropped as each trace is decoded.
+
+        Parameters
+        ----------
+        qual_codes : list of int
+            The quality codes to keep.
+
+        Returns
+        -------
+        TsDataset
+        """
+        if isinstance(self.qual_codes, list):
+            qual_codes = [q for q in self.qual_codes if q in qual_codes]
+        return self._replace(qual_codes=list(qual_codes))
+
+    def aggregate(self, interval, data_type='mean', multiplier=1, report_time=None):
+        """
+        Aggregate the dataset on the server.
+
+        Parameters
+        ----------
+        interval : str
+            The frequency of the output data (year, month, day, hour, minute, second, period).
+        data_type : str
+            mean, maxmin, max, min, start, end, first, last, tot, point, partialtot, or cum.
+        multiplier : int
+            interval frequency.
+        report_time : start or end
+            The time reported for the aggregated values.
+
+        Returns
+        -------
+        TsDataset
+        """
+        return self._replace(interval=interval, data_type=data_type, multiplier=multiplier, report_time=report_time)
+
+    def requests(self):
+        """
+        Compile the dataset into the get_ts_traces requests.
+
+        Returns
+        -------
+        list of dict
+            The kwargs for each Hydllp.get_ts_traces call.
+        """
+        if not self.sites:
+            return []
+        if (self.start is not None) and (self.end is not None) and (self.start > self.end):
+            return []
+        if isinstance(self.qual_codes, list) and not self.qual_codes:
+            return []
+
+        start = 0 if self.start is None else str(self.start)
+        end = 0 if self.end is None else str(self.end)
+
+        n_chunks = np.ceil(len(self.sites) / float(self.sites_chunk))
+        sites_chunks = [i.tolist() for i in np.array_split(self.sites, n_chunks)]
+
+        reqs = [dict(site_list=s, start=start, end=end, datasource=self.datasource, data_type=self.data_type, varfrom=self.varfrom, varto=self.varto, interval=self.interval, multiplier=self.multiplier, qual_codes=self.qual_codes, report_time=self.report_time) for s in sites_chunks]
+
+        return reqs
+
+    def __iter__(self):
+        reqs = self.requests()
+        if not reqs:
+            return
+        with hydllp.openHyDb(self._hyd.hydllp) as h:
+            for req in reqs:
+                yield h.get_ts_traces(**req)
+
+    def compute(self):
+        """
+        Extract the dataset.
+
+        Returns
+        -------
+        DataFrame
+            In long format with site and time as a MultiIndex.
+        """
+        dfs = list(self)
+        if not dfs:
+            return pd.DataFrame(columns=['data', 'qual_code'], index=pd.MultiIndex.from_arrays([[], []], names=['site', 'time']))
+        return pd.concat(dfs)
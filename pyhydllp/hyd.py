@@ -7,6 +7,26 @@ Created on Mon Mar 26 11:30:30 2018
 from pyhydllp.hydllp import Hydllp
 
 
+class _LazyFunction(object):
+    """
+    Descriptor that imports a hyd method from its module the first time it is accessed. This keeps pandas, pdsql, and the SQL drivers from being imported with the package.
+    """
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+
+    def __set_name__(self, owner, name):
+        self._owner = owner
+
+    def __get__(self, obj, objtype=None):
+        import importlib
+        fun = getattr(importlib.import_module(self._module), self._name)
+        setattr(self._owner, self._name, fun)
+        if obj is None:
+            return fun
+        return fun.__get__(obj, objtype)
+
+
 class hyd(object):
     """
     Class to initiate the Hydstra connection and access the extraction functions.
@@ -27,20 +47,77 @@ class hyd(object):
         The login username for Hydstra. Leave a blank str to have Hydstra use the local user machine username.
     password : str
         Same as username, but for password.
+    json_codec : str
+        The json codec for the hydllp requests and responses (orjson, ujson, simdjson, or json). 'auto' uses the fastest one installed.
+    sql_pool : SqlPool or None
+        A shared pool of SQL connections (see pyhydllp.sql.SqlPool) to be used by the functions that query the Hydstra SQL database.
+    ts_cache : TsCache or None
+        A cache of the get_ts_data outputs (see pyhydllp.cache.TsCache). None does not cache.
+    bridge_python : str or None
+        Path to a 32bit python executable. If given, the hydllp.dll is run in a worker process with that python (see pyhydllp.bridge), so this python can be 64bit.
+    single_flight : bool
+        Should concurrent identical hydllp requests of the same user share one call (see Hydllp.query_by_dict)?
 
     Returns
     -------
     hyd object
     """
     ### Initialisation
-    def __init__(self, ini_path, dll_path, hydllp_filename='hydllp.dll', hyaccess_filename='Hyaccess.ini', hyconfig_filename='HYCONFIG.INI', username='', password=''):
+    def __init__(self, ini_path, dll_path, hydllp_filename='hydllp.dll', hyaccess_filename='Hyaccess.ini', hyconfig_filename='HYCONFIG.INI', username='', password='', json_codec='auto', sql_pool=None, ts_cache=None, bridge_python=None, single_flight=False):
 
-        hydllp = Hydllp(ini_path=ini_path, dll_path=dll_path, hydllp_filename=hydllp_filename, hyaccess_filename=hyaccess_filename, hyconfig_filename=hyconfig_filename, username=username, password=password)
+        if bridge_python is None:
+            hydllp = Hydllp(ini_path=ini_path, dll_path=dll_path, hydllp_filename=hydllp_filename, hyaccess_filename=hyaccess_filename, hyconfig_filename=hyconfig_filename, username=username, password=password, json_codec=json_codec, single_flight=single_flight)
+        else:
+            from pyhydllp.bridge import HydllpBridge
+            hydllp = HydllpBridge(ini_path=ini_path, dll_path=dll_path, hydllp_filename=hydllp_filename, hyaccess_filename=hyaccess_filename, hyconfig_filename=hyconfig_filename, username=username, password=password, json_codec=json_codec, single_flight=single_flight, python_exe=bridge_python)
         self.hydllp = hydllp
+        self.sql_pool = sql_pool
+        self.ts_cache = ts_cache
+
+    @classmethod
+    def from_hydllp(cls, hydllp, sql_pool=None, ts_cache=None):
+        """
+        Create a hyd object from an existing Hydllp object (e.g. a replay.ReplayHydllp or synthetic.FakeHydllp).
+
+        Parameters
+        ----------
+        hydllp : Hydllp
+            An initialised Hydllp object.
+        sql_pool : SqlPool or None
+            A shared pool of SQL connections.
+        ts_cache : TsCache or None
+            A cache of the get_ts_data outputs.
+
+        Returns
+        -------
+        hyd object
+        """
+        self = cls.__new__(cls)
+        self.hydllp = hydllp
+        self.sql_pool = sql_pool
+        self.ts_cache = ts_cache
+        return self
+
+    def close(self):
+        """
+        Close the Hydllp object (e.g. stop the worker process of the bridge). hyd can also be used as a context manager to close it on exit.
+        """
+        self.hydllp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
-    ### Load functions
-    from pyhydllp.base import get_variable_list, get_ts_blockinfo, get_ts_data, ts_data_changes
-    try:
-        from pyhydllp.combo import get_ts_data_bulk, sites_var_periods
-    except ImportError:
-        None
+    ### Load functions - imported when first used
+    get_variable_list = _LazyFunction('pyhydllp.base', 'get_variable_list')
+    get_ts_blockinfo = _LazyFunction('pyhydllp.base', 'get_ts_blockinfo')
+    get_ts_data = _LazyFunction('pyhydllp.base', 'get_ts_data')
+    ts_data_changes = _LazyFunction('pyhydllp.base', 'ts_data_changes')
+    iter_ts_data = _LazyFunction('pyhydllp.base', 'iter_ts_data')
+    get_ts_data_multi = _LazyFunction('pyhydllp.base', 'get_ts_data_multi')
+    get_ts_data_bulk = _LazyFunction('pyhydllp.combo', 'get_ts_data_bulk')
+    sites_var_periods = _LazyFunction('pyhydllp.combo', 'sites_var_periods')
+    ts_dataset = _LazyFunction('pyhydllp.dataset', 'ts_dataset')
+    ts_planner = _LazyFunction('pyhydllp.planner', 'ts_planner')
@@ -4,8 +4,15 @@ Functions to read in Hydstra data. Requires a 32bit python environment due to th
 
 import ctypes
 import os
+import sys
+import copy
+import json
+import re
 import contextlib
-import pandas as pd
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Define a context manager generator
 # that creates and releases the connection to the hydstra server
@@ -34,6 +41,233 @@ def openHyDb(hydllp, username=None, password=None):
         hydllp.logout()
 
 
+@contextlib.contextmanager
+def openHyDbPool(hydllp, n_sessions=1, username=None, password=None):
+    """
+    Hydllp content manager generator for a pool of independent sessions. The first session is the passed Hydllp object, the rest are created via Hydllp.new_session.
+
+    Parameters
+    ----------
+    hydllp : Hydllp
+        An initialised Hydllp object.
+    n_sessions : int
+        The number of sessions to log into.
+    username : str
+        The login username for Hydstra. Leave a blank str to have Hydstra use the local user machine username.
+    password : str
+        Same as username, but for password.
+
+    Returns
+    -------
+    Generator of a list of Hydllp
+    """
+    sessions = [hydllp]
+    sessions.extend([hydllp.new_session() for i in range(1, n_sessions)])
+    logged_in = []
+    try:
+        for s in sessions:
+            s.login(username, password)
+            logged_in.append(s)
+        yield sessions
+    finally:
+        for s in logged_in:
+            s.logout()
+
+
+def map_sessions(hydllp, fun, items, n_sessions=1, username=None, password=None):
+    """
+    Function to apply a function to every item using a pool of Hydllp sessions. Each session is only used by one thread at a time.
+
+    Parameters
+    ----------
+    hydllp : Hydllp
+        An initialised Hydllp object.
+    fun : callable
+        A function called as fun(session, item).
+    items : list
+        The items to be processed.
+    n_sessions : int
+        The max number of parallel sessions.
+    username : str
+        The login username for Hydstra. Leave a blank str to have Hydstra use the local user machine username.
+    password : str
+        Same as username, but for password.
+
+    Returns
+    -------
+    list
+        The results in the same order as items.
+    """
+    items = list(items)
+    n_sessions = max(min(n_sessions, len(items)), 1)
+
+    with openHyDbPool(hydllp, n_sessions, username, password) as sessions:
+        if n_sessions == 1:
+            return [fun(sessions[0], i) for i in items]
+
+        pool = queue.Queue()
+        for s in sessions:
+            pool.put(s)
+
+        def run(item):
+            s = pool.get()
+            try:
+                return fun(s, item)
+            finally:
+                pool.put(s)
+
+        with ThreadPoolExecutor(n_sessions) as executor:
+            return list(executor.map(run, items))
+
+
+class _BufferPool(object):
+    """
+    Thread safe pool of reusable response buffers for the HYDLLP.dll calls. Each buffer is a tuple of a bytearray and a ctypes char array sharing its memory.
+    """
+    def __init__(self, max_free=4):
+        self._free = []
+        self._max_free = max_free
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        """
+        Get the largest free buffer if it has at least size bytes or allocate a new one. Handing out the largest buffer avoids the buffer-too-small round trip on repeated large responses.
+        """
+        with self._lock:
+            if self._free:
+                i = max(range(len(self._free)), key=lambda i: len(self._free[i][0]))
+                if len(self._free[i][0]) >= size:
+                    return self._free.pop(i)
+
+        data = bytearray(size)
+        return data, (ctypes.c_char * size).from_buffer(data)
+
+    def release(self, buf):
+        """
+        Return a buffer to the pool. The smallest buffers are dropped when there are more than max_free.
+        """
+        with self._lock:
+            self._free.append(buf)
+            if len(self._free) > self._max_free:
+                i = min(range(len(self._free)), key=lambda i: len(self._free[i][0]))
+                self._free.pop(i)
+
+
+_buffers = _BufferPool()
+
+
+def _stdlib_codec():
+    import json
+    return json.dumps, lambda b: json.loads(b.tobytes())
+
+
+def _orjson_codec():
+    import orjson
+    return orjson.dumps, orjson.loads
+
+
+def _ujson_codec():
+    import ujson
+    return ujson.dumps, lambda b: ujson.loads(b.tobytes())
+
+
+def _simdjson_codec():
+    import json
+    import simdjson
+    return json.dumps, simdjson.loads
+
+
+json_codecs = {'orjson': _orjson_codec, 'ujson': _ujson_codec, 'simdjson': _simdjson_codec, 'json': _stdlib_codec}
+
+
+def get_json_codec(codec='auto'):
+    """
+    Function to get the json encoder and decoder used for the HYDLLP requests and responses.
+
+    Parameters
+    ----------
+    codec : str or tuple
+        The name of the codec (orjson, ujson, simdjson, or json), 'auto' for the first of those that is installed, or a tuple of a custom (name, dumps, loads). dumps must return a str or bytes and loads must accept a memoryview.
+
+    Returns
+    -------
+    tuple
+        Of (name, dumps, loads).
+    """
+    if isinstance(codec, tuple):
+        return codec
+    if codec == 'auto':
+        for name in ['orjson', 'ujson', 'simdjson']:
+            try:
+                return (name,) + json_codecs[name]()
+            except ImportError:
+                pass
+        codec = 'json'
+    if codec not in json_codecs:
+        raise ValueError('codec must be one of auto, ' + ', '.join(json_codecs))
+    return (codec,) + json_codecs[codec]()
+
+
+class _SingleFlight(object):
+    """
+    Shares one in-flight call between concurrent callers with the same key. The call is only shared while it is running; later callers make a new call. The callers that waited get deep copies of the result, so no caller can modify the result of another.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fun, *args):
+        """
+        Run fun(*args) or wait for the running call with the same key and return a copy of its result (or raise its error).
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return copy.deepcopy(call['result'])
+
+        try:
+            call['result'] = fun(*args)
+        except BaseException as err:
+            call['error'] = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
+
+        return call['result']
+
+
+_single_flight = _SingleFlight()
+
+
+## The LoadLibraryEx flag to resolve the dependencies of a dll in its own directory
+LOAD_WITH_ALTERED_SEARCH_PATH = 0x8
+
+
+def _load_dll(dll_filename, dll_path):
+    """
+    Load the hydllp.dll from its absolute path with its dependencies resolved from its own directory. According to the HYDLLP doc, the hydllp.dll needs to reference other files in its directory (see the Hydstra Help file). The dll directory is added to the search path of the process with SetDllDirectoryW, so that the libraries that the dll loads later are also found there. It's process wide and setting it again is harmless. The working directory is never changed, since it is shared by all threads; if the dll still needs it, run the dll in its own process with the bridge (see pyhydllp.bridge).
+    """
+    # According to the HYDLLP doc, the stdcall calling convention is used.
+    # CDLL is only used on non-Windows platforms (e.g. for a stub library).
+    if os.name == 'nt':
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        kernel32.SetDllDirectoryW.argtypes = [ctypes.c_wchar_p]
+        if not kernel32.SetDllDirectoryW(os.path.abspath(dll_path)):
+            raise ctypes.WinError(ctypes.get_last_error())
+        return ctypes.WinDLL(dll_filename, winmode=LOAD_WITH_ALTERED_SEARCH_PATH)
+    return ctypes.CDLL(dll_filename)
+
+
 # Exception for hydstra related errors
 class HydstraError(Exception):
     pass
@@ -43,30 +277,65 @@ class HydstraErrorUnknown(HydstraError):
     pass
 
 
+## Matches the error_num at the start of a response to check it without decoding the whole response
+_error_num_re = re.compile(rb'\s*\{\s*"error_num"\s*:\s*(-?\d+)')
+
+
 class Hydllp(object):
-    def __init__(self, ini_path, dll_path, hydllp_filename, hyaccess_filename, hyconfig_filename, username='', password=''):
+    # The recorder of start_recording
+    _recorder = None
+
+    def __init__(self, ini_path, dll_path, hydllp_filename, hyaccess_filename, hyconfig_filename, username='', password='', json_codec='auto', single_flight=False):
 
         self._dll_path = dll_path
         self._ini_path = ini_path
 
-        self._dll_filename = os.path.join(self._dll_path, hydllp_filename)
-        self._hyaccess_filename = os.path.join(self._ini_path, hyaccess_filename)
-        self._hyconfig_filename = os.path.join(self._ini_path, hyconfig_filename)
+        self._dll_filename = os.path.abspath(os.path.join(self._dll_path, hydllp_filename))
+        self._hyaccess_filename = os.path.abspath(os.path.join(self._ini_path, hyaccess_filename))
+        self._hyconfig_filename = os.path.abspath(os.path.join(self._ini_path, hyconfig_filename))
 
-        self._username = username
-        self._password = password
+        init_kwargs = dict(ini_path=ini_path, dll_path=dll_path, hydllp_filename=hydllp_filename, hyaccess_filename=hyaccess_filename, hyconfig_filename=hyconfig_filename, username=username, password=password, json_codec=json_codec, single_flight=single_flight)
+        self._init_common(init_kwargs, username, password, json_codec, single_flight, (self._hyaccess_filename, self._hyconfig_filename))
 
-        # See Hydstra Help file
-        # According to the HYDLLP doc, the hydll.dll needs to run "in situ" since
-        # it needs to reference other files in that directory.
-        os.chdir(self._dll_path)
-
-        # According to the HYDLLP doc, the stdcall calling convention is used.
-        self._dll = ctypes.WinDLL(self._dll_filename)
+        self._dll = _load_dll(self._dll_filename, self._dll_path)
+        self._bind_functions()
 
         # Hydstra server handle. Unique to each instance.
         self._handle = ctypes.c_int()
 
+    def _init_common(self, init_kwargs, username='', password='', json_codec='auto', single_flight=False, server_key=()):
+        """
+        Initialise the state shared by all of the Hydllp backends (the dll, the bridge, the replay, and the synthetic data). The subclasses that don't load the hydllp.dll call this instead of Hydllp.__init__.
+
+        Parameters
+        ----------
+        init_kwargs : dict
+            The parameters to create a new session with the same settings (see new_session).
+        username : str
+            The default login username.
+        password : str
+            The default login password.
+        json_codec : str or tuple
+            The json codec (see get_json_codec).
+        single_flight : bool
+            Should concurrent identical requests share one call (see query_by_dict)?
+        server_key : tuple
+            Identifies the server of the single flight calls. The calls are also keyed by the logged in user.
+        """
+        self._init_kwargs = init_kwargs
+
+        self._username = username
+        self._password = password
+
+        self._codec_name, self._json_dumps, self._json_loads = get_json_codec(json_codec)
+        self.reset_call_stats()
+
+        # Concurrent identical requests to the same server share one call
+        self._single_flight = single_flight
+        self._server_key = server_key
+        self._identity = username
+        self._call_lock = threading.Lock()
+
         self._logged_in = False
 
         # ********************************************************************************
@@ -74,6 +343,26 @@ class Hydllp(object):
     # Start - Define HYDLLP Wrappers
     # ********************************************************************************
 
+    def _bind_functions(self):
+        """
+        Reference the HYDLLP.dll functions and set their prototypes once.
+        """
+        self._decode_error_lib = self._dll['DecodeError']
+        self._decode_error_lib.argtypes = [ctypes.c_int, ctypes.POINTER(ctypes.c_char), ctypes.c_int]
+        self._decode_error_lib.restype = ctypes.c_int
+
+        self._start_up_ex_lib = self._dll['StartUpEx']
+        self._start_up_ex_lib.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_int)]
+        self._start_up_ex_lib.restype = ctypes.c_int
+
+        self._shutdown_lib = self._dll['ShutDown']
+        self._shutdown_lib.argtypes = [ctypes.c_int]
+        self._shutdown_lib.restype = ctypes.c_int
+
+        self._json_call_lib = self._dll['JSonCall']
+        self._json_call_lib.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(ctypes.c_char), ctypes.c_int]
+        self._json_call_lib.restype = ctypes.c_int
+
     def _decode_error(self, error_code):
         """
         HYDLLP.dll "DecodeError" function.
@@ -83,23 +372,22 @@ class Hydllp(object):
         error_code : int
             The error code returned by startup_ex
         """
-
-        # Reference the DecodeError dll function
-        decode_error_lib = self._dll['DecodeError']
-        decode_error_lib.restype = ctypes.c_int
-
-        # string c_type to store the error message
-        error_str = ""
-        c_error_str = ctypes.c_char_p(error_str.encode('ascii'))
-
-        # Allocate memory for the return string
-        return_str = ctypes.create_string_buffer(b' ', 1400)
-
-        # Call "DecodeError"
-        err = decode_error_lib(ctypes.c_int(error_code),
-                               c_error_str,
-                               ctypes.c_int(1023))
-        return return_str.value
+        buf_len = 1023
+        buf = _buffers.acquire(buf_len + 1)
+        try:
+            data, c_buf = buf
+            data[0] = 0
+
+            # Call "DecodeError"
+            self._decode_error_lib(error_code, c_buf, buf_len)
+
+            # The message may fill the buffer without a terminating NUL
+            end = data.find(0, 0, buf_len)
+            if end < 0:
+                end = buf_len
+            return bytes(data[:end])
+        finally:
+            _buffers.release(buf)
 
     def _start_up_ex(self, user, password, hyaccess, hyconfig):
         """
@@ -119,16 +407,9 @@ class Hydllp(object):
         hyconfig : str
             Fullpath to HYCONFIG.INI
         """
-
-        startUpEx_lib = self._dll['StartUpEx']
-        startUpEx_lib.restype = ctypes.c_int
-
         # Call the dll function "StartUpEx"
-        err = startUpEx_lib(ctypes.c_char_p(user),
-                            ctypes.c_char_p(password),
-                            ctypes.c_char_p(hyaccess),
-                            ctypes.c_char_p(hyconfig),
-                            ctypes.byref(self._handle))
+        # The hyaccess and hyconfig paths are absolute, so the working directory doesn't matter
+        err = self._start_up_ex_lib(user, password, hyaccess, hyconfig, ctypes.byref(self._handle))
         return err
 
     def _shutdown(self):
@@ -139,38 +420,42 @@ class Hydllp(object):
         ----------
         None
         """
-
-        shutdown_lib = self._dll['ShutDown']
-        shutdown_lib.restype = ctypes.c_int
-
-        error_code = shutdown_lib(self._handle)
+        error_code = self._shutdown_lib(self._handle)
 
         # Values other than 0 means that an error occured
         if error_code != 0:
             error_msg = self._decode_error(error_code)
             raise HydstraError(error_msg)
 
-    def _json_call(self, request_str, return_str_len):
+    def _json_call(self, request, buf):
         """
         HYDLLP.dll "JsonCall" function
-        """
 
-        jsonCall_lib = self._dll['JSonCall']
-        jsonCall_lib.restype = ctypes.c_int
-
-        # Allocate memory for the return string
-        return_str = ctypes.create_string_buffer(b' ', return_str_len)
+        Parameters
+        ----------
+        request : bytes or str
+            The json request.
+        buf : tuple
+            A buffer from the buffer pool to store the response.
+
+        Returns
+        -------
+        memoryview
+            Of the response in the buffer. Only valid until the buffer is released.
+        """
+        if not isinstance(request, bytes):
+            request = request.encode('ascii')
 
-        # c_return_str = ctypes.c_char_p(return_str)
+        data, c_buf = buf
+        data[0] = 0
 
         # Call the dll function "JsonCall"
-        err = jsonCall_lib(self._handle,
-                           ctypes.c_char_p(request_str.encode('ascii')),
-                           return_str,
-                           return_str_len)
+        err = self._json_call_lib(self._handle, request, c_buf, len(data))
 
-        result = return_str.value
-        return result
+        end = data.find(0)
+        if end < 0:
+            end = len(data)
+        return memoryview(data)[:end]
 
         # ********************************************************************************
 
@@ -209,6 +494,8 @@ class Hydllp(object):
                 error_msg = '	Login failed. Make sure the user ID and password are correct.'
             raise HydstraError(error_msg)
 
+        # The single flight calls are shared by the sessions of the same user only
+        self._identity = username
         self._logged_in = True
 
     def logout(self):
@@ -222,31 +509,74 @@ class Hydllp(object):
         if self._logged_in:
             self._shutdown()
 
-    def query_by_dict(self, request_dict):
+    def close(self):
         """
-        Sends and receives request to the hydstra server using hydllp.dll.
+        Release the resources of the object (e.g. stop the recording). The bridge also stops its worker process.
         """
-        import json
+        self.stop_recording()
 
-        # initial buffer length
-        # If it is too small, we can resize, see below
-        buffer_len = 3000
+    def __enter__(self):
+        return self
 
-        # convert request dict to a json string
-        request_json = json.dumps(request_dict)
+    def __exit__(self, *args):
+        self.close()
 
-        # call json_call and convert result to python dictionary
-        result_json = self._json_call(request_json, buffer_len)
-        result_dict = json.loads(result_json)
+    def new_session(self):
+        """
+        Create a new independent Hydllp object with the same settings. Each object has its own Hydstra server handle.
+
+        Returns
+        -------
+        Hydllp
+        """
+        return self.__class__(**self._init_kwargs)
+
+    def reset_call_stats(self):
+        """
+        Reset the call statistics of query_by_dict. The call_stats dict contains the json codec name, the number of calls and buffer resizes, the bytes sent and received, and the total encode, dll call, and decode times in seconds.
+        """
+        self.call_stats = {'codec': self._codec_name, 'calls': 0, 'buffer_resizes': 0, 'bytes_sent': 0, 'bytes_received': 0, 'encode_time': 0.0, 'call_time': 0.0, 'decode_time': 0.0}
+
+    def _call_decode(self, request_json, buf, raw=False):
+        """
+        Call JsonCall and decode the response directly from the buffer. With raw, the response is copied out of the buffer as bytes and only decoded if its error_num is not 0.
+
+        Returns
+        -------
+        tuple
+            Of (result_dict, response bytes). result_dict is None for a raw response without an error and the response is None when not raw.
+        """
+        t1 = time.perf_counter()
+        result_view = self._json_call(request_json, buf)
+        t2 = time.perf_counter()
+        n_bytes = len(result_view)
+        result_dict = None
+        response = None
+        try:
+            if raw:
+                response = bytes(result_view)
+                m = _error_num_re.match(response)
+                if (m is None) or (int(m.group(1)) != 0):
+                    result_dict = self._json_loads(result_view)
+            else:
+                result_dict = self._json_loads(result_view)
+        finally:
+            result_view.release()
+        t3 = time.perf_counter()
+
+        stats = self.call_stats
+        stats['calls'] += 1
+        stats['bytes_sent'] += len(request_json)
+        stats['bytes_received'] += n_bytes
+        stats['call_time'] += t2 - t1
+        stats['decode_time'] += t3 - t2
 
-        # If the initial buffer is too small, then re-call json_call
-        # with the actual buffer length given by the error response
-        if result_dict["error_num"] == 200:
-            buffer_len = result_dict["buff_required"]
-            print('More buffer was required: ' + str(buffer_len))
-            result_json = self._json_call(request_json, buffer_len)
-            result_dict = json.loads(result_json)
+        return result_dict, response
 
+    def _check_result(self, result_dict):
+        """
+        Raise a HydstraError if the decoded response is an error.
+        """
         # If error_num is not 0, then an error occured
         if result_dict["error_num"] != 0:
             error_msg = "Error num:{}, {}".format(result_dict['error_num'],
@@ -258,7 +588,110 @@ class Hydllp(object):
             error_msg = "Error code = 0, however no 'return' was found"
             raise HydstraError(error_msg)
 
-        return (result_dict)
+    def start_recording(self, path):
+        """
+        Record all of the requests and responses of query_by_dict to a compressed archive (see pyhydllp.replay). The archive can be served back with ReplayHydllp.
+
+        Parameters
+        ----------
+        path : str
+            Path to the zip archive. An existing archive is appended to.
+        """
+        from pyhydllp.replay import Recorder
+        self.stop_recording()
+        self._recorder = Recorder(path)
+
+    def stop_recording(self):
+        """
+        Stop recording and close the archive.
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+    def query_by_dict(self, request_dict):
+        """
+        Sends and receives request to the hydstra server using hydllp.dll. If single_flight is True, concurrent identical requests (from any Hydllp object of the same server and logged in user) share one call. The waiting requests get copies of the result.
+        """
+        if self._recorder is not None:
+            return self._recorder.record(self._query_single_flight, request_dict)
+        return self._query_single_flight(request_dict)
+
+    def _query_single_flight(self, request_dict):
+        if not self._single_flight:
+            return self._query_by_dict(request_dict)
+
+        key = (self._server_key, self._identity, json.dumps(request_dict, sort_keys=True, default=str))
+        return _single_flight.do(key, self._query_by_dict, request_dict)
+
+    def _call(self, request_json, raw=False):
+        """
+        Call JsonCall with a pooled response buffer. If the buffer is too small, JsonCall is called again with the buffer length given by the error response. The calls of one object are serialised, since the server handle can only be used by one thread at a time.
+
+        Returns
+        -------
+        tuple
+            Of (result_dict, response bytes) as returned by _call_decode.
+        """
+        # initial buffer length
+        # If it is too small, we can resize, see below
+        buffer_len = 3000
+
+        if not isinstance(request_json, bytes):
+            request_json = request_json.encode('ascii')
+
+        # call json_call and convert result to python dictionary
+        # The response buffers are reused between calls
+        buf = _buffers.acquire(buffer_len)
+        try:
+            with self._call_lock:
+                result_dict, response = self._call_decode(request_json, buf, raw)
+
+                # If the initial buffer is too small, then re-call json_call
+                # with the actual buffer length given by the error response
+                if (result_dict is not None) and (result_dict["error_num"] == 200):
+                    buffer_len = result_dict["buff_required"]
+                    print('More buffer was required: ' + str(buffer_len), file=sys.stderr)
+                    self.call_stats['buffer_resizes'] += 1
+                    buf0 = buf
+                    buf = _buffers.acquire(buffer_len)
+                    _buffers.release(buf0)
+                    result_dict, response = self._call_decode(request_json, buf, raw)
+        finally:
+            _buffers.release(buf)
+
+        if result_dict is not None:
+            self._check_result(result_dict)
+
+        return result_dict, response
+
+    def _query_by_dict(self, request_dict):
+        """
+        Sends and receives request to the hydstra server using hydllp.dll.
+        """
+        # convert request dict to a json string
+        t1 = time.perf_counter()
+        request_json = self._json_dumps(request_dict)
+        if not isinstance(request_json, bytes):
+            request_json = request_json.encode('ascii')
+        self.call_stats['encode_time'] += time.perf_counter() - t1
+
+        return self._call(request_json)[0]
+
+    def _query_raw(self, request_json):
+        """
+        Sends a json request to the hydstra server using hydllp.dll and returns the json response as it came from the dll. Only error responses are decoded (to raise the HydstraError), so the response can be passed on (e.g. by the bridge worker) and decoded once by the receiver.
+
+        Parameters
+        ----------
+        request_json : bytes or str
+            The json request.
+
+        Returns
+        -------
+        bytes
+        """
+        return self._call(request_json, raw=True)[1]
 
     def get_site_list(self, site_list_exp):
         # Generate a request of all the sites
@@ -271,6 +704,7 @@ class Hydllp(object):
         return (site_list_result["return"]["sites"])
 
     def get_variable_list(self, site_list, data_source):
+        import pandas as pd
 
         # Convert the site list to a comma delimited string of sites
         site_list_str = ",".join([str(site) for site in site_list])
@@ -282,25 +716,28 @@ class Hydllp(object):
 
         var_list_result = self.query_by_dict(var_list_request)
         list1 = var_list_result["return"]["sites"]
-        df1 = pd.DataFrame()
-        for i in list1:
-            site = i['site']
-            df_temp = pd.DataFrame(i['variables'])
-            df_temp['site'] = site
-            df1 = pd.concat([df1, df_temp], sort=False)
+
+        # Build the frame in one pass over all of the variables of all the sites
+        vars1 = [v for i in list1 for v in i['variables']]
+        sites1 = [i['site'] for i in list1 for v in i['variables']]
+        out_cols = ['site', 'varto', 'var_name', 'units', 'from_date', 'to_date']
+        if not vars1:
+            return pd.DataFrame(columns=out_cols)
+        df1 = pd.DataFrame(vars1)
+        df1['site'] = sites1
 
         ## Mangling
-        df2 = df1.copy().drop('subdesc', axis=1)
+        df2 = df1.drop('subdesc', axis=1)
+        variable = df2['variable'].astype(float)
+        df2 = df2[(variable % 1 == 0).values].copy()
+        df2['variable'] = variable[df2.index].astype('int32')
         df2['period_end'] = pd.to_datetime(df2['period_end'], format='%Y%m%d%H%M%S')
         df2['period_start'] = pd.to_datetime(df2['period_start'], format='%Y%m%d%H%M%S')
         df2['site'] = df2['site'].str.strip().astype(str)
-        df2['variable'] = df2['variable'].astype(float)
-        df2 = df2[df2['variable'].isin(df2['variable'].astype('int32'))]
-        df2['variable'] = df2['variable'].astype('int32')
-        df3 = df2.drop_duplicates().copy()
+        df3 = df2.drop_duplicates()
 
-        df3.rename(columns={'name': 'var_name', 'period_start': 'from_date', 'period_end': 'to_date', 'variable': 'varto'}, inplace=True)
-        df3 = df3[['site', 'varto', 'var_name', 'units', 'from_date', 'to_date']].reset_index(drop=True)
+        df3 = df3.rename(columns={'name': 'var_name', 'period_start': 'from_date', 'period_end': 'to_date', 'variable': 'varto'})
+        df3 = df3[out_cols].reset_index(drop=True)
 
         return df3
 
@@ -341,10 +778,23 @@ class Hydllp(object):
 
         return (db_area_result["return"]["sites"])
 
-    def get_ts_blockinfo(self, site_list, datasources=['A'], variables=['100', '10', '110', '140', '130', '143', '450'], start='1900-01-01', end='2100-01-01', from_mod_date='1900-01-01', to_mod_date='2100-01-01', fill_gaps=0, auditinfo=0):
+    def get_ts_blockinfo(self, site_list, datasources=['A'], variables=['100', '10', '110', '140', '130', '143', '450'], start='1900-01-01', end='2100-01-01', from_mod_date='1900-01-01', to_mod_date='2100-01-01', fill_gaps=0, auditinfo=0, sort=True):
         """
+        Wrapper function over hydllp to extract info about when data has changed between modification dates.
 
+        Parameters
+        ----------
+        site_list : list
+            Site numbers.
+        sort : bool
+            Should the output be sorted by site, varto, and from_mod_date? Set to False when the output will be combined and sorted later.
+
+        Returns
+        -------
+        DataFrame
+            With site, data_source, varto, from_mod_date, and to_mod_date.
         """
+        import pandas as pd
 
         # Convert the site list to a comma delimited string of sites
         if isinstance(site_list, list):
@@ -381,8 +831,10 @@ class Hydllp(object):
             df1['endtime'] = pd.to_datetime(df1['endtime'], format='%Y%m%d%H%M%S')
             df1['starttime'] = pd.to_datetime(df1['starttime'], format='%Y%m%d%H%M%S')
             df1['variable'] = pd.to_numeric(df1['variable'], errors='coerce', downcast='integer')
-            df2 = df1[['site', 'datasource', 'variable', 'starttime', 'endtime']].sort_values(['site', 'variable', 'starttime'])
-            df2.rename(columns={'datasource': 'data_source', 'variable': 'varto', 'starttime': 'from_mod_date', 'endtime': 'to_mod_date'}, inplace=True)
+            df2 = df1[['site', 'datasource', 'variable', 'starttime', 'endtime']]
+            if sort:
+                df2 = df2.sort_values(['site', 'variable', 'starttime'])
+            df2 = df2.rename(columns={'datasource': 'data_source', 'variable': 'varto', 'starttime': 'from_mod_date', 'endtime': 'to_mod_date'})
 
             return df2
 
@@ -420,6 +872,7 @@ class Hydllp(object):
         DataFrame
             In long format with site and time as a MultiIndex.
         """
+        import pandas as pd
 
         # Convert the site list to a comma delimited string of sites
         if isinstance(site_list, list):
@@ -476,6 +929,8 @@ class Hydllp(object):
                     df1 = df1[df1.qual_code.isin(qual_codes)]
                 out1 = pd.concat([out1, df1])
 
+        if out1.empty:
+            out1 = pd.DataFrame(columns=['site', 'time', 'data', 'qual_code'])
         out2 = out1.set_index(['site', 'time'])[['data', 'qual_code']]
 
         return out2
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Request planner to coalesce and deduplicate get_ts_traces requests from different callers.
+"""
+import numpy as np
+import pandas as pd
+from pyhydllp import util, hydllp
+
+## The gap between two windows that still counts as adjacent
+interval_gap = {'second': 'seconds', 'minute': 'minutes', 'hour': 'hours', 'day': 'days', 'month': 'months', 'year': 'years'}
+
+## The pandas frequencies to align the aggregated windows to
+interval_floor = {'second': 's', 'minute': 'min', 'hour': 'h', 'day': 'D'}
+
+
+def _floor_time(t, interval, multiplier):
+    """
+    Floor a time to the start of its aggregation period. The periods of a multiplier are counted from the epoch (or from year 0 for months and years), so all windows share the same period boundaries.
+    """
+    if interval in interval_floor:
+        return t.floor(str(int(multiplier)) + interval_floor[interval])
+    step = int(multiplier) * (12 if interval == 'year' else 1)
+    months = (t.year * 12 + t.month - 1) // step * step
+    return pd.Timestamp(year=months // 12, month=months % 12 + 1, day=1)
+
+
+def _align_window(start, end, data_type, interval, multiplier):
+    """
+    Widen a time window of an aggregated request to whole periods. The aligned window is half open: it starts at the first period that overlaps the window and ends at the end of the last one. None is unbounded. Windows of point data and period intervals are returned as they are.
+
+    Returns
+    -------
+    tuple
+        Of (start, end, aligned).
+    """
+    if (data_type == 'point') or (interval not in interval_gap):
+        return start, end, False
+    period = pd.DateOffset(**{interval_gap[interval]: int(multiplier)})
+    if start is not None:
+        start = _floor_time(start, interval, multiplier)
+    if end is not None:
+        end = _floor_time(end, interval, multiplier) + period
+    return start, end, True
+
+
+def ts_planner(self, sites_chunk=20):
+    """
+    Function to create a request planner. Requests are added to the planner and all of them are extracted together with the minimal set of get_ts_traces requests.
+
+    Parameters
+    ----------
+    sites_chunk : int
+        Number of sites to request to hydllp at one time.
+
+    Returns
+    -------
+    RequestPlanner
+    """
+    return RequestPlanner(self, sites_chunk=sites_chunk)
+
+
+class RequestPlanner(object):
+    """
+    Class to coalesce get_ts_traces requests. The requests are normalised per site, identical requests are deduplicated, and overlapping or adjacent time windows for the same site and variable are merged. The merged results are sliced back to each request.
+
+    The windows of aggregated requests (every data_type except point with an interval other than period) are widened to whole periods aligned to the interval (e.g. midnight for days, counted from the epoch for a multiplier) before they are merged. Merging then can't change the period boundaries, but a request that starts or ends within a period gets the whole period rather than a period counted from its start time.
+
+    Parameters
+    ----------
+    hyd : hyd
+        An initialised hyd object.
+    sites_chunk : int
+        Number of sites to request to hydllp at one time.
+
+    Returns
+    -------
+    RequestPlanner object
+    """
+    def __init__(self, hyd, sites_chunk=20):
+        self._hyd = hyd
+        self.sites_chunk = sites_chunk
+        self._requests = []
+
+    def add(self, sites, start=0, end=0, datasource='A', data_type='mean', varfrom=100, varto=140, qual_codes=None, interval='day', multiplier=1, report_time=None):
+        """
+        Add a request. The parameters are the same as get_ts_data, so start and end must either both be times or both be 0.
+
+        Returns
+        -------
+        int
+            The index of the request in the output of run.
+        """
+        key = (datasource, data_type, varfrom, varto, interval, multiplier, report_time)
+        sites1 = [str(s) for s in util.select_sites(sites)]
+        start0 = util.time_bound(start)
+        end0 = util.time_bound(end)
+        util.check_time_bounds(start0, end0)
+        start1, end1, aligned = _align_window(start0, end0, data_type, interval, multiplier)
+        self._requests.append({'key': key, 'sites': sites1, 'start': start1, 'end': end1, 'aligned': aligned, 'qual_codes': qual_codes})
+        return len(self._requests) - 1
+
+    def _merge_windows(self, windows, interval, multiplier, aligned=False):
+        """
+        Merge overlapping and adjacent time windows. None is unbounded. Aligned windows are half open, so they are only merged when they overlap or touch.
+        """
+        if (interval in interval_gap) and not aligned:
+            gap = pd.DateOffset(**{interval_gap[interval]: multiplier})
+        else:
+            gap = pd.DateOffset(0)
+
+        windows1 = sorted(set(windows), key=lambda w: pd.Timestamp.min if w[0] is None else w[0])
+        merged = [list(windows1[0])]
+        for start, end in windows1[1:]:
+            cur = merged[-1]
+            if (cur[1] is None) or (start is None) or (start <= cur[1] + gap):
+                if (cur[1] is not None) and ((end is None) or (end > cur[1])):
+                    cur[1] = end
+            else:
+                merged.append([start, end])
+
+        return [tuple(w) for w in merged]
+
+    def plan(self):
+        """
+        Compile the added requests into the minimal get_ts_traces requests.
+
+        Returns
+        -------
+        list of dict
+            The kwargs for each Hydllp.get_ts_traces call.
+        """
+        ### Normalise to site windows
+        site_windows = {}
+        aligned = {}
+        for req in self._requests:
+            util.check_time_bounds(req['start'], req['end'])
+            aligned[req['key']] = req['aligned']
+            for site in req['sites']:
+                site_windows.setdefault((req['key'], site), []).append((req['start'], req['end']))
+
+        ### Merge the windows per site and group the sites with the same windows
+        groups = {}
+        for (key, site), windows in site_windows.items():
+            for w in self._merge_windows(windows, key[4], key[5], aligned[key]):
+                groups.setdefault((key, w), []).append(site)
+
+        ### Build the requests
+        reqs = []
+        for (key, w), sites in groups.items():
+            datasource, data_type, varfrom, varto, interval, multiplier, report_time = key
+            start = 0 if w[0] is None else str(w[0])
+            end = 0 if w[1] is None else str(w[1])
+            n_chunks = np.ceil(len(sites) / float(self.sites_chunk))
+            for s in np.array_split(sites, n_chunks):
+                reqs.append(dict(site_list=s.tolist(), start=start, end=end, datasource=datasource, data_type=data_type, varfrom=varfrom, varto=varto, interval=interval, multiplier=multiplier, report_time=report_time))
+
+        return reqs
+
+    def run(self):
+        """
+        Extract all of the added requests.
+
+        Returns
+        -------
+        list of DataFrame
+            One DataFrame per added request (in the order they were added) in long format with site and time as a MultiIndex.
+        """
+        reqs = self.plan()
+
+        ### Extract the data
+        results = {}
+        with hydllp.openHyDb(self._hyd.hydllp) as h:
+            for req in reqs:
+                key = (req['datasource'], req['data_type'], req['varfrom'], req['varto'], req['interval'], req['multiplier'], req['report_time'])
+                df = h.get_ts_traces(**req)
+                results.setdefault(key, []).append(df)
+        results = {k: pd.concat(v).sort_index() for k, v in results.items()}
+
+        ### Slice the results back to the requests
+        out = []
+        for req in self._requests:
+            data = results.get(req['key'])
+            if data is None:
+                out.append(pd.DataFrame(columns=['data', 'qual_code'], index=pd.MultiIndex.from_arrays([[], []], names=['site', 'time'])))
+                continue
+            sites1 = data.index.get_level_values('site')
+            times1 = data.index.get_level_values('time')
+            mask = sites1.isin(req['sites'])
+            if not req['aligned']:
+                if req['start'] is not None:
+                    mask = mask & (times1 >= req['start'])
+                if req['end'] is not None:
+                    mask = mask & (times1 <= req['end'])
+            elif req['key'][6] == 'end':
+                ## The periods are reported at their end times
+                if req['start'] is not None:
+                    mask = mask & (times1 > req['start'])
+                if req['end'] is not None:
+                    mask = mask & (times1 <= req['end'])
+            else:
+                if req['start'] is not None:
+                    mask = mask & (times1 >= req['start'])
+                if req['end'] is not None:
+                    mask = mask & (times1 < req['end'])
+            if isinstance(req['qual_codes'], list):
+                mask = mask & data['qual_code'].isin(req['qual_codes']).values
+            out.append(data[mask])
+
+        return out
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in stage profiler for the extraction functions. Pass a Profiler as the profiler parameter of get_ts_data or get_ts_data_bulk to record the wall time, CPU time, and tracemalloc peak of each stage (and site).
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+import tracemalloc
+
+
+@contextlib.contextmanager
+def _null_stage():
+    yield {}
+
+
+def stage(profiler, name, site=None, hydllp=None):
+    """
+    Function to get the stage context manager of a profiler or a dummy one if profiler is None.
+    """
+    if profiler is None:
+        return _null_stage()
+    return profiler.stage(name, site=site, hydllp=hydllp)
+
+
+class Profiler(object):
+    """
+    Class to record the timings of the extraction stages. Stages can be nested and recorded from several threads. The memory peaks are only recorded while tracemalloc is tracing (e.g. when the profiler is used as a context manager with trace_memory=True). tracemalloc is process wide, so the peaks of stages that run in parallel threads include each other.
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Should tracemalloc be started when the profiler is used as a context manager? It slows down the code being profiled.
+
+    Returns
+    -------
+    Profiler object
+    """
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracing = False
+        self._t0 = time.perf_counter()
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return self
+
+    def __exit__(self, *args):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name, site=None, hydllp=None):
+        """
+        Context manager to record a stage. The yielded dict can be filled with extra info for the record.
+
+        Parameters
+        ----------
+        name : str
+            The stage name.
+        site : str or None
+            The site (or sites) of the stage.
+        hydllp : Hydllp or None
+            If given, the DLL call and json decode times of the stage are taken from the Hydllp call_stats.
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        tracing = tracemalloc.is_tracing()
+        frame = {}
+        if tracing:
+            cur, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame = {'start_mem': cur, 'peak': cur}
+        stack.append(frame)
+
+        if hydllp is not None:
+            stats0 = dict(hydllp.call_stats)
+        info = {}
+        t1 = time.perf_counter()
+        c1 = time.thread_time()
+        try:
+            yield info
+        finally:
+            c2 = time.thread_time()
+            t2 = time.perf_counter()
+            stack.pop()
+
+            record = {'stage': name, 'site': site, 'start': t1 - self._t0, 'wall': t2 - t1, 'cpu': c2 - c1, 'mem_peak': None, 'thread': threading.get_ident()}
+
+            if tracing and tracemalloc.is_tracing():
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record['mem_peak'] = peak - frame['start_mem']
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+
+            if hydllp is not None:
+                stats1 = hydllp.call_stats
+                record['dll_calls'] = stats1['calls'] - stats0['calls']
+                record['dll_time'] = stats1['call_time'] - stats0['call_time']
+                record['decode_time'] = stats1['decode_time'] - stats0['decode_time']
+
+            record.update(info)
+            with self._lock:
+                self.records.append(record)
+
+    def to_frame(self):
+        """
+        Get all of the stage records.
+
+        Returns
+        -------
+        DataFrame
+        """
+        import pandas as pd
+        return pd.DataFrame(self.records)
+
+    def report(self, by='stage'):
+        """
+        Summarise the stage records.
+
+        Parameters
+        ----------
+        by : str or list of str
+            The record fields to group by (e.g. 'stage' or ['stage', 'site']).
+
+        Returns
+        -------
+        DataFrame
+            With the number of records, the total wall and CPU times in seconds, and the max memory peak in MB.
+        """
+        df = self.to_frame()
+        if df.empty:
+            return df
+        df['mem_peak'] = df['mem_peak'].astype(float) / 1024 ** 2
+        grp = df.groupby(by, sort=False)
+        out = grp.agg(count=('wall', 'count'), wall=('wall', 'sum'), cpu=('cpu', 'sum'), mem_peak_mb=('mem_peak', 'max'))
+        return out.sort_values('wall', ascending=False)
+
+    def chrome_trace(self, path=None):
+        """
+        Convert the stage records to the Chrome trace event format (viewable in chrome://tracing or Perfetto).
+
+        Parameters
+        ----------
+        path : str or None
+            Path to save the json file to.
+
+        Returns
+        -------
+        dict
+        """
+        pid = os.getpid()
+        events = []
+        for r in self.records:
+            args = {k: v for k, v in r.items() if k not in ['stage', 'start', 'wall', 'thread'] and v is not None}
+            events.append({'name': r['stage'], 'cat': 'pyhydllp', 'ph': 'X', 'ts': round(r['start'] * 1e6, 3), 'dur': round(r['wall'] * 1e6, 3), 'pid': pid, 'tid': r['thread'], 'args': args})
+        trace = {'traceEvents': sorted(events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms'}
+
+        if isinstance(path, str):
+            with open(path, 'w') as f:
+                json.dump(trace, f, default=str)
+
+        return trace
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Record and replay of the Hydstra requests and responses. Responses recorded with Hydllp.start_recording can be served back offline by ReplayHydllp, at full speed or with the original call times, so benchmarks and tests can run on production shaped data without the server.
+
+The archive is a zip file with two members per call: NNNNNN.request.json with the request, the start time, the call time in seconds, and the error (if any), and NNNNNN.response.json with the response.
+"""
+import os
+import json
+import time
+import zipfile
+import threading
+from collections import deque
+from pyhydllp.hydllp import Hydllp, HydstraError
+
+
+class Recorder(object):
+    """
+    Class to record the query_by_dict calls to a zip archive. Use Hydllp.start_recording rather than this class directly.
+
+    Parameters
+    ----------
+    path : str
+        Path to the zip archive. An existing archive is appended to.
+
+    Returns
+    -------
+    Recorder object
+    """
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path, mode='a', compression=zipfile.ZIP_DEFLATED)
+        self._n = len([n for n in self._zip.namelist() if n.endswith('.request.json')])
+        self._lock = threading.Lock()
+
+    def record(self, fun, request_dict):
+        """
+        Call fun(request_dict) and record the request and the response or error.
+        """
+        start = time.time()
+        t1 = time.perf_counter()
+        try:
+            result = fun(request_dict)
+        except HydstraError as err:
+            self._write(request_dict, None, start, time.perf_counter() - t1, str(err))
+            raise
+        self._write(request_dict, result, start, time.perf_counter() - t1, None)
+        return result
+
+    def _write(self, request_dict, result, start, elapsed, error):
+        entry = json.dumps({'request': request_dict, 'start': start, 'elapsed': elapsed, 'error': error}, default=str)
+        response = json.dumps(result, default=str)
+        with self._lock:
+            self._n += 1
+            name = '{:06d}'.format(self._n)
+            self._zip.writestr(name + '.request.json', entry)
+            self._zip.writestr(name + '.response.json', response)
+
+    def close(self):
+        """
+        Close the archive.
+        """
+        with self._lock:
+            self._zip.close()
+
+
+def read_archive(path):
+    """
+    Function to read all of the recorded calls of an archive.
+
+    Parameters
+    ----------
+    path : str
+        Path to the zip archive.
+
+    Returns
+    -------
+    list of dict
+        The request, start, elapsed, and error of each call (in the order they were recorded) with the raw response json bytes.
+    """
+    calls = []
+    with zipfile.ZipFile(path) as z:
+        names = sorted([n[:-len('.request.json')] for n in z.namelist() if n.endswith('.request.json')])
+        for name in names:
+            entry = json.loads(z.read(name + '.request.json'))
+            entry['response'] = z.read(name + '.response.json')
+            calls.append(entry)
+
+    return calls
+
+
+def _request_key(request_dict):
+    return json.dumps(request_dict, sort_keys=True, default=str)
+
+
+class ReplayHydllp(Hydllp):
+    """
+    Hydllp object that serves the recorded responses of an archive instead of calling the hydllp.dll. Requests are matched on their contents. Requests that were recorded several times get their responses in the recorded order (starting again at the first when they run out). The responses are decoded on every call like real responses.
+
+    Parameters
+    ----------
+    path : str
+        Path to the zip archive.
+    timing : str
+        'fast' to return the responses immediately or 'original' to wait for the recorded call time.
+    speed : int or float
+        With the original timing, how many times faster than the recorded call time to return the responses.
+    json_codec : str
+        The json codec to decode the responses (orjson, ujson, simdjson, json, or auto).
+
+    Returns
+    -------
+    ReplayHydllp object
+    """
+    def __init__(self, path, timing='fast', speed=1, json_codec='auto'):
+        if timing not in ['fast', 'original']:
+            raise ValueError("timing must be either 'fast' or 'original'")
+
+        self._init_common(dict(path=path, timing=timing, speed=speed, json_codec=json_codec), json_codec=json_codec, server_key=(os.path.abspath(path),))
+        self._timing = timing
+        self._speed = speed
+
+        self._calls = {}
+        for entry in read_archive(path):
+            self._calls.setdefault(_request_key(entry['request']), []).append(entry)
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def login(self, username=None, password=None):
+        self._logged_in = True
+
+    def logout(self):
+        self._logged_in = False
+
+    def _query_by_dict(self, request_dict):
+        """
+        Serve the recorded response of a request.
+        """
+        key = _request_key(request_dict)
+        with self._lock:
+            if key not in self._calls:
+                raise HydstraError('No recorded response for the request: ' + key)
+            queue1 = self._queues.get(key)
+            if not queue1:
+                queue1 = self._queues[key] = deque(self._calls[key])
+            entry = queue1.popleft()
+
+        if self._timing == 'original':
+            time.sleep(entry['elapsed'] / self._speed)
+
+        if entry['error'] is not None:
+            raise HydstraError(entry['error'])
+
+        t1 = time.perf_counter()
+        result_dict = self._json_loads(memoryview(entry['response']))
+        t2 = time.perf_counter()
+
+        stats = self.call_stats
+        stats['calls'] += 1
+        stats['bytes_received'] += len(entry['response'])
+        stats['decode_time'] += t2 - t1
+
+        return result_dict
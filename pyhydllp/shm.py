@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Shared memory handoff of extracted time series data from worker processes. Each worker writes its decoded traces as plain arrays into a multiprocessing.shared_memory segment and only returns a small descriptor to the parent, so the data never needs to be pickled.
+
+The segment layout is (for n rows) the times as int64 nanoseconds, the values as float64, the site codes as int32 (indexes into the descriptor sites list), and the quality codes as float64 (so that missing quality codes stay NaN). The quality codes are downcast like in Hydllp.get_ts_traces when they are assembled.
+
+The workers keep their segments open until they exit and the parent reads the segments before it shuts the workers down, since Windows frees a segment when its last handle is closed. The segments are not registered with the resource trackers of the workers or the parent (which would unlink them or warn about leaks), the parent unlinks them after reading (see cleanup).
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor
+from pyhydllp import hydllp
+
+## The dtypes of the arrays in a segment in order
+_layout = [('time', np.int64), ('data', np.float64), ('site', np.int32), ('qual_code', np.float64)]
+
+## The segments written by this (worker) process. They are kept open until the process exits.
+_segments = {}
+
+
+def _views(buf, n):
+    """
+    Create the numpy arrays on a segment buffer.
+    """
+    arrays = {}
+    offset = 0
+    for name, dtype in _layout:
+        arrays[name] = np.frombuffer(buf, dtype=dtype, count=n, offset=offset)
+        offset += n * np.dtype(dtype).itemsize
+    return arrays
+
+
+def _open_segment(name=None, create=False, size=0):
+    """
+    Create or attach to a segment without registering it with the resource tracker.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    seg = shared_memory.SharedMemory(name=name, create=create, size=size)
+    if os.name != 'nt':
+        resource_tracker.unregister(seg._name, 'shared_memory')
+    return seg
+
+
+def write_traces(data):
+    """
+    Function to write the output of get_ts_traces to a new shared memory segment. The segment is kept open in this process for the parent process to read and unlink.
+
+    Parameters
+    ----------
+    data : DataFrame
+        In long format with site and time as a MultiIndex and data and qual_code columns.
+
+    Returns
+    -------
+    dict
+        The descriptor of the segment with the name, the number of rows, and the sites.
+    """
+    n = len(data)
+    size = sum([n * np.dtype(dtype).itemsize for name, dtype in _layout])
+
+    site_codes, sites = pd.factorize(data.index.get_level_values('site'))
+    times = data.index.get_level_values('time').values.astype('datetime64[ns]')
+
+    seg = _open_segment(create=True, size=max(size, 1))
+    _segments[seg.name] = seg
+    arrays = _views(seg.buf, n)
+    arrays['time'][:] = times.view(np.int64)
+    arrays['data'][:] = pd.to_numeric(data['data'], errors='coerce').values
+    arrays['site'][:] = site_codes
+    arrays['qual_code'][:] = pd.to_numeric(data['qual_code'], errors='coerce').values
+    del arrays
+
+    return {'name': seg.name, 'n': n, 'sites': [str(s) for s in sites]}
+
+
+def assemble(descriptors):
+    """
+    Function to assemble the segments into one DataFrame. The segments are copied once into the final arrays. Must be run while the workers that wrote the segments are still running.
+
+    Parameters
+    ----------
+    descriptors : list of dict
+        From write_traces.
+
+    Returns
+    -------
+    DataFrame
+        In long format with site and time as a MultiIndex.
+    """
+    total = sum([d['n'] for d in descriptors])
+    out = {name: np.empty(total, dtype=dtype) for name, dtype in _layout}
+    sites = []
+
+    start = 0
+    for d in descriptors:
+        n = d['n']
+        seg = _open_segment(name=d['name'])
+        try:
+            arrays = _views(seg.buf, n)
+            for name, dtype in _layout:
+                out[name][start:start + n] = arrays[name]
+            ## Shift the site codes into the combined sites list
+            out['site'][start:start + n] += len(sites)
+            del arrays
+        finally:
+            seg.close()
+        sites.extend(d['sites'])
+        start += n
+
+    index = pd.MultiIndex.from_arrays([np.asarray(sites, dtype=object)[out['site']], out['time'].view('datetime64[ns]')], names=['site', 'time'])
+
+    qual_code = pd.to_numeric(out['qual_code'], downcast='integer')
+
+    return pd.DataFrame({'data': out['data'], 'qual_code': qual_code}, index=index)
+
+
+def cleanup(descriptors):
+    """
+    Function to unlink the segments. Segments that have already been removed are ignored.
+
+    Parameters
+    ----------
+    descriptors : list of dict
+        From write_traces.
+    """
+    for d in descriptors:
+        try:
+            seg = shared_memory.SharedMemory(name=d['name'])
+        except FileNotFoundError:
+            continue
+        seg.close()
+        seg.unlink()
+
+
+def _extract_worker(hydllp_class, init_kwargs, sites_chunks, trace_kwargs):
+    """
+    Extract the site chunks in a worker process with its own Hydstra login and write the result to shared memory.
+    """
+    h1 = hydllp_class(**init_kwargs)
+    dfs = []
+    with hydllp.openHyDb(h1) as h:
+        for sites in sites_chunks:
+            dfs.append(h.get_ts_traces(site_list=sites, **trace_kwargs))
+    return write_traces(pd.concat(dfs))
+
+
+def get_ts_traces_processes(hydllp_obj, sites_chunks, processes, **trace_kwargs):
+    """
+    Function to extract the site chunks in parallel processes. Each process logs into Hydstra once and hands its data back via shared memory. The segments are read before the processes are shut down and they are always unlinked, also when an extraction fails.
+
+    Parameters
+    ----------
+    hydllp_obj : Hydllp
+        An initialised Hydllp object. Each process creates a new one with the same settings.
+    sites_chunks : list of list of str
+        The sites of each get_ts_traces request.
+    processes : int
+        The number of processes.
+    trace_kwargs
+        The other Hydllp.get_ts_traces parameters.
+
+    Returns
+    -------
+    DataFrame
+        In long format with site and time as a MultiIndex.
+    """
+    processes = max(min(processes, len(sites_chunks)), 1)
+    groups = [sites_chunks[int(i[0]):int(i[-1]) + 1] for i in np.array_split(np.arange(len(sites_chunks)), processes)]
+
+    descriptors = []
+    with ProcessPoolExecutor(processes) as executor:
+        try:
+            futures = [executor.submit(_extract_worker, hydllp_obj.__class__, hydllp_obj._init_kwargs, g, trace_kwargs) for g in groups]
+            errors = []
+            for f in futures:
+                ## Collect all of the segments before raising so that they are unlinked
+                try:
+                    descriptors.append(f.result())
+                except Exception as err:
+                    errors.append(err)
+            if errors:
+                raise errors[0]
+            ## The workers still hold their segments open
+            data = assemble(descriptors)
+        finally:
+            cleanup(descriptors)
+
+    return data
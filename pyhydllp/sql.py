@@ -4,13 +4,270 @@ Created on Mon Mar 26 20:49:35 2018
 
 @author: michaelek
 """
+import contextlib
 import pandas as pd
 import pdsql
 
 
-def rating_changes(server, database, sites=None, from_mod_date=None, to_mod_date=None, username=None, password=None):
+class SqlPool(object):
     """
-    Function to determine flow rating changes during a specified period.
+    Class to hold a pool of connections to the Hydstra SQL database that can be shared between the sql functions. Statements are sent with bound parameters. The sqlalchemy text constructs of the statements are kept in a dict and the engine caches their compiled forms (query_cache_size, which needs SQLAlchemy >= 1.4). SQLAlchemy 1.4 and 2.x are supported. Whether the server reuses a query plan is up to the server and driver.
+
+    Parameters
+    ----------
+    server : str
+        The SQL server name.
+    database : str
+        The database name.
+    username : str or None
+        The SQL username. None will use a trusted connection.
+    password : str or None
+        Same as username, but for password.
+    pool_size : int
+        The number of connections to keep open in the pool.
+    max_overflow : int
+        The number of connections that can be opened in addition to pool_size when the pool is exhausted.
+    statement_cache_size : int
+        The number of compiled statements for the engine to cache.
+
+    Returns
+    -------
+    SqlPool object
+    """
+    def __init__(self, server, database, username=None, password=None, pool_size=5, max_overflow=5, statement_cache_size=500):
+        import sqlalchemy
+
+        self.server = server
+        self.database = database
+        self._username = username
+        self._password = password
+
+        ## Let pdsql determine the driver and url, then recreate the engine with the pool settings
+        engine = pdsql.create_engine('mssql', server, database, username=username, password=password)
+        self.engine = sqlalchemy.create_engine(engine.url, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True, query_cache_size=statement_cache_size)
+        engine.dispose()
+
+        self._stmts = {}
+
+    @classmethod
+    def from_engine(cls, engine, server=None, database=None):
+        """
+        Create an SqlPool from an existing sqlalchemy engine (e.g. one with custom pool settings or an SQLite engine for testing). rd_sql still requires an MSSQL engine.
+
+        Parameters
+        ----------
+        engine : sqlalchemy engine
+            The engine. It's disposed of with the pool.
+        server : str or None
+            The SQL server name.
+        database : str or None
+            The database name.
+
+        Returns
+        -------
+        SqlPool object
+        """
+        self = cls.__new__(cls)
+        self.server = server
+        self.database = database
+        self._username = None
+        self._password = None
+        self.engine = engine
+        self._stmts = {}
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.dispose()
+
+    def statement(self, stmt):
+        """
+        Return the sqlalchemy text construct of an SQL statement. The constructs are kept so that each statement is only parsed once.
+        """
+        if stmt not in self._stmts:
+            import sqlalchemy
+            self._stmts[stmt] = sqlalchemy.text(stmt)
+        return self._stmts[stmt]
+
+    def read_sql(self, stmt, params=None, con=None, **kwargs):
+        """
+        Function to read the results of an SQL statement with bound parameters (e.g. :from_date) into a DataFrame.
+
+        Parameters
+        ----------
+        stmt : str
+            The SQL statement.
+        params : dict or None
+            The bound parameter values.
+        con : sqlalchemy connection or None
+            An open connection from this pool. None will use a connection from the pool for the duration of the call.
+        kwargs
+            Passed to pandas.read_sql.
+
+        Returns
+        -------
+        DataFrame
+        """
+        if con is None:
+            with self.engine.connect() as con:
+                return pd.read_sql(self.statement(stmt), con, params=params, **kwargs)
+        else:
+            return pd.read_sql(self.statement(stmt), con, params=params, **kwargs)
+
+    def rating_changes(self, sites=None, from_mod_date=None, to_mod_date=None):
+        """
+        Function to run the rating changes query of sql.rating_changes. With many sites, the sites are written to a temporary table in the same transaction as the query.
+
+        Parameters
+        ----------
+        sites: list of str or None
+            List of sites to be returned. None includes all sites.
+        from_mod_date: str or None
+            The starting date when the data has been modified.
+        to_mod_date: str or None
+            The ending date when the data has been modified.
+
+        Returns
+        -------
+        DataFrame
+            With site and from_date as returned by the server.
+        """
+        stmt, params, temp_sites = _rating_changes_stmt(sites, from_mod_date, to_mod_date)
+
+        if temp_sites is not None:
+            with self.engine.begin() as conn:
+                pd.DataFrame({'site': temp_sites}).to_sql(rate_sites_tab, con=conn, if_exists='replace', index=False, chunksize=1000)
+                return self.read_sql(stmt, params, con=conn)
+        else:
+            return self.read_sql(stmt, params)
+
+    def rd_sql(self, **kwargs):
+        """
+        Function to call pdsql.mssql.rd_sql with a connection from the pool. The kwargs are passed to rd_sql.
+
+        Returns
+        -------
+        DataFrame
+        """
+        with self.engine.connect() as con:
+            return pdsql.mssql.rd_sql(self.server, self.database, con=con, **kwargs)
+
+    def dispose(self):
+        """
+        Close all connections in the pool.
+        """
+        self.engine.dispose()
+
+
+class _LazySqlPool(object):
+    """
+    Stand-in for a single connection SqlPool that is only created when it is first used, so that callers that don't end up querying SQL (e.g. with a fresh site catalog) never connect.
+    """
+    def __init__(self, server, database, username=None, password=None):
+        self.server = server
+        self.database = database
+        self._username = username
+        self._password = password
+        self._pool = None
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if self._pool is None:
+            self._pool = SqlPool(self.server, self.database, self._username, self._password, pool_size=1, max_overflow=0)
+        return getattr(self._pool, name)
+
+    def dispose(self):
+        if self._pool is not None:
+            self._pool.dispose()
+            self._pool = None
+
+
+@contextlib.contextmanager
+def open_pool(server, database, username=None, password=None, pool=None):
+    """
+    SqlPool content manager generator. Yields the passed pool if there is one (an SqlPool or a stand-in like synthetic.SyntheticSqlPool), otherwise a single connection pool is created when it is first used and disposed of on exit.
+
+    Parameters
+    ----------
+    server : str
+        The SQL server name.
+    database : str
+        The database name.
+    username : str or None
+        The SQL username. None will use a trusted connection.
+    password : str or None
+        Same as username, but for password.
+    pool : SqlPool or None
+        An existing SqlPool.
+
+    Returns
+    -------
+    Generator
+    """
+    if pool is not None:
+        yield pool
+    else:
+        pool1 = _LazySqlPool(server, database, username, password)
+        try:
+            yield pool1
+        finally:
+            pool1.dispose()
+
+
+## The temporary table of the rating_changes sites
+rate_sites_tab = '#rate_sites'
+
+
+def _rating_changes_stmt(sites=None, from_mod_date=None, to_mod_date=None, max_in_sites=1000):
+    """
+    Function to build the rating changes statement of rating_changes. More than max_in_sites sites are joined from the temporary rate_sites_tab table rather than listed in an IN clause.
+
+    Returns
+    -------
+    tuple
+        Of the statement, the bound parameters, and the sites for the temporary table (None if it's not used).
+    """
+    stmt = """SELECT RTRIM(per.STATION) AS site, MIN(DATEADD(minute, (CAST(per.STIME AS int) / 100) * 60 + CAST(per.STIME AS int) % 100, per.SDATE)) AS from_date
+    FROM RATEPER per
+    INNER JOIN RATEHED hed ON per.STATION = hed.STATION AND per.REFTAB = hed.[TABLE]
+    {join}{where}
+    GROUP BY RTRIM(per.STATION)"""
+
+    ### Where statements
+    where_lst = []
+    params = {}
+    if isinstance(from_mod_date, str):
+        where_lst.append("hed.RELDATE >= :from_mod_date")
+        params['from_mod_date'] = pd.Timestamp(from_mod_date).to_pydatetime()
+    if isinstance(to_mod_date, str):
+        where_lst.append("hed.RELDATE <= :to_mod_date")
+        params['to_mod_date'] = pd.Timestamp(to_mod_date).to_pydatetime()
+
+    temp_sites = None
+    join = ''
+    if isinstance(sites, list):
+        sites1 = pd.Series(sites, name='site').astype(str).str.strip().unique().tolist()
+        if len(sites1) > max_in_sites:
+            join = "INNER JOIN {} s ON hed.STATION = s.site\n    ".format(rate_sites_tab)
+            temp_sites = sites1
+        else:
+            sites_str = ', '.join(["'" + i.replace("'", "''") + "'" for i in sites1])
+            where_lst.append("hed.STATION IN ({})".format(sites_str))
+
+    if where_lst:
+        where = 'WHERE ' + ' AND '.join(where_lst)
+    else:
+        where = ''
+
+    return stmt.format(join=join, where=where), params, temp_sites
+
+
+def rating_changes(server, database, sites=None, from_mod_date=None, to_mod_date=None, username=None, password=None, pool=None):
+    """
+    Function to determine flow rating changes during a specified period. The RATEHED and RATEPER tables are joined and aggregated in a single query on the server.
 
     Parameters
     ----------
@@ -24,54 +281,29 @@ def rating_changes(server, database, sites=None, from_mod_date=None, to_mod_date
         The starting date when the data has been modified.
     to_mod_date: str
         The ending date when the data has been modified.
+    pool : SqlPool or None
+        A shared SqlPool. None will open a new connection.
 
     Returns
     -------
     DataFrame
         With site, varfrom, varto, and from_date
     """
-    ### Parameters
-    table_per = 'RATEPER'
-    table_hed = 'RATEHED'
-    fields_per = ['STATION', 'VARFROM', 'VARTO', 'SDATE', 'STIME', 'REFTAB', 'PHASE']
-    names_per = ['site', 'varfrom', 'varto', 'sdate', 'stime', 'reftab', 'phase']
-    fields_hed = ['STATION', 'VARFROM', 'VARTO', 'TABLE', 'RELDATE']
-    names_hed = ['site', 'varfrom', 'varto', 'reftab', 'date']
-
     ### Read data
-    if sites is not None:
-        if isinstance(sites, list):
-            where_in = {'STATION': sites}
-        else:
-            where_in = None
-    else:
-            where_in = None
+    with open_pool(server, database, username, password, pool) as pool1:
+        rate_per = pool1.rating_changes(sites, from_mod_date, to_mod_date)
 
-    rate_hed = pdsql.mssql.rd_sql(server, database, table_hed, fields_hed, where_in, rename_cols=names_hed, from_date=from_mod_date, to_date=to_mod_date, date_col='RELDATE', username=username, password=password)
-    if rate_hed.empty:
+    if rate_per.empty:
         return pd.DataFrame()
     else:
-        rate_hed['site'] = rate_hed['site'].str.strip()
-
-        where_per = {'STATION': rate_hed['site'].astype(str).unique().tolist()}
-
-        rate_per = pdsql.mssql.rd_sql(server, database, table_per, fields_per, where_per, rename_cols=names_per, where_op='OR', username=username, password=password)
-        rate_per['site'] = rate_per['site'].str.strip()
-        time1 = pd.to_timedelta(rate_per['stime'].astype(int) // 100, unit='H') + pd.to_timedelta(rate_per['stime'].astype(int) % 100, unit='m')
-        rate_per['sdate'] = rate_per['sdate'] + time1
-        rate_per = rate_per.sort_values(['site', 'sdate']).reset_index(drop=True).drop('stime', axis=1)
+        rate_per['from_date'] = pd.to_datetime(rate_per['from_date'])
+        rate_per['varfrom'] = 100
+        rate_per['varto'] = 140
 
-        rate_per1 = pd.merge(rate_per, rate_hed[['site', 'reftab']], on=['site', 'reftab'])
-        rate_per2 = rate_per1.groupby('site')['sdate'].min().reset_index()
-        rate_per2.columns = ['site', 'from_date']
+        return rate_per[['site', 'varfrom', 'varto', 'from_date']].sort_values('site').reset_index(drop=True)
 
-        rate_per2['varfrom'] = 100
-        rate_per2['varto'] = 140
 
-        return rate_per2[['site', 'varfrom', 'varto', 'from_date']]
-
-
-def sql_sites_var(server, database, varto=None, data_source='A', username=None, password=None):
+def sql_sites_var(server, database, varto=None, data_source='A', username=None, password=None, pool=None):
     """
     Function to extract all of the sites associated with specific varto codes. Calls to the site data stored in an SQL server.
 
@@ -85,6 +317,8 @@ def sql_sites_var(server, database, varto=None, data_source='A', username=None,
         The Hydstra specific variable codes. None equates to all varto's.
     data_source: str
         The Hydstra data source ID. 'A' is archive.
+    pool : SqlPool or None
+        A shared SqlPool. None will open a new connection.
 
     Returns
     -------
@@ -111,7 +345,8 @@ def sql_sites_var(server, database, varto=None, data_source='A', username=None,
     else:
         raise TypeError('period_where must be None, int, or list')
 
-    period1 = pdsql.mssql.rd_sql(server, database, period_tab, period_cols, where_in=period_where, rename_cols=period_names, username=username, password=password)
+    with open_pool(server, database, username, password, pool) as pool1:
+        period1 = pool1.rd_sql(table=period_tab, col_names=period_cols, where_in=period_where, rename_cols=period_names)
     period1.loc[:, 'site'] = period1.site.str.strip()
 
     ### Determine the variables to extract
@@ -129,7 +364,7 @@ def sql_sites_var(server, database, varto=None, data_source='A', username=None,
     return period3
 
 
-def gaugings(server, database, sites=None, mtypes=['wl', 'flow'], from_date=None, to_date=None, from_mod_date=None, to_mod_date=None, stacked=False, username=None, password=None):
+def gaugings(server, database, sites=None, mtypes=['wl', 'flow'], from_date=None, to_date=None, from_mod_date=None, to_mod_date=None, stacked=False, username=None, password=None, pool=None):
     """
     Function to extract gaugings data from Hydstra SQL.
 
@@ -153,6 +388,8 @@ def gaugings(server, database, sites=None, mtypes=['wl', 'flow'], from_date=None
         The end modification date that should be extracted. If not None, has priority over to_date.
     stacked : bool
         Should the mtypes and data be stacked or not.
+    pool : SqlPool or None
+        A shared SqlPool. None will open a new connection.
 
     Returns
     -------
@@ -163,12 +400,94 @@ def gaugings(server, database, sites=None, mtypes=['wl', 'flow'], from_date=None
     The supported mtypes are:
         wl, flow, temp, width, area, velocity, maxdepth, and wettedper
     """
+    ### Extract the gaugings
+    cols, rename_cols = _gaugings_cols(mtypes)
+
+    if isinstance(sites, list):
+        where_in = {'STN': sites}
+    else:
+        where_in = None
+
+    with open_pool(server, database, username, password, pool) as pool1:
+        if isinstance(from_mod_date, str) | isinstance(to_mod_date, str):
+            g1 = pool1.rd_sql(table='GAUGINGS', col_names=cols, where_in=where_in, from_date=from_mod_date, to_date=to_mod_date, date_col='DATEMOD', rename_cols=rename_cols)
+        else:
+            g1 = pool1.rd_sql(table='GAUGINGS', col_names=cols, where_in=where_in, from_date=from_date, to_date=to_date, date_col='MEAS_DATE', rename_cols=rename_cols)
+
+    return _process_gaugings(g1, mtypes, stacked)
+
+
+def gaugings_chunks(server, database, sites=None, mtypes=['wl', 'flow'], from_date=None, to_date=None, from_mod_date=None, to_mod_date=None, stacked=False, chunksize=100000, username=None, password=None, pool=None):
+    """
+    Generator to extract gaugings data from Hydstra SQL in chunks. The result rows are streamed from the server so that large extractions run in constant memory. The parameters and outputs are the same as gaugings, but returned as one DataFrame per chunk.
+
+    Parameters
+    ----------
+    server : str
+        The SQL server name.
+    database : str
+        The database name.
+    sites : list
+        List of sites to be extracted.
+    mtypes : list
+        List of generic measurement types to be extracted (see gaugings).
+    from_date : str or None
+        The start date that should be extracted.
+    to_date : str or None
+        The end date that should be extracted.
+    from_mod_date : str or None
+        The start modification date that should be extracted. If not None, has priority over from_date.
+    to_mod_date : str or None
+        The end modification date that should be extracted. If not None, has priority over to_date.
+    stacked : bool
+        Should the mtypes and data be stacked or not.
+    chunksize : int
+        The number of gaugings rows per chunk.
+    pool : SqlPool or None
+        A shared SqlPool. None will open a new connection.
+
+    Returns
+    -------
+    Generator of DataFrames
+    """
+    ### Build the statement
+    cols, rename_cols = _gaugings_cols(mtypes)
+    col_stmt = ', '.join(['[' + c + ']' for c in cols])
+
+    if isinstance(sites, list):
+        where_in = {'STN': sites}
+    else:
+        where_in = None
+
+    if isinstance(from_mod_date, str) | isinstance(to_mod_date, str):
+        where_lst, where_temp = pdsql.mssql.sql_where_stmts(where_in=where_in, from_date=from_mod_date, to_date=to_mod_date, date_col='DATEMOD')
+    else:
+        where_lst, where_temp = pdsql.mssql.sql_where_stmts(where_in=where_in, from_date=from_date, to_date=to_date, date_col='MEAS_DATE')
+
+    stmt = 'SELECT ' + col_stmt + ' FROM GAUGINGS'
+    if isinstance(where_lst, list):
+        stmt = stmt + ' where ' + ' and '.join(where_lst)
+
+    ### Stream the results
+    with open_pool(server, database, username, password, pool) as pool1:
+        with pool1.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True)
+            for key, value in where_temp.items():
+                pd.DataFrame(data=value, columns=[key]).to_sql('#temp_' + key.lower(), con=conn, if_exists='replace', index=False, chunksize=1000)
+            for g1 in pool1.read_sql(stmt, con=conn, chunksize=chunksize):
+                g1.columns = rename_cols
+                yield _process_gaugings(g1, mtypes, stacked)
+
+
+def _gaugings_cols(mtypes):
+    """
+    Function to determine the GAUGINGS table column names and their output names for the mtypes.
+    """
     ### Extract the mtype codes
     mtype_dict = {'wl': 'M_GH', 'flow': 'FLOW', 'area': 'AREA', 'velocity': 'VELOCITY', 'maxdepth': 'MAXDEPTH', 'wettedper': 'WETTEDPER', 'temp': 'TEMP', 'width': 'WIDTH', 'deviation': 'DEVIATION'}
 
     mtypes_code = [mtype_dict[i] for i in mtypes if i in mtype_dict]
 
-    ### Extract the gaugings
     cols = ['STN', 'MEAS_DATE', 'END_TIME']
     cols.extend(mtypes_code)
     cols.extend(['QUALITY'])
@@ -177,28 +496,24 @@ def gaugings(server, database, sites=None, mtypes=['wl', 'flow'], from_date=None
     rename_cols.extend(['qual_code'])
     cols.append('DATEMOD')
     rename_cols.append('mod_date')
-#    mtypes.append('mod_date')
 
-    if isinstance(sites, list):
-        where_in = {'STN': sites}
-    else:
-        where_in = None
+    return cols, rename_cols
 
-    if isinstance(from_mod_date, str) | isinstance(to_mod_date, str):
-        g1 = pdsql.mssql.rd_sql(server, database, 'GAUGINGS', cols, where_in, from_date=from_mod_date, to_date=to_mod_date, date_col='DATEMOD', rename_cols=rename_cols, username=username, password=password)
-    else:
-        g1 = pdsql.mssql.rd_sql(server, database, 'GAUGINGS', cols, where_in, from_date=from_date, to_date=to_date, date_col='MEAS_DATE', rename_cols=rename_cols, username=username, password=password)
+
+def _process_gaugings(g1, mtypes, stacked):
+    """
+    Function to clean up the raw GAUGINGS table rows. The measurement date and END_TIME (hhmm as an int) are combined into a single time column.
+    """
     g1.site = g1.site.str.strip()
     g1 = g1[g1.site.notnull()].copy()
     g1.loc[~(g1.time >= 100), 'time'] = 1200
-    dt1 = pd.to_datetime(g1.date.astype(str) + ' ' + g1.time.astype(int).astype(str), format='%Y-%m-%d %H%M')
-    g1.time = dt1
+    time1 = g1.time.astype(int)
+    g1.time = pd.to_datetime(g1.date).dt.normalize() + pd.to_timedelta((time1 // 100) * 60 + time1 % 100, unit='m')
     g2 = g1.drop('date', axis=1)
 
     if stacked:
-#        mtypes.append('qual_code')
-        g3 = g2.melt(id_vars=['site', 'time'], value_vars=mtypes, var_name='mtype')
-        g3 = pd.merge(g3, g2[['site', 'time', 'qual_code', 'mod_date']], on=['site', 'time']).set_index(['site', 'time', 'mtype'])
+        g3 = g2.melt(id_vars=['site', 'time', 'qual_code', 'mod_date'], value_vars=mtypes, var_name='mtype')
+        g3 = g3.set_index(['site', 'time', 'mtype'])[['value', 'qual_code', 'mod_date']]
     else:
         g3 = g2.set_index(['site', 'time'])
     return g3
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic Hydstra inventories and data for scaling tests. A SyntheticHydstra object generates consistent sites, record periods, gaps, quality codes, and edit and rating histories from a seed. FakeHydllp serves it in place of the hydllp.dll and SyntheticSqlPool in place of the Hydstra SQL database, so whole extractions (e.g. get_ts_data_bulk) can be run locally at any scale:
+
+    syn = SyntheticHydstra(n_sites=10000, start='1970-01-01', end='2020-01-01', freq='15min')
+    hyd1 = hyd.from_hydllp(FakeHydllp(syn), sql_pool=SyntheticSqlPool(syn))
+    hyd1.get_ts_data_bulk('synthetic', 'hydstra', varto=140, export='flow.h5')
+
+The time series values are deterministic functions of the site and time, so the same data is returned for overlapping requests.
+"""
+import time
+import numpy as np
+import pandas as pd
+from pyhydllp.hydllp import Hydllp, HydstraError
+
+## The pandas frequencies of the hydllp intervals
+interval_freq = {'year': 'YS', 'month': 'MS', 'day': 'D', 'hour': 'h', 'minute': 'min', 'second': 's'}
+
+## The aggregation of the hydllp data types
+data_type_agg = {'mean': 'mean', 'maxmin': 'mean', 'tot': 'sum', 'partialtot': 'sum', 'max': 'max', 'min': 'min', 'start': 'first', 'first': 'first', 'end': 'last', 'last': 'last'}
+
+var_names = {10: ('Rainfall', 'mm'), 100: ('Water Level', 'm'), 140: ('Discharge', 'cumec'), 143: ('Discharge', 'l/s'), 110: ('Ground Water Level', 'm'), 130: ('Lake Level', 'm'), 450: ('Water Temperature', 'degC')}
+
+
+def _hydstra_time(times):
+    """
+    Convert datetime64 values to the hydllp time strings (YYYYMMDDHHMMSS).
+    """
+    t1 = np.datetime_as_string(np.asarray(times, dtype='datetime64[s]'), unit='s')
+    if t1.size == 0:
+        return t1.astype(str)
+    for c in ['-', 'T', ':']:
+        t1 = np.char.replace(t1, c, '')
+    return t1
+
+
+def _to_datetime(ns):
+    """
+    Convert int64 nanoseconds to datetimes rounded down to the second like the Hydstra times.
+    """
+    return pd.to_datetime(np.asarray(ns, dtype='int64') // 1000000000 * 1000000000)
+
+
+def _hydllp_time(t, default):
+    """
+    Convert a hydllp request time (YYYYMMDDHHMMSS or 0) to a Timestamp.
+    """
+    if (t == 0) or (t == '0') or (t is None):
+        return default
+    return pd.Timestamp(pd.to_datetime(str(t), format='%Y%m%d%H%M%S'))
+
+
+class SyntheticHydstra(object):
+    """
+    Class to generate a consistent synthetic Hydstra inventory and its time series data.
+
+    Parameters
+    ----------
+    n_sites : int
+        The number of sites.
+    start : str
+        The earliest record start.
+    end : str
+        The latest record end.
+    freq : str
+        The pandas frequency of the recorded data (e.g. '15min').
+    variables : list of tuple or None
+        The (varfrom, varto) of each site. (100, 140) is rated flow from water level. None is [(100, 100), (100, 140), (10, 10)].
+    qual_codes : dict or None
+        The quality codes and their probabilities. Each day of a site gets one quality code. None is {10: 0.1, 20: 0.1, 30: 0.8}.
+    gaps_per_site : int
+        The number of gaps in the record of each site.
+    gap_days : int or float
+        The max length of the gaps in days.
+    edits_per_site : int
+        The number of edits in the edit history of each site and variable.
+    ratings_per_site : int
+        The number of rating changes of each rated flow site.
+    seed : int
+        The random seed.
+    data_source : str
+        The Hydstra data source.
+
+    Returns
+    -------
+    SyntheticHydstra object
+    """
+    def __init__(self, n_sites=100, start='1970-01-01', end='2020-01-01', freq='15min', variables=None, qual_codes=None, gaps_per_site=2, gap_days=30, edits_per_site=5, ratings_per_site=2, seed=0, data_source='A'):
+        if variables is None:
+            variables = [(100, 100), (100, 140), (10, 10)]
+        if qual_codes is None:
+            qual_codes = {10: 0.1, 20: 0.1, 30: 0.8}
+
+        self.start = pd.Timestamp(start)
+        self.end = pd.Timestamp(end)
+        self.freq = freq
+        self.variables = list(variables)
+        self.data_source = data_source
+        self._qual_codes = np.array(list(qual_codes.keys()), dtype='int16')
+        self._qual_cum = np.cumsum(list(qual_codes.values())) / float(sum(qual_codes.values()))
+
+        rng = np.random.default_rng(seed)
+        self.sites = [str(60000 + i) for i in range(n_sites)]
+        self._site_index = {s: i for i, s in enumerate(self.sites)}
+        span = (self.end - self.start).value
+
+        ### Record periods - aligned to the data frequency
+        step = pd.Timedelta(freq).value
+        from1 = self.start.value + (rng.uniform(0, 0.2, n_sites) * span // step * step).astype('int64')
+        to1 = self.end.value - (rng.uniform(0, 0.05, n_sites) * span // step * step).astype('int64')
+        self.periods = pd.DataFrame({'site': self.sites, 'from_date': pd.to_datetime(from1), 'to_date': pd.to_datetime(to1)})
+
+        ### Site parameters of the value functions
+        self._base = rng.uniform(1, 10, n_sites)
+        self._phase = rng.uniform(0, 2 * np.pi, n_sites)
+
+        ### Gaps
+        gap_sites = np.repeat(np.arange(n_sites), gaps_per_site)
+        gap_from = from1[gap_sites] + (rng.uniform(0, 1, len(gap_sites)) * (to1 - from1)[gap_sites]).astype('int64')
+        gap_to = gap_from + (rng.uniform(0, gap_days, len(gap_sites)) * 86400e9).astype('int64')
+        self.gaps = pd.DataFrame({'site': np.array(self.sites, dtype=object)[gap_sites], 'from_date': _to_datetime(gap_from), 'to_date': _to_datetime(gap_to)})
+
+        ### Edit histories - the modification date is after the edited data
+        vartos = sorted(set([v[0] for v in self.variables] + [v[1] for v in self.variables if v[0] == v[1]]))
+        edits = []
+        for varto in vartos:
+            e_sites = np.repeat(np.arange(n_sites), edits_per_site)
+            e_from = from1[e_sites] + (rng.uniform(0, 1, len(e_sites)) * (to1 - from1)[e_sites]).astype('int64')
+            e_to = np.minimum(e_from + (rng.uniform(0, 365, len(e_sites)) * 86400e9).astype('int64'), to1[e_sites])
+            e_mod = e_to + (rng.uniform(0, 365, len(e_sites)) * 86400e9).astype('int64')
+            edits.append(pd.DataFrame({'site': np.array(self.sites, dtype=object)[e_sites], 'varto': varto, 'mod_date': _to_datetime(e_mod), 'from_date': _to_datetime(e_from), 'to_date': _to_datetime(e_to)}))
+        self.edits = pd.concat(edits).sort_values(['site', 'varto', 'mod_date']).reset_index(drop=True)
+
+        ### Rating changes of the rated flow sites
+        if (100, 140) in self.variables:
+            r_sites = np.repeat(np.arange(n_sites), ratings_per_site)
+            r_from = from1[r_sites] + (rng.uniform(0, 1, len(r_sites)) * (to1 - from1)[r_sites]).astype('int64')
+            r_rel = r_from + (rng.uniform(0, 365, len(r_sites)) * 86400e9).astype('int64')
+            self.ratings = pd.DataFrame({'site': np.array(self.sites, dtype=object)[r_sites], 'rel_date': _to_datetime(r_rel), 'from_date': _to_datetime(r_from)})
+        else:
+            self.ratings = pd.DataFrame(columns=['site', 'rel_date', 'from_date'])
+
+    ### Inventory
+
+    def period_table(self):
+        """
+        The PERIOD table rows (as used by sql.sql_sites_var).
+
+        Returns
+        -------
+        DataFrame
+            With STATION, DATASOURCE, VARFROM, and VARIABLE.
+        """
+        rows = [(s, self.data_source, float(varfrom), float(varto)) for s in self.sites for varfrom, varto in self.variables]
+        return pd.DataFrame(rows, columns=['STATION', 'DATASOURCE', 'VARFROM', 'VARIABLE'])
+
+    def variable_list(self, sites, data_source='A'):
+        """
+        The return of the hydllp get_variable_list function.
+        """
+        periods = self.periods.set_index('site')
+        vartos = sorted(set([v[1] for v in self.variables] + [v[0] for v in self.variables]))
+        out = []
+        for s in sites:
+            s = str(s).strip()
+            if (s not in self._site_index) or (data_source != self.data_source):
+                continue
+            p_from, p_to = _hydstra_time([periods.at[s, 'from_date'], periods.at[s, 'to_date']])
+            variables = [{'variable': '{:.2f}'.format(v), 'name': var_names.get(v, ('Variable ' + str(v), ''))[0], 'units': var_names.get(v, ('', ''))[1], 'subdesc': '', 'period_start': str(p_from), 'period_end': str(p_to)} for v in vartos]
+            out.append({'site': s, 'variables': variables})
+        return {'sites': out}
+
+    def blockinfo(self, sites, variables, starttime, endtime, start_modified, end_modified):
+        """
+        The return of the hydllp get_ts_blockinfo function from the edit histories.
+        """
+        e1 = self.edits
+        mask = e1['site'].isin([str(s) for s in sites]) & e1['varto'].isin([int(float(v)) for v in variables])
+        mask &= (e1['mod_date'] >= start_modified) & (e1['mod_date'] <= end_modified)
+        mask &= (e1['to_date'] >= starttime) & (e1['from_date'] <= endtime)
+        e2 = e1[mask]
+        blocks = pd.DataFrame({'site': e2['site'].values, 'datasource': self.data_source, 'variable': e2['varto'].map('{:.2f}'.format).values, 'starttime': _hydstra_time(e2['from_date'].values), 'endtime': _hydstra_time(e2['to_date'].values)})
+        return {'blocks': blocks.to_dict('records')}
+
+    def rating_changes(self, sites=None, from_mod_date=None, to_mod_date=None):
+        """
+        The earliest data time of the rating changes released between the modification dates (as returned by sql.rating_changes).
+
+        Returns
+        -------
+        DataFrame
+            With site and from_date.
+        """
+        r1 = self.ratings
+        mask = np.ones(len(r1), dtype=bool)
+        if sites is not None:
+            mask &= r1['site'].isin([str(s) for s in sites]).values
+        if from_mod_date is not None:
+            mask &= (r1['rel_date'] >= pd.Timestamp(from_mod_date)).values
+        if to_mod_date is not None:
+            mask &= (r1['rel_date'] <= pd.Timestamp(to_mod_date)).values
+        return r1[mask].groupby('site', as_index=False)['from_date'].min()
+
+    ### Time series data
+
+    def series(self, site, varfrom, varto, start=None, end=None):
+        """
+        Generate the recorded data of a site and variable.
+
+        Returns
+        -------
+        DataFrame
+            With the times as the index and data and qual_code columns.
+        """
+        i = self._site_index[str(site)]
+        p = self.periods.iloc[i]
+        start1 = p['from_date'] if start is None else max(pd.Timestamp(start), p['from_date'])
+        end1 = p['to_date'] if end is None else min(pd.Timestamp(end), p['to_date'])
+        times = pd.date_range(start1.ceil(self.freq), end1, freq=self.freq)
+
+        ## Remove the gaps
+        t = times.asi8
+        keep = np.ones(len(t), dtype=bool)
+        for g in self.gaps[self.gaps['site'] == str(site)].itertuples(index=False):
+            keep &= (t < g.from_date.value) | (t > g.to_date.value)
+        times = times[keep]
+        t = times.asi8
+
+        ## Values as functions of the time (in days)
+        days = t / 86400e9
+        noise = np.modf(np.abs(np.sin(days * 12.9898 + i * 78.233)) * 43758.5453)[0]
+        if varfrom == 10:
+            values = np.where(noise > 0.9, (noise - 0.9) * 20, 0)
+        else:
+            level = self._base[i] + 0.5 * np.sin(2 * np.pi * days / 365.25 + self._phase[i]) + 0.2 * np.sin(2 * np.pi * days / 3.7) + 0.05 * noise
+            if varto in [140, 143]:
+                values = 5 * np.maximum(level - self._base[i] + 1, 0) ** 1.6
+                if varto == 143:
+                    values = values * 1000
+            else:
+                values = level
+        values = values.round(3)
+
+        ## Quality codes by day
+        day_noise = np.modf(np.abs(np.sin(np.floor(days) * 93.9898 + i * 17.233)) * 43758.5453)[0]
+        quals = self._qual_codes[np.minimum(np.searchsorted(self._qual_cum, day_noise, side='right'), len(self._qual_codes) - 1)]
+
+        return pd.DataFrame({'data': values, 'qual_code': quals}, index=times)
+
+    def traces(self, sites, start_time=0, end_time=0, varfrom=100, varto=140, interval='day', multiplier=1, data_type='mean', report_time='start', **kwargs):
+        """
+        The return of the hydllp get_ts_traces function. The recorded data is aggregated to the interval like Hydstra does.
+        """
+        start = _hydllp_time(start_time, None)
+        end = _hydllp_time(end_time, None)
+        varfrom = int(float(varfrom))
+        varto = int(float(varto))
+        var_sites = [s for s in sites if str(s) in self._site_index] if (varfrom, varto) in self.variables else []
+
+        traces = []
+        for s in var_sites:
+            df = self.series(s, varfrom, varto, start, end)
+            if (interval != 'period') and (data_type != 'point') and (interval in interval_freq):
+                freq = str(int(multiplier)) + interval_freq[interval]
+                grp = df.resample(freq)
+                df = pd.DataFrame({'data': grp['data'].agg(data_type_agg.get(data_type, 'mean')), 'qual_code': grp['qual_code'].max()}).dropna()
+                if report_time == 'end':
+                    df.index = df.index + pd.tseries.frequencies.to_offset(freq)
+            trace = pd.DataFrame({'v': np.char.mod('%.3f', df['data'].values), 't': _hydstra_time(df.index.values), 'q': df['qual_code'].values.astype(int)}).to_dict('records')
+            traces.append({'site': str(s), 'varfrom': '{:.2f}'.format(varfrom), 'varto': '{:.2f}'.format(varto), 'trace': trace})
+
+        return {'traces': traces}
+
+
+class FakeHydllp(Hydllp):
+    """
+    Hydllp object that serves a SyntheticHydstra instead of calling the hydllp.dll. The responses are encoded and decoded with the json codec like real responses, so the extraction costs are realistic.
+
+    Parameters
+    ----------
+    synthetic : SyntheticHydstra
+        The synthetic Hydstra data.
+    json_codec : str
+        The json codec (orjson, ujson, simdjson, json, or auto).
+    latency : int or float
+        Extra seconds to wait for every call to simulate the server time.
+
+    Returns
+    -------
+    FakeHydllp object
+    """
+    def __init__(self, synthetic, json_codec='auto', latency=0):
+        self._init_common(dict(synthetic=synthetic, json_codec=json_codec, latency=latency), json_codec=json_codec, server_key=(id(synthetic),))
+        self.synthetic = synthetic
+        self._latency = latency
+
+    def login(self, username=None, password=None):
+        self._logged_in = True
+
+    def logout(self):
+        self._logged_in = False
+
+    def _query_by_dict(self, request_dict):
+        """
+        Answer a request from the synthetic data.
+        """
+        syn = self.synthetic
+        fun = request_dict['function']
+        params = request_dict.get('params', {})
+
+        t1 = time.perf_counter()
+        if fun == 'get_ts_traces':
+            ret = syn.traces(params['site_list'].split(','), **{k: v for k, v in params.items() if k != 'site_list'})
+        elif fun == 'get_variable_list':
+            ret = syn.variable_list(params['site_list'].split(','), params.get('datasource', 'A'))
+        elif fun == 'get_ts_blockinfo':
+            ret = syn.blockinfo(params['site_list'].split(','), params['variables'], _hydllp_time(params['starttime'], syn.start), _hydllp_time(params['endtime'], syn.end), _hydllp_time(params['start_modified'], syn.start), _hydllp_time(params['end_modified'], syn.end))
+        elif fun == 'get_site_list':
+            ret = {'sites': list(syn.sites)}
+        else:
+            raise HydstraError('Error num:1, The function ' + str(fun) + ' is not available in the synthetic data')
+
+        request_json = self._json_dumps(request_dict)
+        response = self._json_dumps({'error_num': 0, 'return': ret})
+        if not isinstance(response, bytes):
+            response = response.encode('ascii')
+        if self._latency:
+            time.sleep(self._latency)
+        t2 = time.perf_counter()
+        result_dict = self._json_loads(memoryview(response))
+        t3 = time.perf_counter()
+
+        stats = self.call_stats
+        stats['calls'] += 1
+        stats['bytes_sent'] += len(request_json)
+        stats['bytes_received'] += len(response)
+        stats['call_time'] += t2 - t1
+        stats['decode_time'] += t3 - t2
+
+        return result_dict
+
+
+class SyntheticSqlPool(object):
+    """
+    Stand-in for the SqlPool of the Hydstra SQL database that serves a SyntheticHydstra. It answers the PERIOD table reads of sql.sql_sites_var and the rating changes of sql.rating_changes.
+
+    Parameters
+    ----------
+    synthetic : SyntheticHydstra
+        The synthetic Hydstra data.
+
+    Returns
+    -------
+    SyntheticSqlPool object
+    """
+    def __init__(self, synthetic, server='synthetic', database='hydstra'):
+        self.synthetic = synthetic
+        self.server = server
+        self.database = database
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.dispose()
+
+    def rd_sql(self, table, col_names=None, where_in=None, rename_cols=None, **kwargs):
+        """
+        Read the synthetic PERIOD table like pdsql.mssql.rd_sql.
+        """
+        if table != 'PERIOD':
+            raise ValueError('The synthetic SQL database only has the PERIOD table')
+        df = self.synthetic.period_table()
+        if isinstance(where_in, dict):
+            for col, values in where_in.items():
+                df = df[df[col].isin(values)]
+        if col_names is not None:
+            df = df[col_names]
+        if rename_cols is not None:
+            df.columns = rename_cols
+        return df.reset_index(drop=True)
+
+    def rating_changes(self, sites=None, from_mod_date=None, to_mod_date=None):
+        """
+        Answer the rating changes query like SqlPool.rating_changes.
+        """
+        return self.synthetic.rating_changes(sites, from_mod_date, to_mod_date)
+
+    def dispose(self):
+        pass
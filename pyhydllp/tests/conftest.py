@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures of the tests. The stub library (stub/hydllp_stub.c) stands in for the hydllp.dll and is compiled with the C compiler when one is available.
+"""
+import os
+import shutil
+import subprocess
+import pytest
+
+#################################################
+### Parameters
+
+stub_src = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub', 'hydllp_stub.c')
+
+################################################
+### Fixtures
+
+
+@pytest.fixture(scope='session')
+def stub_path(tmp_path_factory):
+    cc = shutil.which('cc') or shutil.which('gcc')
+    if (os.name == 'nt') or (cc is None):
+        pytest.skip('The stub library needs a C compiler on a non-Windows platform')
+    path = str(tmp_path_factory.mktemp('stub'))
+    subprocess.run([cc, '-shared', '-fPIC', '-O2', '-o', os.path.join(path, 'hydllp.so'), stub_src], check=True)
+    return path
@@ -0,0 +1,66 @@
+/*
+ * Stub of the HYDLLP library for testing and benchmarking the Hydllp wrapper without Hydstra.
+ * It exports the four HYDLLP functions used by Hydllp and SetPoints to set the number of points
+ * of the get_ts_traces style response. Build with:
+ *
+ *     cc -shared -fPIC -O2 -o hydllp.so hydllp_stub.c
+ */
+#include <string.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+static char *resp = NULL;
+static int resp_len = 0;
+static int n_points = 10;
+
+/* Build the response of n_points daily values */
+static void build(void) {
+    if (resp) return;
+    resp = malloc((size_t)n_points * 64 + 256);
+    int p = sprintf(resp, "{\"error_num\":0,\"return\":{\"traces\":[{\"site\":\"70105\",\"trace\":[");
+    for (int i = 0; i < n_points; i++) {
+        p += sprintf(resp + p, "%s{\"v\":\"%d.5\",\"t\":\"%04d%02d%02d000000\",\"q\":\"30\"}", i ? "," : "", i, 1900 + i / 336, (i / 28) % 12 + 1, i % 28 + 1);
+    }
+    p += sprintf(resp + p, "]}]}}");
+    resp_len = p;
+}
+
+void SetPoints(int n) {
+    free(resp);
+    resp = NULL;
+    n_points = n;
+}
+
+int StartUpEx(char *user, char *password, char *hyaccess, char *hyconfig, int *handle) {
+    if (strcmp(user, "bad") == 0) return 12;
+    *handle = 1;
+    return 0;
+}
+
+int ShutDown(int handle) {
+    return 0;
+}
+
+/* Code 99 fills the whole buffer without a terminating NUL */
+int DecodeError(int code, char *buf, int len) {
+    if (code == 99) {
+        memset(buf, 'x', len);
+        return 0;
+    }
+    snprintf(buf, len, "stub error %d", code);
+    return 0;
+}
+
+int JSonCall(int handle, char *request, char *buf, int len) {
+    if (strstr(request, "\"get_ts_traces\"") == NULL) {
+        snprintf(buf, len, "{\"error_num\":1,\"error_msg\":\"Unknown function\"}");
+        return 0;
+    }
+    build();
+    if (len < resp_len + 1) {
+        snprintf(buf, len, "{\"error_num\":200,\"buff_required\":%d}", resp_len + 1);
+        return 0;
+    }
+    memcpy(buf, resp, resp_len + 1);
+    return 0;
+}
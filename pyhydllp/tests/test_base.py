@@ -4,7 +4,9 @@ Created on Mon Mar 26 13:43:17 2018
 
 @author: michaelek
 """
+import pandas as pd
 from pyhydllp import hyd
+from pyhydllp.profiler import Profiler
 
 
 #################################################
@@ -43,6 +45,12 @@ def test_get_ts_blockinfo():
     assert len(b1) >= 300
 
 
+def test_get_ts_blockinfo_chunked():
+    b1 = hyd1.get_ts_blockinfo(sites=sites, from_mod_date=from_mod_date, to_mod_date=to_mod_date)
+    b2 = hyd1.get_ts_blockinfo(sites=sites, from_mod_date=from_mod_date, to_mod_date=to_mod_date, sites_chunk=1, mod_days_chunk=30, threads=2)
+    assert b2.equals(b1.drop_duplicates().reset_index(drop=True))
+
+
 def test_get_variable_list():
     v1 = hyd1.get_variable_list(sites=sites)
     assert len(v1) >= 4
@@ -53,6 +61,37 @@ def test_get_ts_data():
     assert len(tsdata) >= 400
 
 
+def test_iter_ts_data():
+    tsdata = list(hyd1.iter_ts_data(sites=sites, varfrom=100, varto=140, start=from_mod_date, end=to_mod_date, sites_chunk=1, lookahead=1))
+    assert (len(tsdata) == len(sites)) & (sum([len(t) for t in tsdata]) >= 400)
+
+
+def test_get_ts_data_profiler():
+    with Profiler() as prof:
+        hyd1.get_ts_data(sites=sites, varfrom=100, varto=140, start=from_mod_date, end=to_mod_date, sites_chunk=1, profiler=prof)
+    rep1 = prof.report()
+    trace1 = prof.chrome_trace()
+    assert (rep1.loc['get_ts_traces', 'count'] == len(sites)) & (len(trace1['traceEvents']) == len(prof.records))
+
+
+def test_get_ts_data_export(tmp_path):
+    export_path = str(tmp_path / 'ts_data.csv')
+    tsdata = hyd1.get_ts_data(sites=sites, varfrom=100, varto=140, start=from_mod_date, end=to_mod_date, sites_chunk=1, export_path=export_path, concat_data=False)
+    tsdata2 = pd.read_csv(export_path)
+    assert (tsdata is None) & (len(tsdata2) >= 400)
+
+
+def test_ts_dataset():
+    ds = hyd1.ts_dataset(sites=sites, varfrom=100, varto=140, start=from_mod_date, end=to_mod_date)
+    tsdata = ds.sel_sites(sites[:1]).sel_time(end='2018-03-01').compute()
+    assert (len(tsdata) >= 50) & (tsdata.index.get_level_values('site').nunique() == 1)
+
+
+def test_get_ts_data_multi():
+    tsdata = hyd1.get_ts_data_multi(sites=sites, var_specs=[(100, 100, 'mean'), (100, 140, 'mean'), (100, 140, 'max')], start=from_mod_date, end=to_mod_date)
+    assert (len(tsdata) >= 1200) & (tsdata.index.get_level_values('variable').nunique() == 2) & (tsdata.index.get_level_values('data_type').nunique() == 2)
+
+
 
 
 ini_path = r'\\fileservices02\ManagedShares\Data\Hydstra\prod\hyd'
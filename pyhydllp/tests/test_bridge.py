@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the hydllp bridge. The worker runs a stub backend, so the tests don't need the hydllp.dll.
+"""
+import sys
+import time
+import subprocess
+import pytest
+from pyhydllp.hydllp import HydstraError
+from pyhydllp.bridge import HydllpBridge
+from pyhydllp import hyd, hydllp
+
+#################################################
+### Parameters
+
+backend = 'pyhydllp.tests.test_bridge:StubHydllp'
+
+sites = ['70105', '69607']
+
+
+class StubHydllp(object):
+    """
+    Backend that answers get_ts_traces requests with a few daily values per site. The sites from 79000 have no quality codes.
+    """
+    def __init__(self, **kwargs):
+        self._logged_in = False
+
+    def login(self, username=None, password=None):
+        if username == 'bad':
+            raise HydstraError('Login failed. Make sure the user ID and password are correct.')
+        self._logged_in = True
+
+    def logout(self):
+        self._logged_in = False
+
+    def query_by_dict(self, request_dict):
+        if not self._logged_in:
+            raise HydstraError('Not logged in')
+        time.sleep(request_dict['params'].get('delay', 0))
+        if request_dict['function'] != 'get_ts_traces':
+            raise HydstraError('Error num:1, Unknown function')
+        sites1 = request_dict['params']['site_list'].split(',')
+        traces = []
+        for s in sites1:
+            q = '' if s >= '79000' else '30'
+            traces.append({'site': s, 'trace': [{'v': str(i * 1.5), 't': '2018010{}000000'.format(i), 'q': q} for i in range(1, 6)]})
+        return {'error_num': 0, 'return': {'traces': traces}}
+
+
+################################################
+### Tests
+
+
+def test_bridge_get_ts_traces():
+    with HydllpBridge(None, None, backend=backend) as h:
+        h.login()
+        ts1 = h.get_ts_traces(sites, start='2018-01-01', end='2018-01-05')
+        h.logout()
+    assert (len(ts1) == 10) & (ts1['data'].sum() == 45) & (h.call_stats['calls'] == 1)
+
+
+def test_bridge_errors():
+    with HydllpBridge(None, None, backend=backend) as h:
+        with pytest.raises(HydstraError):
+            h.login('bad', 'bad')
+        h.login()
+        with pytest.raises(HydstraError):
+            h.get_site_list('all')
+        ts1 = h.get_ts_traces(sites[:1])
+    assert len(ts1) == 5
+
+
+def test_bridge_new_session():
+    with HydllpBridge(None, None, backend=backend) as h:
+        h2 = h.new_session()
+        with h2:
+            assert h2._worker.pid != h._worker.pid
+
+
+def test_get_ts_data_processes():
+    sites1 = [str(70000 + i) for i in range(10)]
+    with hyd.from_hydllp(HydllpBridge(None, None, backend=backend)) as hyd1:
+        ts1 = hyd1.get_ts_data(sites1, sites_chunk=2)
+        ts2 = hyd1.get_ts_data(sites1, sites_chunk=2, processes=3)
+        ts3 = hyd1.get_ts_data(sites1 + ['79000'], sites_chunk=2)
+        ts4 = hyd1.get_ts_data(sites1 + ['79000'], sites_chunk=2, processes=3)
+    assert (len(ts2) == 50) & ts2.equals(ts1) & (ts2['qual_code'].dtype == ts1['qual_code'].dtype)
+    assert (ts4['qual_code'].isnull().sum() == 5) & ts4.equals(ts3) & (ts4['qual_code'].dtype == ts3['qual_code'].dtype)
+    assert hyd1.hydllp._worker.poll() is not None
+
+
+def test_get_ts_data_processes_segments():
+    """
+    The shared memory segments are neither leaked nor reported as leaked by the resource tracker.
+    """
+    code = '\n'.join(['from pyhydllp import hyd', 'from pyhydllp.bridge import HydllpBridge', 'with hyd.from_hydllp(HydllpBridge(None, None, backend={!r})) as hyd1:'.format(backend), '    print(len(hyd1.get_ts_data([str(70000 + i) for i in range(10)], sites_chunk=2, processes=3)))'])
+    p = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=120)
+    assert (p.returncode == 0) & (p.stdout.strip() == '50') & ('leaked' not in p.stderr) & ('resource_tracker' not in p.stderr)
+
+
+def test_bridge_raw_responses(stub_path):
+    """
+    The Hydllp backend passes the JsonCall responses of the stub library on without decoding them.
+    """
+    with HydllpBridge(stub_path, stub_path, 'hydllp.so', backend='pyhydllp.hydllp:Hydllp') as h:
+        with hydllp.openHyDb(h):
+            ts1 = h.get_ts_traces(['70105'])
+            with pytest.raises(HydstraError):
+                h.get_site_list('all')
+    assert (len(ts1) == 10) & (ts1['data'].sum() == 50) & (h.call_stats['calls'] == 1)
+
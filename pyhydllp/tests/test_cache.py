@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the time series cache. The extractions are run against the synthetic Hydstra data.
+"""
+import numpy as np
+import pandas as pd
+from pyhydllp import hyd
+from pyhydllp.cache import TsCache
+from pyhydllp.synthetic import SyntheticHydstra, FakeHydllp
+
+#################################################
+### Parameters
+
+syn = SyntheticHydstra(n_sites=10, start='2000-01-01', end='2010-01-01', freq='1h', seed=1)
+
+sites = syn.sites[:3]
+
+
+def data_frame(sites, times):
+    index = pd.MultiIndex.from_product([sites, pd.to_datetime(times)], names=['site', 'time'])
+    return pd.DataFrame({'data': np.arange(len(index), dtype='float64'), 'qual_code': 30}, index=index)
+
+
+################################################
+### Tests
+
+
+def test_cache_get_put():
+    cache = TsCache(max_entries=2)
+    key = TsCache.make_key('A', 'mean', 100, 140, 'day', 1, [30, 10], None)
+    data = data_frame(['1', '2'], pd.date_range('2018-01-01', '2018-01-10'))
+    cache.put(key, ['1', '2'], '2018-01-01', '2018-01-10', data)
+
+    assert key == TsCache.make_key('A', 'mean', 100, 140, 'day', 1, [10, 30], None)
+    assert len(cache.get(key, ['2'], '2018-01-03', '2018-01-04')) == 2
+    assert cache.get(key, ['2', '3'], '2018-01-03', '2018-01-04') is None
+    assert cache.get(key, ['2'], '2017-12-31', '2018-01-04') is None
+    assert cache.get(key, ['2'], 0, '2018-01-04') is None
+
+    fine_key = TsCache.make_key('A', 'mean', 100, 140, 'hour', 1, None, None)
+    cache.put(fine_key, ['1'], 0, 0, data_frame(['1'], pd.date_range('2018-01-01', periods=48, freq='h')))
+    month_key = TsCache.make_key('A', 'mean', 100, 140, 'month', 1, None, None)
+    assert (len(cache.get_finer(month_key, ['1'], '2018-01-01', '2018-01-01 05:00')) == 48) & (cache.get_finer(month_key, ['2'], 0, 0) is None)
+
+    ## The finer data must cover the whole months
+    cache.put(fine_key, ['2'], '2018-01-15', '2018-02-28 23:00', data_frame(['2'], pd.date_range('2018-01-15', '2018-02-28 23:00', freq='h')))
+    assert (len(cache.get_finer(month_key, ['2'], '2018-02-10', '2018-02-11')) == 28 * 24) & (cache.get_finer(month_key, ['2'], '2018-01-20', '2018-02-11') is None)
+
+    cache.put(month_key, ['1'], 0, 0, data)
+    assert cache.get(key, ['1'], '2018-01-03', '2018-01-04') is None
+    cache.clear()
+    assert cache.get(month_key, ['1'], 0, 0) is None
+
+
+def test_local_resample():
+    hyd1 = hyd.from_hydllp(FakeHydllp(syn), ts_cache=TsCache())
+    h1 = hyd1.get_ts_data(sites, start='2005-01-01', end='2005-03-31 23:00', interval='hour')
+    calls1 = hyd1.hydllp.call_stats['calls']
+    d1 = hyd1.get_ts_data(sites, start='2005-01-01', end='2005-03-01', qual_codes=[30], local_resample=True)
+    calls2 = hyd1.hydllp.call_stats['calls']
+
+    ## Compared against the aggregates of the whole days
+    hyd2 = hyd.from_hydllp(FakeHydllp(syn))
+    d2 = hyd2.get_ts_data(sites, start='2005-01-01', end='2005-03-01 23:00', qual_codes=[30])
+    assert (calls2 == calls1) & (len(h1) > 4000) & d1.index.equals(d2.index) & np.allclose(d1['data'], d2['data'], atol=0.001) & (d1['qual_code'] == 30).all()
+
+
+def test_local_resample_mid_period(tmp_path):
+    """
+    A cache that starts within a month can't make that month, so it's extracted from the server.
+    """
+    hyd1 = hyd.from_hydllp(FakeHydllp(syn), ts_cache=TsCache())
+    hyd1.get_ts_data(sites, start='2005-01-15', end='2005-03-31 23:00', interval='hour')
+    calls1 = hyd1.hydllp.call_stats['calls']
+    d1 = hyd1.get_ts_data(sites, start='2005-02-10', end='2005-03-31', interval='month', local_resample=True)
+    calls2 = hyd1.hydllp.call_stats['calls']
+    d2 = hyd1.get_ts_data(sites, start='2005-01-20', end='2005-03-31', interval='month', local_resample=True)
+    calls3 = hyd1.hydllp.call_stats['calls']
+
+    hyd2 = hyd.from_hydllp(FakeHydllp(syn))
+    d3 = hyd2.get_ts_data(sites, start='2005-02-01', end='2005-03-31 23:00', interval='month')
+    assert (calls2 == calls1) & (calls3 == calls2 + 1) & d1.index.equals(d3.index) & np.allclose(d1['data'], d3['data'], atol=0.001)
+    assert d2.equals(hyd2.get_ts_data(sites, start='2005-01-20', end='2005-03-31', interval='month'))
+
+    ## The cached data is exported with the streaming writer and not returned without concat_data
+    path = str(tmp_path / 'ts.parquet')
+    d4 = hyd1.get_ts_data(sites, start='2005-02-10', end='2005-03-31', interval='month', local_resample=True, export_path=path, concat_data=False)
+    assert (d4 is None) & (hyd1.hydllp.call_stats['calls'] == calls3) & (len(pd.read_parquet(path)) == len(d1))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the SQLite site catalog. The catalog is refreshed from the synthetic Hydstra data.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from pyhydllp import hyd, sql
+from pyhydllp.catalog import SiteCatalog
+from pyhydllp.synthetic import SyntheticHydstra, FakeHydllp, SyntheticSqlPool
+
+#################################################
+### Parameters
+
+syn = SyntheticHydstra(n_sites=10, start='2000-01-01', end='2010-01-01', freq='1h', seed=1)
+
+pool = SyntheticSqlPool(syn)
+
+hyd1 = hyd.from_hydllp(FakeHydllp(syn), sql_pool=pool)
+
+################################################
+### Tests
+
+
+def test_refresh_query(tmp_path):
+    path = str(tmp_path / 'catalog.sqlite')
+    with SiteCatalog(path) as cat:
+        assert cat.is_stale()
+        upd1 = cat.refresh(hyd1, 'synthetic', 'hydstra', pool=pool)
+        upd2 = cat.refresh(hyd1, 'synthetic', 'hydstra', pool=pool)
+        sites_var, var_periods = cat.query(varto=140, sites=syn.sites[:4])
+        assert (sorted(upd1) == syn.sites) & (upd2 == []) & (not cat.is_stale())
+        assert (len(sites_var) == 4) & (sorted(var_periods.site.unique()) == syn.sites[:4]) & (var_periods['from_date'].dtype.kind == 'M')
+
+        with ThreadPoolExecutor(4) as executor:
+            res = list(executor.map(lambda s: cat.query(sites=[s])[0], syn.sites))
+        assert [len(r) for r in res] == [len(syn.variables)] * len(syn.sites)
+
+    with SiteCatalog(path) as cat:
+        assert not cat.is_stale()
+
+
+def test_sites_var_periods(tmp_path):
+    path = str(tmp_path / 'catalog.sqlite')
+    p1 = hyd1.sites_var_periods('synthetic', 'hydstra', varto=[100, 140])
+    p2 = hyd1.sites_var_periods('synthetic', 'hydstra', varto=[100, 140], catalog=path)
+    cols = ['site', 'varfrom', 'varto']
+    assert p2.sort_values(cols).reset_index(drop=True).equals(p1.sort_values(cols).reset_index(drop=True))
+
+    with SiteCatalog(str(tmp_path / 'catalog_b.sqlite'), data_source='B') as cat:
+        with pytest.raises(ValueError):
+            hyd1.sites_var_periods('synthetic', 'hydstra', varto=[100, 140], catalog=cat)
+
+
+def test_catalog_source(tmp_path):
+    path = str(tmp_path / 'catalog.sqlite')
+    with SiteCatalog(path) as cat:
+        cat.refresh(hyd1, 'synthetic', 'hydstra', pool=pool)
+
+    ## A catalog file is tied to its data_source, server, and database
+    with pytest.raises(ValueError):
+        SiteCatalog(path, data_source='B')
+    with SiteCatalog(path) as cat:
+        with pytest.raises(ValueError):
+            cat.refresh(hyd1, 'other', 'hydstra', pool=pool)
+        upd1 = cat.refresh(hyd1, 'other', 'hydstra', pool=pool, full=True)
+        assert (sorted(upd1) == syn.sites) & (cat._get_meta('server') == 'other') & (cat._get_meta('data_source') == 'A')
+
+
+def test_get_ts_data_bulk_no_sql(tmp_path, monkeypatch):
+    """
+    With a fresh catalog and no from_mod_date, no SQL connection is opened.
+    """
+    path = str(tmp_path / 'catalog.sqlite')
+    with SiteCatalog(path) as cat:
+        cat.refresh(hyd1, 'synthetic', 'hydstra', pool=pool)
+        hyd2 = hyd.from_hydllp(FakeHydllp(syn))
+        monkeypatch.setattr(sql, 'SqlPool', lambda *args, **kwargs: pytest.fail('An SQL connection was opened'))
+        d1 = hyd2.get_ts_data_bulk('synthetic', 'hydstra', 140, sites=syn.sites[:2], from_date='2009-06-01', catalog=cat, concat_data=True, progress=lambda info: None)
+    assert (len(d1) > 0) & (sorted(d1.site.unique()) == syn.sites[:2])
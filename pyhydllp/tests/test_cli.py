@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the command line job spec and progress metrics.
+"""
+import io
+import pytest
+import sqlalchemy
+from pyhydllp import hyd, sql
+from pyhydllp.cli import read_job_spec, run_jobs, Progress
+
+#################################################
+### Parameters
+
+spec = {'hyd': {'ini_path': 'ini', 'dll_path': 'dll'},
+        'defaults': {'server': 'sql2012prod03', 'database': 'hydstra', 'from_mod_date': '2018-07-01'},
+        'jobs': [{'name': 'flow', 'varto': 140, 'export': 'flow.h5'}, {'varto': 10, 'from_mod_date': '2018-08-01'}]}
+
+################################################
+### Tests
+
+
+def test_read_job_spec():
+    hyd_kwargs, jobs = read_job_spec(spec)
+    assert (hyd_kwargs['dll_path'] == 'dll') & (jobs[0]['server'] == 'sql2012prod03') & (jobs[1]['from_mod_date'] == '2018-08-01') & (jobs[1]['name'] == 'job_1')
+
+    with pytest.raises(ValueError):
+        read_job_spec({'jobs': [{'server': 'sql2012prod03', 'database': 'hydstra', 'vartoo': 140}]})
+
+
+def test_progress():
+    stream = io.StringIO()
+    prog = Progress(stream, interval=0)
+    update = prog.job('flow')
+    update({'site': '70105', 'varto': 140, 'rows': 100, 'bytes': 2 * 1024 ** 2, 'done': 1, 'total': 2})
+    update({'site': '69607', 'varto': 140, 'rows': 0, 'bytes': 0, 'done': 2, 'total': 2})
+    m = prog.metrics()
+    assert (m['sites'] == 2) & (m['rows'] == 100) & (m['mb'] == 2) & ('flow: 2/2' in stream.getvalue())
+
+
+def test_run_jobs_h5_workers():
+    with pytest.raises(ValueError):
+        run_jobs(spec, workers=2)
+
+
+def test_run_jobs_close(stub_path, monkeypatch):
+    """
+    The hyd of each job is closed, even when the job fails.
+    """
+    closed = []
+    close = hyd.close
+    monkeypatch.setattr(hyd, 'close', lambda self: closed.append(self) or close(self))
+    from_engine = sql.SqlPool.from_engine
+    monkeypatch.setattr(sql, 'SqlPool', lambda *args, **kwargs: from_engine(sqlalchemy.create_engine('sqlite://')))
+
+    spec1 = {'hyd': {'ini_path': stub_path, 'dll_path': stub_path, 'hydllp_filename': 'hydllp.so'}, 'defaults': spec['defaults'], 'jobs': [{'varto': 140}, {'varto': 10}]}
+    summary = run_jobs(spec1, workers=2, stream=None)
+    assert (summary['status'] == 'error') & (len(closed) == 2)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the Hydllp wrapper that don't need the hydllp.dll. The ctypes calls are run against a stub library (stub/hydllp_stub.c, see the stub_path fixture in conftest.py).
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from pyhydllp import hydllp
+from pyhydllp.hydllp import Hydllp, HydstraError
+
+#################################################
+### Parameters
+
+trace_req = {'function': 'get_ts_traces', 'version': 2, 'params': {'site_list': '70105'}}
+
+
+def stub_hydllp(stub_path, **kwargs):
+    return Hydllp(stub_path, stub_path, 'hydllp.so', 'Hyaccess.ini', 'HYCONFIG.INI', **kwargs)
+
+
+################################################
+### Tests
+
+
+def test_cwd_unchanged(stub_path):
+    """
+    The working directory is never changed while the dll is loaded and called.
+    """
+    cwd = os.getcwd()
+    done = threading.Event()
+
+    def run():
+        try:
+            for i in range(50):
+                h = stub_hydllp(stub_path)
+                with hydllp.openHyDb(h):
+                    h.get_ts_traces(['70105'])
+        finally:
+            done.set()
+
+    t = threading.Thread(target=run)
+    t.start()
+    cwds = set()
+    while not done.is_set():
+        cwds.add(os.getcwd())
+    t.join()
+
+    assert cwds.union([os.getcwd()]) == set([cwd])
+
+
+def test_stub_calls(stub_path):
+    h = stub_hydllp(stub_path)
+    h._dll.SetPoints(5)
+    with pytest.raises(HydstraError):
+        h.login('bad', 'bad')
+    with hydllp.openHyDb(h):
+        ts1 = h.get_ts_traces(['70105'])
+        with pytest.raises(HydstraError):
+            h.get_site_list('all')
+    assert (len(ts1) == 5) & (ts1['data'].sum() == 12.5) & (h.call_stats['calls'] == 2)
+
+
+def test_query_raw(stub_path):
+    h = stub_hydllp(stub_path)
+    with hydllp.openHyDb(h):
+        r1 = h._query_raw(json.dumps(trace_req))
+        with pytest.raises(HydstraError):
+            h._query_raw(json.dumps({'function': 'get_site_list', 'version': 1, 'params': {}}))
+    assert isinstance(r1, bytes) & (json.loads(r1) == h.query_by_dict(trace_req))
+
+
+def test_single_flight(stub_path):
+    h1 = stub_hydllp(stub_path, single_flight=True)
+    h2 = h1.new_session()
+    h3 = stub_hydllp(stub_path, username='other', single_flight=True)
+    calls = []
+
+    ## Slow down the calls so that the requests overlap
+    for h in [h1, h2, h3]:
+        def slow(request_dict, query=h._query_by_dict):
+            time.sleep(0.5)
+            calls.append(request_dict)
+            return query(request_dict)
+        h._query_by_dict = slow
+        h.login()
+
+    with ThreadPoolExecutor(8) as executor:
+        res = list(executor.map(lambda h: h.query_by_dict(trace_req), [h1, h2] * 3 + [h3] * 2))
+
+    assert (len(calls) == 2) & all([r == res[0] for r in res]) & (len(set([id(r) for r in res])) == len(res))
+
+
+def test_resize_message(stub_path, monkeypatch, capsys):
+    """
+    The buffer resize message must not end up in stdout (e.g. in the json summary of the command line).
+    """
+    monkeypatch.setattr(hydllp, '_buffers', hydllp._BufferPool(0))
+    h = stub_hydllp(stub_path)
+    h._dll.SetPoints(500)
+    with hydllp.openHyDb(h):
+        h.get_ts_traces(['70105'])
+    captured = capsys.readouterr()
+    assert (captured.out == '') & ('More buffer was required' in captured.err)
+
+
+def test_decode_error(stub_path):
+    h = stub_hydllp(stub_path)
+    assert (h._decode_error(5) == b'stub error 5') & (h._decode_error(99) == b'x' * 1023)
+
+
+def test_buffer_pool_benchmark(stub_path, monkeypatch):
+    """
+    Large responses with and without reusing the response buffers.
+    """
+    n_calls = 200
+    h = stub_hydllp(stub_path)
+    h._dll.SetPoints(2000)
+    res = {}
+    with hydllp.openHyDb(h):
+        for name, max_free in [('fresh', 0), ('pooled', 4)]:
+            monkeypatch.setattr(hydllp, '_buffers', hydllp._BufferPool(max_free))
+            h.reset_call_stats()
+            t1 = time.perf_counter()
+            for i in range(n_calls):
+                h.query_by_dict(trace_req)
+            res[name] = (time.perf_counter() - t1) / n_calls * 1000, h.call_stats['buffer_resizes']
+
+    ## The pooled buffers skip the buffer-too-small round trip, so they should not be slower (with some slack for noisy machines)
+    assert (res['fresh'][1] == n_calls) & (res['pooled'][1] == 1) & (res['pooled'][0] < res['fresh'][0] * 1.5)
+
+
+def test_get_json_codec(monkeypatch):
+    obj = {'error_num': 0, 'return': {'v': '1.5', 't': '20180101000000'}}
+    for name in hydllp.json_codecs:
+        try:
+            name1, dumps, loads = hydllp.get_json_codec(name)
+        except ImportError:
+            continue
+        b = dumps(obj)
+        if not isinstance(b, bytes):
+            b = b.encode('ascii')
+        assert (name1 == name) & (loads(memoryview(b)) == obj)
+
+    custom = ('custom', json.dumps, lambda b: json.loads(b.tobytes()))
+    assert hydllp.get_json_codec(custom) is custom
+    with pytest.raises(ValueError):
+        hydllp.get_json_codec('yaml')
+
+    def missing():
+        raise ImportError('not installed')
+
+    for name in ['orjson', 'ujson', 'simdjson']:
+        monkeypatch.setitem(hydllp.json_codecs, name, missing)
+    assert hydllp.get_json_codec('auto')[0] == 'json'
+    with pytest.raises(ImportError):
+        hydllp.get_json_codec('orjson')
+
+
+def test_call_stats(stub_path):
+    h = stub_hydllp(stub_path, json_codec='json')
+    h._dll.SetPoints(3)
+    with hydllp.openHyDb(h):
+        h.query_by_dict(trace_req)
+        h.query_by_dict(trace_req)
+        stats = dict(h.call_stats)
+        h.reset_call_stats()
+
+    n_sent = len(json.dumps(trace_req))
+    assert (stats['codec'] == 'json') & (stats['calls'] == 2) & (stats['buffer_resizes'] == 0) & (stats['bytes_sent'] == 2 * n_sent)
+    assert (stats['bytes_received'] > 300) & (stats['call_time'] > 0) & (stats['decode_time'] > 0) & (h.call_stats['calls'] == 0)
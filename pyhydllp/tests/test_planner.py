@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the request planner. The window merging and chunking are checked directly and the extraction is run against the synthetic Hydstra data.
+"""
+import pandas as pd
+import pytest
+from pyhydllp import hyd
+from pyhydllp.planner import RequestPlanner, _floor_time, _align_window
+from pyhydllp.synthetic import SyntheticHydstra, FakeHydllp
+
+#################################################
+### Parameters
+
+syn = SyntheticHydstra(n_sites=10, start='2000-01-01', end='2010-01-01', freq='1h', seed=1)
+
+hyd1 = hyd.from_hydllp(FakeHydllp(syn))
+
+sites = syn.sites[:5]
+
+T = pd.Timestamp
+
+################################################
+### Tests
+
+
+def test_floor_time():
+    assert _floor_time(T('2018-03-05 13:20'), 'day', 1) == T('2018-03-05')
+    assert _floor_time(T('2018-03-05 13:20'), 'hour', 6) == T('2018-03-05 12:00')
+    assert _floor_time(T('2018-03-05 13:20'), 'month', 1) == T('2018-03-01')
+    assert _floor_time(T('2018-03-05 13:20'), 'month', 3) == T('2018-01-01')
+    assert _floor_time(T('2018-03-05 13:20'), 'year', 5) == T('2015-01-01')
+
+
+def test_align_window():
+    assert _align_window(T('2018-03-05 13:20'), T('2018-03-07 01:00'), 'mean', 'day', 1) == (T('2018-03-05'), T('2018-03-08'), True)
+    assert _align_window(None, T('2018-03-07 01:00'), 'tot', 'month', 1) == (None, T('2018-04-01'), True)
+    assert _align_window(T('2018-03-05 13:20'), None, 'point', 'day', 1) == (T('2018-03-05 13:20'), None, False)
+    assert _align_window(T('2018-03-05 13:20'), None, 'mean', 'period', 1) == (T('2018-03-05 13:20'), None, False)
+
+
+def test_merge_windows():
+    p = RequestPlanner(None)
+    windows = [(T('2018-01-01'), T('2018-01-10')), (T('2018-01-05'), T('2018-01-20')), (T('2018-01-21'), T('2018-01-25')), (T('2018-03-01'), T('2018-03-05')), (T('2018-03-01'), T('2018-03-05'))]
+    assert p._merge_windows(windows, 'day', 1) == [(T('2018-01-01'), T('2018-01-25')), (T('2018-03-01'), T('2018-03-05'))]
+    assert p._merge_windows(windows, 'day', 1, aligned=True) == [(T('2018-01-01'), T('2018-01-20')), (T('2018-01-21'), T('2018-01-25')), (T('2018-03-01'), T('2018-03-05'))]
+    assert p._merge_windows([(None, T('2018-01-10')), (T('2018-01-05'), None), (T('2019-01-05'), T('2019-02-01'))], 'day', 1) == [(None, None)]
+
+
+def test_plan():
+    p = RequestPlanner(None, sites_chunk=2)
+    p.add(sites, start='2005-01-01 06:00', end='2005-01-31')
+    p.add(sites[:3], start='2005-01-20', end='2005-02-28')
+    p.add(sites[:3], start='2005-01-20', end='2005-02-28')
+    p.add(sites[:1], start='2005-01-01', end='2005-01-31', data_type='max')
+    reqs = p.plan()
+    windows = sorted([(r['data_type'], r['start'], r['end'], len(r['site_list'])) for r in reqs])
+    assert windows == [('max', '2005-01-01 00:00:00', '2005-02-01 00:00:00', 1), ('mean', '2005-01-01 00:00:00', '2005-02-01 00:00:00', 2), ('mean', '2005-01-01 00:00:00', '2005-03-01 00:00:00', 1), ('mean', '2005-01-01 00:00:00', '2005-03-01 00:00:00', 2)]
+
+
+def test_run():
+    p = hyd1.ts_planner(sites_chunk=2)
+    i1 = p.add(sites, start='2005-01-01 06:00', end='2005-01-31 12:00')
+    i2 = p.add(sites[:3], start='2005-01-20', end='2005-02-28', qual_codes=[30])
+    i3 = p.add(sites[:2], start='2005-01-01', end='2005-01-10', report_time='end')
+    out = p.run()
+
+    ts1 = hyd1.get_ts_data(sites, start='2005-01-01', end='2005-02-01').sort_index()
+    ts1 = ts1[ts1.index.get_level_values('time') < T('2005-02-01')]
+    ts2 = hyd1.get_ts_data(sites[:3], start='2005-01-20', end='2005-03-01', qual_codes=[30]).sort_index()
+    ts2 = ts2[ts2.index.get_level_values('time') < T('2005-03-01')]
+    ts3 = hyd1.get_ts_data(sites[:2], start='2005-01-01', end='2005-01-11', report_time='end').sort_index()
+    ts3 = ts3[ts3.index.get_level_values('time') <= T('2005-01-11')]
+    assert out[i1].equals(ts1) & out[i2].equals(ts2) & out[i3].equals(ts3) & (len(out[i1]) == 5 * 31)
+
+
+def test_time_bounds():
+    p = RequestPlanner(hyd1)
+    p.add(sites, start=0, end=0)
+    with pytest.raises(ValueError):
+        p.add(sites, start=0, end='2005-01-31')
+    p._requests.append(dict(p._requests[0], start=None, end=T('2005-02-01')))
+    with pytest.raises(ValueError):
+        p.plan()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the record and replay of the Hydstra responses. The responses are recorded from the stub backend of the bridge tests.
+"""
+import time
+import pytest
+from pyhydllp.hydllp import HydstraError
+from pyhydllp.bridge import HydllpBridge
+from pyhydllp.replay import ReplayHydllp, read_archive
+
+#################################################
+### Parameters
+
+backend = 'pyhydllp.tests.test_bridge:StubHydllp'
+
+sites = ['70105', '69607']
+
+################################################
+### Tests
+
+
+def test_record_replay(tmp_path):
+    archive = str(tmp_path / 'responses.zip')
+
+    with HydllpBridge(None, None, backend=backend) as h:
+        h.login()
+        h.start_recording(archive)
+        ts1 = h.get_ts_traces(sites, start='2018-01-01', end='2018-01-05')
+        with pytest.raises(HydstraError):
+            h.get_site_list('all')
+        h.stop_recording()
+
+    calls = read_archive(archive)
+    assert (len(calls) == 2) & (calls[1]['error'] is not None)
+
+    r = ReplayHydllp(archive)
+    r.login()
+    ts2 = r.get_ts_traces(sites, start='2018-01-01', end='2018-01-05')
+    assert ts2.equals(ts1)
+    with pytest.raises(HydstraError):
+        r.get_site_list('all')
+    with pytest.raises(HydstraError):
+        r.get_ts_traces(sites[:1])
+
+
+def test_replay_timing(tmp_path):
+    archive = str(tmp_path / 'responses.zip')
+    req = {'function': 'get_ts_traces', 'version': 2, 'params': {'site_list': ','.join(sites), 'delay': 0.3}}
+
+    with HydllpBridge(None, None, backend=backend) as h:
+        h.login()
+        h.start_recording(archive)
+        h.query_by_dict(req)
+        h.stop_recording()
+
+    t1 = time.perf_counter()
+    ReplayHydllp(archive).query_by_dict(req)
+    t2 = time.perf_counter()
+    ReplayHydllp(archive, timing='original').query_by_dict(req)
+    t3 = time.perf_counter()
+    assert (t2 - t1 < 0.2) & (t3 - t2 >= 0.3)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the sql functions that don't need the Hydstra SQL server. The statements are run against an in-memory SQLite database or checked by a stand-in pool.
+"""
+import pandas as pd
+import sqlalchemy
+from pyhydllp import sql
+
+#################################################
+### Parameters
+
+sites = ['70105', '69607', "O'Brien"]
+
+
+class RecordingPool(sql.SqlPool):
+    """
+    SqlPool on SQLite that records the rating changes statements and the temporary table sites instead of running them.
+    """
+    def __init__(self):
+        self.engine = sqlalchemy.create_engine('sqlite://')
+        self._stmts = {}
+        self.calls = []
+
+    def read_sql(self, stmt, params=None, con=None, **kwargs):
+        temp_sites = None
+        if con is not None:
+            temp_sites = pd.read_sql(sqlalchemy.text('SELECT site FROM "{}"'.format(sql.rate_sites_tab)), con)['site'].tolist()
+        self.calls.append({'stmt': stmt, 'params': params, 'temp_sites': temp_sites})
+        return pd.DataFrame({'site': ['70105'], 'from_date': ['2018-03-01 12:30:00']})
+
+
+################################################
+### Tests
+
+
+def test_rating_changes_stmt():
+    stmt, params, temp_sites = sql._rating_changes_stmt(sites, '2018-01-01', '2018-07-01')
+    assert (temp_sites is None) & ("hed.STATION IN ('70105', '69607', 'O''Brien')" in stmt) & (sorted(params) == ['from_mod_date', 'to_mod_date'])
+
+    many_sites = [str(i) for i in range(1500)] + ['0']
+    stmt, params, temp_sites = sql._rating_changes_stmt(many_sites)
+    assert (temp_sites == many_sites[:-1]) & ('STATION IN' not in stmt) & ('INNER JOIN ' + sql.rate_sites_tab in stmt) & (params == {})
+
+
+def test_rating_changes_temp_table():
+    pool = RecordingPool()
+    many_sites = [str(i) for i in range(1500)]
+    r1 = sql.rating_changes(None, None, many_sites, from_mod_date='2018-01-01', pool=pool)
+    r2 = sql.rating_changes(None, None, sites, pool=pool)
+    assert (pool.calls[0]['temp_sites'] == many_sites) & (pool.calls[1]['temp_sites'] is None)
+    assert (r1.columns.tolist() == ['site', 'varfrom', 'varto', 'from_date']) & (r1['from_date'].iloc[0] == pd.Timestamp('2018-03-01 12:30')) & r1.equals(r2)
+
+
+def test_sql_pool():
+    engine = sqlalchemy.create_engine('sqlite://')
+    with engine.begin() as conn:
+        pd.DataFrame({'STATION': sites, 'VARIABLE': [100, 140, 10]}).to_sql('PERIOD', conn, index=False)
+
+    with sql.SqlPool.from_engine(engine) as pool:
+        stmt = 'SELECT STATION FROM PERIOD WHERE VARIABLE >= :min_var'
+        p1 = pool.read_sql(stmt, {'min_var': 100})
+        with sql.open_pool(None, None, pool=pool) as pool1:
+            p2 = pool1.read_sql(stmt, {'min_var': 140})
+        assert (pool1 is pool) & (pool.statement(stmt) is pool.statement(stmt)) & (len(pool._stmts) == 1)
+    assert (p1['STATION'].tolist() == sites[:2]) & (p2['STATION'].tolist() == ['69607'])
+
+
+def test_gaugings_chunks():
+    engine = sqlalchemy.create_engine('sqlite://')
+    g0 = pd.DataFrame({'STN': ['70105 ', '70105 ', '69607 ', '69607 ', '71106 '], 'MEAS_DATE': pd.to_datetime(['2018-01-01', '2018-02-01', '2018-01-15', '2018-03-01', '2018-01-20']), 'END_TIME': [930, 1415, 0, 800, 1200], 'M_GH': [1.1, 1.2, 0.5, 0.6, 2.0], 'FLOW': [3.1, 3.5, 0.2, 0.3, 10.0], 'QUALITY': [30, 30, 20, 30, 30], 'DATEMOD': pd.to_datetime(['2018-01-02', '2018-02-02', '2018-01-16', '2018-03-02', '2018-01-21'])})
+    with engine.begin() as conn:
+        g0.to_sql('GAUGINGS', conn, index=False)
+
+    with sql.SqlPool.from_engine(engine) as pool:
+        chunks = list(sql.gaugings_chunks(None, None, sites=['70105 ', '69607 '], from_mod_date='2018-01-10', chunksize=2, pool=pool))
+
+    g1 = pd.concat(chunks)
+    assert (len(chunks) == 2) & (len(g1) == 3) & (sorted(g1.index.get_level_values('site').unique()) == ['69607', '70105'])
+    assert (g1.loc[('70105', pd.Timestamp('2018-02-01 14:15')), 'flow'] == 3.5) & (g1.loc[('69607', pd.Timestamp('2018-01-15 12:00')), 'wl'] == 0.5)
+
+
+def test_rd_sql():
+    engine = sqlalchemy.create_engine('sqlite://')
+    with engine.begin() as conn:
+        pd.DataFrame({'STATION': sites, 'VARIABLE': [100, 140, 10]}).to_sql('PERIOD', conn, index=False)
+
+    with sql.SqlPool.from_engine(engine) as pool:
+        p1 = pool.rd_sql(table='PERIOD', col_names=['STATION', 'VARIABLE'], where_in={'VARIABLE': [100, 140]}, rename_cols=['site', 'varto'])
+    assert (p1.columns.tolist() == ['site', 'varto']) & (p1['site'].tolist() == sites[:2])
+
+
+def test_open_pool_lazy(monkeypatch):
+    created = []
+    monkeypatch.setattr(sql, 'SqlPool', lambda *args, **kwargs: created.append(args) or RecordingPool())
+    with sql.open_pool('server', 'hydstra') as pool1:
+        pass
+    with sql.open_pool('server', 'hydstra') as pool2:
+        r1 = pool2.rating_changes(sites)
+    assert (len(created) == 1) & (created[0][:2] == ('server', 'hydstra')) & (len(r1) == 1)
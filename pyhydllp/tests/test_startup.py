@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Startup time benchmark. Importing pyhydllp and accessing the hyd class should not import the heavy dependencies.
+"""
+import subprocess
+import sys
+
+#################################################
+### Parameters
+
+heavy_modules = ['pandas', 'numpy', 'pdsql', 'sqlalchemy', 'pyodbc', 'pymssql']
+
+## The max import time in seconds - generous, the package itself takes a few ms
+max_import_time = 0.5
+
+startup_code = """
+import sys, time
+t1 = time.perf_counter()
+import pyhydllp
+pyhydllp.hyd
+t2 = time.perf_counter()
+print(t2 - t1)
+print(','.join([m for m in {mods} if m in sys.modules]))
+""".format(mods=heavy_modules)
+
+################################################
+### Tests
+
+
+def test_startup():
+    out1 = subprocess.run([sys.executable, '-c', startup_code], stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.split('\n')
+    assert (out1[1] == '') & (float(out1[0]) < max_import_time)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the synthetic Hydstra data and the fake backend.
+"""
+import os
+import pandas as pd
+import pytest
+from pyhydllp import hyd
+from pyhydllp.synthetic import SyntheticHydstra, FakeHydllp, SyntheticSqlPool
+from pyhydllp.profiler import Profiler
+
+#################################################
+### Parameters
+
+syn = SyntheticHydstra(n_sites=10, start='2000-01-01', end='2010-01-01', freq='1h', seed=1)
+
+hyd1 = hyd.from_hydllp(FakeHydllp(syn))
+
+sites = syn.sites[:3]
+
+################################################
+### Tests
+
+
+def test_get_ts_data():
+    ts1 = hyd1.get_ts_data(sites, start='2005-01-01', end='2005-12-31', varfrom=100, varto=140, sites_chunk=2)
+    ts2 = hyd1.get_ts_data(sites[:1], start='2005-06-01', end='2005-07-01', varfrom=100, varto=140).iloc[:-1]
+    assert (len(ts1) > 900) & ts1.qual_code.isin([10, 20, 30]).all()
+    ts3 = ts1.loc[ts2.index]
+    assert (len(ts2) == 30) & (ts3['data'].values == ts2['data'].values).all()
+
+
+def test_inventory():
+    v1 = hyd1.get_variable_list(sites)
+    b1 = hyd1.get_ts_blockinfo(sites, from_mod_date='2000-01-01', to_mod_date='2012-01-01')
+    syn2 = SyntheticHydstra(n_sites=10, start='2000-01-01', end='2010-01-01', freq='1h', seed=1)
+    assert (len(v1) == 9) & (len(b1) > 0) & syn2.edits.equals(syn.edits) & (len(syn.period_table()) == 30)
+
+
+def test_get_ts_blockinfo_chunked():
+    b1 = hyd1.get_ts_blockinfo(sites, from_mod_date='2000-01-01', to_mod_date='2012-01-01')
+    b2 = hyd1.get_ts_blockinfo(sites, from_mod_date='2000-01-01', to_mod_date='2012-01-01', sites_chunk=1, mod_days_chunk=300, threads=2)
+    b3 = hyd1.get_ts_blockinfo(sites, from_mod_date='2012-01-01', to_mod_date='2000-01-01', mod_days_chunk=300)
+    assert b2.equals(b1.drop_duplicates().reset_index(drop=True)) & b3.empty
+
+
+def test_ts_data_changes_site_files(tmp_path):
+    from_mod_date = pd.Timestamp('2000-01-01')
+    file_times = {sites[0]: from_mod_date - pd.Timedelta(days=2), sites[1]: from_mod_date - pd.Timedelta(hours=12), syn.sites[3]: from_mod_date + pd.Timedelta(days=10)}
+    for site, t in file_times.items():
+        path = str(tmp_path / (site + '.A'))
+        open(path, 'w').close()
+        os.utime(path, (t.timestamp(), t.timestamp()))
+
+    sites1 = syn.sites[:4]
+    c1 = hyd1.ts_data_changes([100], sites1, from_mod_date='2000-01-01', to_mod_date='2012-01-01')
+    c2 = hyd1.ts_data_changes([100], sites1, from_mod_date='2000-01-01', to_mod_date='2012-01-01', site_files_path=str(tmp_path))
+    assert (sorted(c1.site) == sites1) & (sorted(c2.site) == sites1[1:])
+    assert c2.reset_index(drop=True).equals(c1[c1.site != sites[0]].reset_index(drop=True))
+
+
+def test_ts_dataset():
+    ds = hyd1.ts_dataset(sites, start='2005-01-01', end='2005-12-31', qual_codes=[20, 30], sites_chunk=2)
+    ds2 = ds.sel_qual_codes([30, 10]).sel_sites(sites[1:]).sel_time(start='2005-03-01')
+    ts1 = ds2.compute()
+    ts2 = hyd1.get_ts_data(sites[1:], start='2005-03-01', end='2005-12-31', qual_codes=[30])
+    assert (len(ds.requests()) == 2) & all([r['qual_codes'] == [30] for r in ds2.requests()]) & (ds.qual_codes == [20, 30])
+    assert (len(ts1) > 200) & (ts1.qual_code == 30).all() & ts1.equals(ts2)
+    assert ds2.sel_qual_codes([10]).compute().empty
+
+    ## HYDLLP needs both times or neither
+    with pytest.raises(ValueError):
+        hyd1.ts_dataset(sites, end='2005-12-31')
+    with pytest.raises(ValueError):
+        hyd1.ts_dataset(sites).sel_time(start='2005-03-01')
+    assert len(hyd1.ts_dataset(sites).sel_time('2005-03-01', '2005-04-01').requests()) == 1
+
+
+def test_get_ts_data_multi():
+    specs = [(100, 140, 'mean'), (100, 140, 'max'), (100, 100, 'mean'), (100, 140, 'mean')]
+    ts1 = hyd1.get_ts_data_multi(sites, specs, start='2005-01-01', end='2005-01-31', sites_chunk=2, threads=2)
+    ts2 = hyd1.get_ts_data(sites, start='2005-01-01', end='2005-01-31', data_type='max').sort_index()
+    max1 = ts1.xs((140, 'max'), level=('variable', 'data_type'))
+    assert (ts1.index.names == ['site', 'variable', 'data_type', 'time']) & (len(ts1) == 3 * 3 * 31) & max1.equals(ts2)
+    with pytest.raises(ValueError):
+        hyd1.get_ts_data_multi(sites, [(100, 140, 'mean'), (140, 140, 'mean')])
+
+
+def test_iter_ts_data():
+    ts1 = hyd1.get_ts_data(sites, start='2005-01-01', end='2005-03-01', sites_chunk=1)
+    chunks = list(hyd1.iter_ts_data(sites, start='2005-01-01', end='2005-03-01', sites_chunk=1, lookahead=1, max_bytes=1))
+    assert (len(chunks) == 3) & pd.concat(chunks).equals(ts1)
+
+    ## Stopping early must not leave the prefetch thread hanging
+    it1 = hyd1.iter_ts_data(sites, start='2005-01-01', end='2005-03-01', sites_chunk=1)
+    c1 = next(it1)
+    it1.close()
+    assert c1.equals(chunks[0])
+
+
+def test_profiler(tmp_path):
+    export_path = str(tmp_path / 'ts.csv')
+    with Profiler() as prof:
+        hyd1.get_ts_data(sites, start='2005-01-01', end='2005-03-01', sites_chunk=2, export_path=export_path, profiler=prof)
+    r1 = prof.to_frame()
+    rep1 = prof.report()
+    trace1 = prof.chrome_trace(str(tmp_path / 'trace.json'))
+    traces = r1[r1.stage == 'get_ts_traces']
+    assert (sorted(set(r1.stage)) == ['concat', 'export', 'get_ts_traces', 'login']) & (len(traces) == 2) & (traces['dll_calls'] == 1).all()
+    assert (r1['mem_peak'].notnull().all()) & (rep1.loc['get_ts_traces', 'count'] == 2) & (len(trace1['traceEvents']) == len(r1))
+
+
+def test_get_ts_data_bulk(tmp_path):
+    export_path = str(tmp_path / 'bulk.h5')
+    pool = SyntheticSqlPool(syn)
+    progress = []
+    d1 = hyd1.get_ts_data_bulk('synthetic', 'hydstra', 140, sites=sites, from_date='2009-01-01', concat_data=True, pool=pool, progress=progress.append)
+    d2 = hyd1.get_ts_data_bulk('synthetic', 'hydstra', 140, sites=sites, from_date='2009-01-01', from_mod_date='2000-01-01', to_mod_date='2012-01-01', concat_data=True, export=export_path, pool=pool, progress=progress.append)
+    d3 = pd.read_hdf(export_path, 'var_140')
+    assert (len(d1) > 0) & (sorted(d1.site.unique()) == sorted(sites)) & (d1.hydstra_code == 140).all()
+    assert (len(d2) > 0) & (len(d3) == len(d2)) & (progress[len(sites) - 1]['done'] == len(sites))
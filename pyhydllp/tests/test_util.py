@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the util functions.
+"""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from pyhydllp import util
+
+#################################################
+### Parameters
+
+file_times = {'70105.A': 1530000000, '69607.a': 1531000000, 'ABC_1.A': 1532000000, 'notes.txt': 1533000000}
+
+################################################
+### Tests
+
+
+def test_site_mod_time(tmp_path):
+    for name, mtime in file_times.items():
+        path = str(tmp_path / name)
+        open(path, 'w').close()
+        os.utime(path, (mtime, mtime))
+    snapshot_path = str(tmp_path / 'snapshot.csv')
+
+    m1 = util.site_mod_time(str(tmp_path), threads=2)
+    m2 = util.site_mod_time(str(tmp_path), sites=['70105', 'ABC/1'])
+    assert (sorted(m1.site) == ['69607', '70105', 'ABC_1']) & (sorted(m2.site) == ['70105', 'ABC_1'])
+    assert m1.set_index('site').loc['70105', 'mod_time'] == pd.Timestamp(1530000000, unit='s')
+
+    c1 = util.site_mod_time(str(tmp_path), snapshot_path=snapshot_path)
+    c2 = util.site_mod_time(str(tmp_path), snapshot_path=snapshot_path)
+    os.utime(str(tmp_path / '70105.A'), (1534000000, 1534000000))
+    c3 = util.site_mod_time(str(tmp_path), sites=['70105', '69607'], snapshot_path=snapshot_path)
+    snap1 = pd.read_csv(snapshot_path, dtype={'site': str})
+    assert (len(c1) == 3) & c2.empty & (c3.site.tolist() == ['70105']) & (sorted(snap1.site) == ['69607', '70105', 'ABC_1'])
+
+
+def test_resample_ts():
+    times = pd.date_range('2018-01-01', periods=48, freq='h')
+    index = pd.MultiIndex.from_arrays([['70105'] * 48, times], names=['site', 'time'])
+    data = pd.DataFrame({'data': np.arange(48, dtype='float64'), 'qual_code': [10] * 47 + [30]}, index=index)
+
+    d1 = util.resample_ts(data, 'day')
+    d2 = util.resample_ts(data, 'day', data_type='tot', report_time='end')
+    d3 = util.resample_ts(data.iloc[:30], 'hour', multiplier=12, data_type='max')
+    assert (d1['data'].tolist() == [11.5, 35.5]) & (d1['qual_code'].tolist() == [10, 30])
+    assert (d2.index.get_level_values('time').tolist() == [pd.Timestamp('2018-01-02'), pd.Timestamp('2018-01-03')]) & (d2['data'].tolist() == [276, 852])
+    assert d3['data'].tolist() == [11, 23, 29]
+    with pytest.raises(ValueError):
+        util.resample_ts(data, 'week')
+
+
+@pytest.mark.parametrize('ext', ['.csv', '.h5', '.parquet'])
+def test_ts_writer(tmp_path, ext):
+    path = str(tmp_path / ('data' + ext))
+    empty = pd.DataFrame({'data': [], 'qual_code': []}, index=pd.MultiIndex.from_arrays([[], []], names=['site', 'time']))
+    index1 = pd.MultiIndex.from_arrays([[70105, 70105], pd.to_datetime(['2018-01-01', '2018-01-02'])], names=['site', 'time'])
+    chunk1 = pd.DataFrame({'data': [1, 2], 'qual_code': [10, 30]}, index=index1)
+    index2 = pd.MultiIndex.from_arrays([['ABC/12345', 'ABC/12345'], ['2018-01-01', '2018-01-02']], names=['site', 'time'])
+    chunk2 = pd.DataFrame({'data': [3.5, np.nan], 'qual_code': [10, np.nan]}, index=index2)
+
+    with util.ts_writer(path, site_itemsize=12) as w:
+        w.write(empty)
+        w.write(chunk1)
+        w.write(empty)
+        w.write(chunk2)
+
+    if ext == '.csv':
+        d1 = pd.read_csv(path, dtype={'site': str}, parse_dates=['time']).set_index(['site', 'time'])
+    elif ext == '.h5':
+        d1 = pd.read_hdf(path, 'df')
+    else:
+        d1 = pd.read_parquet(path)
+    assert (w.n_rows == 4) & (d1.index.get_level_values('site').tolist() == ['70105', '70105', 'ABC/12345', 'ABC/12345'])
+    if ext != '.csv':
+        assert d1.index.get_level_values('time').dtype == 'datetime64[ns]'
+    assert (d1['data'].tolist()[:3] == [1, 2, 3.5]) & (d1['qual_code'].tolist()[:3] == [10, 30, 10]) & d1['qual_code'].isna().tolist()[3]
+
+    ## Only empty chunks still create the file
+    path2 = str(tmp_path / ('empty' + ext))
+    util.save_df(empty, path2)
+    assert os.path.isfile(path2)
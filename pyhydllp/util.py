@@ -6,6 +6,7 @@ import os
 import pandas as pd
 import numpy as np
 from re import search, IGNORECASE, findall
+from concurrent.futures import ThreadPoolExecutor
 
 
 def select_sites(x):
@@ -19,6 +20,8 @@ def select_sites(x):
         x1 = np.array(x).copy()
     elif isinstance(x, (pd.Series, pd.Index)):
         x1 = x.values.copy()
+    elif isinstance(x, pd.api.extensions.ExtensionArray):
+        x1 = np.asarray(x).copy()
     elif isinstance(x, pd.DataFrame):
         x1 = x.iloc[:, 0].values.copy()
     elif isinstance(x, str):
@@ -31,6 +34,71 @@ def select_sites(x):
     return x1
 
 
+def time_bound(t):
+    """
+    Function to convert a start or end time to a Timestamp. 0 and None (for all data) return None.
+    """
+    if (t is None) or (isinstance(t, int) and (t == 0)):
+        return None
+    return pd.Timestamp(t)
+
+
+def check_time_bounds(start, end):
+    """
+    Function to check that the start and end times (from time_bound) are either both times or both None. HYDLLP get_ts_traces needs either both times or 0 for both (all data).
+    """
+    if (start is None) != (end is None):
+        raise ValueError('start and end must either both be times or both be 0 (for all data)')
+
+
+def resample_ts(data, interval, multiplier=1, data_type='mean', report_time=None):
+    """
+    Function to resample time series data (from get_ts_data) to a coarser interval. The times of the input data must be the start of their periods. The quality code of each resampled value is the max of the aggregated values.
+
+    Parameters
+    ----------
+    data : DataFrame
+        In long format with site and time as a MultiIndex and data and qual_code as columns.
+    interval : str
+        The frequency of the output data (year, month, day, hour, minute, or second).
+    multiplier : int
+        interval frequency.
+    data_type : str
+        mean, tot, max, min, first, or last. The mean is the mean of the input values, so it only equals the Hydstra time weighted mean when the input is regular (e.g. daily means).
+    report_time : start, end, or None
+        Should the time of the output be the start or end of the period?
+
+    Returns
+    -------
+    DataFrame
+        In long format with site and time as a MultiIndex.
+    """
+    freq_codes = {'year': 'YS', 'month': 'MS', 'day': 'D', 'hour': 'h', 'minute': 'min', 'second': 's'}
+    agg_funs = {'mean': 'mean', 'tot': 'sum', 'max': 'max', 'min': 'min', 'first': 'first', 'last': 'last'}
+
+    if interval not in freq_codes:
+        raise ValueError('interval must be one of ' + ', '.join(freq_codes))
+    if data_type not in agg_funs:
+        raise ValueError('data_type must be one of ' + ', '.join(agg_funs))
+
+    if data.empty:
+        return data
+
+    freq = str(multiplier) + freq_codes[interval]
+    grp = data.groupby([pd.Grouper(level='site'), pd.Grouper(level='time', freq=freq)])
+    data1 = grp['data'].agg(agg_funs[data_type])
+    count1 = grp['data'].count()
+    qual1 = grp['qual_code'].max()
+
+    out1 = pd.DataFrame({'data': data1, 'qual_code': qual1})[(count1 > 0).values]
+    if report_time == 'end':
+        out1 = out1.reset_index()
+        out1['time'] = out1['time'] + pd.tseries.frequencies.to_offset(freq)
+        out1 = out1.set_index(['site', 'time'])
+
+    return out1
+
+
 def rd_dir(data_dir, ext, file_num_names=False, ignore_case=True):
     """
     Function to read a directory of files and create a list of files associated with a spcific file extension. Can also create a list of file numbers from within the file list (e.g. if each file is a station number.)
@@ -50,22 +118,153 @@ def rd_dir(data_dir, ext, file_num_names=False, ignore_case=True):
 
 def save_df(df, path_str, index=True, header=True):
     """
-    Function to save a dataframe based on the path_str extension. The path_str must  either end in csv or h5.
+    Function to save a dataframe based on the path_str extension. The path_str must end in csv, h5, or parquet.
 
     df -- Pandas DataFrame.\n
     path_str -- File path (str).\n
     index -- Should the row index be saved? Only necessary for csv.
     """
+    with ts_writer(path_str, index=index, header=header) as w:
+        w.write(df)
+
+
+class _TsWriter(object):
+    """
+    Base class of the streaming writers. The first non-empty chunk written defines the columns and dtypes and the later chunks are cast to them. Empty chunks before it are skipped (the last one is only written on close if no data came at all). The values are stored as float64, the quality codes as nullable int16, the sites as str, and the times as datetime64[ns].
+    """
+    ## The dtype of the quality codes. Nullable, since missing values have no quality code.
+    qual_code_dtype = 'Int16'
+
+    def __init__(self, path_str, index=True, header=True, site_itemsize=None):
+        self.path_str = path_str
+        self.index = index
+        self.header = header
+        self.site_itemsize = site_itemsize
+        self.n_rows = 0
+        self._dtypes = None
+        self._started = False
+        self._empty = None
+
+    def _normalise(self, df):
+        df = df.astype({c: t for c, t in [('data', 'float64'), ('qual_code', self.qual_code_dtype)] if c in df.columns})
+        if 'time' in df.columns:
+            df['time'] = pd.to_datetime(df['time']).astype('datetime64[ns]')
+        if 'site' in df.columns:
+            df['site'] = df['site'].astype(str)
+        if isinstance(df.index, pd.MultiIndex):
+            levels = {n: i for i, n in enumerate(df.index.names)}
+            if 'time' in levels:
+                df.index = df.index.set_levels(pd.to_datetime(df.index.levels[levels['time']]).astype('datetime64[ns]'), level='time')
+            if 'site' in levels:
+                df.index = df.index.set_levels(df.index.levels[levels['site']].astype(str), level='site')
+        elif df.index.name == 'time':
+            df.index = pd.DatetimeIndex(df.index).astype('datetime64[ns]')
+        elif df.index.name == 'site':
+            df.index = df.index.astype(str)
+        if self._dtypes is None:
+            self._dtypes = df.dtypes.to_dict()
+        else:
+            df = df.astype(self._dtypes)
+        return df
+
+    def write(self, df):
+        """
+        Append a chunk of data to the file.
+        """
+        if df.empty:
+            if not self._started:
+                self._empty = df
+            return
+        self._write(df)
+
+    def _write(self, df):
+        df = self._normalise(df)
+        self._append(df)
+        self._started = True
+        self.n_rows += len(df)
+
+    def close(self):
+        if (not self._started) and (self._empty is not None):
+            self._write(self._empty)
+            self._empty = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _CsvWriter(_TsWriter):
+    def _append(self, df):
+        df.to_csv(self.path_str, mode='a' if self._started else 'w', index=self.index, header=self.header and not self._started)
+
+
+class _HdfWriter(_TsWriter):
+    ## PyTables can't store the nullable ints, but float32 holds the quality codes exactly and keeps the NaNs
+    qual_code_dtype = 'float32'
+
+    def _append(self, df):
+        min_itemsize = None
+        if (not self._started) and (('site' in df.columns) or ('site' in df.index.names)):
+            ## The max number of characters of the site names is fixed by the first chunk
+            if self.site_itemsize is None:
+                sites = df['site'] if 'site' in df.columns else df.index.get_level_values('site')
+                self.site_itemsize = max(int(sites.str.len().max()) if len(sites) else 0, 1)
+            min_itemsize = {'site': self.site_itemsize}
+        df.to_hdf(self.path_str, key='df', mode='a' if self._started else 'w', format='table', append=self._started, min_itemsize=min_itemsize)
+
+
+class _ParquetWriter(_TsWriter):
+    def __init__(self, path_str, index=True, header=True, site_itemsize=None):
+        super(_ParquetWriter, self).__init__(path_str, index, header, site_itemsize)
+        self._writer = None
+
+    def _append(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=self.index)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path_str, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        super(_ParquetWriter, self).close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+ts_writers = {'.csv': _CsvWriter, '.h5': _HdfWriter, '.parquet': _ParquetWriter}
+
+
+def ts_writer(path_str, index=True, header=True, site_itemsize=None):
+    """
+    Function to create a streaming writer based on the path_str extension (csv, h5, or parquet). Chunks of data are appended to the file with the write method as they are extracted, so the whole dataset never needs to be in memory. Use it as a context manager or call close when done. HDF5 needs pytables and parquet needs pyarrow.
 
-    path1 = os.path.splitext(os.path_str)
+    Parameters
+    ----------
+    path_str : str
+        File path.
+    index : bool
+        Should the row index be saved?
+    header : bool
+        Should the column names be saved? Only for csv.
+    site_itemsize : int or None
+        The max number of characters of the site names. Only for h5. None uses the longest site name of the first non-empty chunk.
 
-    if path1[1] in '.h5':
-        df.to_hdf(path_str, 'df', mode='w')
-    if path1[1] in '.csv':
-        df.to_csv(path_str, index=index, header=header)
+    Returns
+    -------
+    Writer object
+    """
+    ext = os.path.splitext(path_str)[1].lower()
+    if ext not in ts_writers:
+        raise ValueError('path_str must end in ' + ', '.join(ts_writers))
+    return ts_writers[ext](path_str, index=index, header=header, site_itemsize=site_itemsize)
 
 
-def site_mod_time(site_files_path, sites=None):
+def site_mod_time(site_files_path, sites=None, threads=1, snapshot_path=None):
     """
     Function to extract modification times from Hydstra data archive files. Returns a DataFrame of sites by modification date. The modification date is in GMT.
 
@@ -75,22 +274,49 @@ def site_mod_time(site_files_path, sites=None):
         Path to the Hydstra ts data files. Something like r'\\fileservices02\ManagedShares\Data\Hydstra\prod\hyd\dat\hyd'.
     sites : list, array, Series, or None
         If sites is not None, then return only the given sites.
+    threads : int
+        Number of threads to get the file stats in. On Windows the stats come with the directory listing, so this mostly helps other platforms on network shares.
+    snapshot_path : str or None
+        Path to a csv file with the modification times of a previous run. If given, only the sites that are new or have changed modification times since the snapshot are returned and the snapshot file is updated.
 
     Returns
     -------
     DataFrame
     """
-    files1 = rd_dir(site_files_path, 'A')
-    file_sites = [os.path.splitext(i)[0] for i in files1]
+    with os.scandir(site_files_path) as it:
+        entries = [e for e in it if e.name.lower().endswith('.a')]
 
     if sites is not None:
         sites1 = select_sites(sites).astype(str)
-        sites2 = [i.replace('/', '_') for i in sites1]
-        file_sites1 = [i for i in file_sites if i in sites2]
+        sites2 = set([i.replace('/', '_') for i in sites1])
+        entries = [e for e in entries if os.path.splitext(e.name)[0] in sites2]
+
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            mtimes = list(executor.map(lambda e: e.stat().st_mtime, entries))
     else:
-        file_sites1 = file_sites
+        mtimes = [e.stat().st_mtime for e in entries]
+
+    file_sites = [os.path.splitext(e.name)[0] for e in entries]
+    mod_times = pd.to_datetime(np.round(np.array(mtimes, dtype='float64')).astype('int64'), unit='s')
+
+    df = pd.DataFrame({'site': file_sites, 'mod_time': mod_times})
 
-    mod_times = pd.to_datetime([round(os.path.getmtime(os.path.join(site_files_path, i + '.A'))) for i in file_sites1], unit='s')
+    ### Compare to the snapshot - optional
+    if isinstance(snapshot_path, str):
+        if os.path.isfile(snapshot_path):
+            snap0 = pd.read_csv(snapshot_path, dtype={'site': str}, parse_dates=['mod_time'])
+            if sites is not None:
+                old1 = snap0[~snap0.site.isin(file_sites)]
+            else:
+                old1 = snap0.iloc[:0]
+            comp1 = pd.merge(df, snap0, on='site', how='left', suffixes=('', '_old'))
+            chg1 = df[(comp1['mod_time'] != comp1['mod_time_old']).values]
+            snap1 = pd.concat([old1, df])
+        else:
+            chg1 = df
+            snap1 = df
+        snap1.to_csv(snapshot_path, index=False)
+        df = chg1.reset_index(drop=True)
 
-    df = pd.DataFrame({'site': file_sites1, 'mod_time': mod_times})
     return df
@@ -18,7 +18,8 @@ version = '1.1.5'
 if os.environ.get('READTHEDOCS', False) == 'True':
     INSTALL_REQUIRES = []
 else:
-    INSTALL_REQUIRES = ['pandas']
+    # SqlPool uses the engine API shared by SQLAlchemy 1.4 and 2.x (the tests run on 2.x)
+    INSTALL_REQUIRES = ['pandas', 'sqlalchemy>=1.4']
 
 # Get the long description from the README file
 with open(os.path.join(here, 'README.rst'), encoding='utf-8') as f:
@@ -182,5 +183,10 @@ setup(
     #        'sample=sample.command_line:t3',
     #    ],
     # },
+    entry_points={
+        'console_scripts': [
+            'pyhydllp=pyhydllp.cli:main',
+        ],
+    },
     license='Apache',
 )